@@ -1,2 +1,30 @@
 from __future__ import absolute_import
-from .alooma import *
+import sys
+
+if sys.version_info >= (3, 7):
+    import importlib
+    import os
+
+    _PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+    # the Client module (and requests and numpy with it) is imported on
+    # first use, so the command line starts fast (PEP 562)
+    def __getattr__(name):
+        # submodules not imported yet, e.g. `alooma.alooma` or
+        # `from . import <submodule>`
+        if os.path.exists(os.path.join(_PACKAGE_DIR, name + '.py')):
+            return importlib.import_module('.' + name, __name__)
+        client_module = importlib.import_module('.alooma', __name__)
+        if name == '__all__':
+            return [key for key in vars(client_module)
+                    if not key.startswith('_')]
+        try:
+            return getattr(client_module, name)
+        except AttributeError:
+            raise AttributeError("module 'alooma' has no attribute '{name}'"
+                                 .format(name=name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(__getattr__('__all__')))
+else:
+    from .alooma import *
@@ -2,9 +2,27 @@ import json
 import time
 import re
 import requests
+import threading
 import warnings
 from six.moves import urllib
 
+from . import models, table_sync
+from .capabilities import (DEFAULT_CAPABILITIES_TTL,
+                           FLAG_BIGQUERY_NEW_CONNECT_CONFIGURATION,
+                           SCHEMAS_MIN_VERSION, CapabilityCache)
+from .catalog import DEFAULT_CATALOG_TTL, TableCatalog
+from .coalesce import DEFAULT_CACHE_WINDOW, RequestCoalescer
+from .conditional import NOT_MODIFIED, ConditionalCache
+from .event_types import (DEFAULT_EVENT_TYPE_TTL, DEFAULT_MAX_EVENT_TYPES,
+                          EventTypeCatalog)
+from .concurrency import DEFAULT_MAX_WORKERS
+from .metrics import (MetricsSnapshot, OUTPUTS_METRICS, SNAPSHOT_METRICS,
+                      series_from_response)
+from .notifications import (DEFAULT_MAX_POLL_INTERVAL,
+                            DEFAULT_MIN_POLL_INTERVAL, stream_notifications)
+from .tracing import (NOOP_TRACER, SPAN_HTTP, SPAN_LOGIN, SPAN_RETRY,
+                      SPAN_SLEEP, instrument)
+
 MAPPING_MODES = ['AUTO_MAP', 'STRICT', 'FLEXIBLE']
 EVENT_DROPPING_TRANSFORM_CODE = "def transform(event):\n\treturn None"
 DEFAULT_TRANSFORM_CODE = "def transform(event):\n\treturn event"
@@ -59,6 +77,8 @@ DEFAULT_TIMEOUT = 60
 
 MAPPING_TIMEOUT = 300
 
+DEFAULT_TOPOLOGY_TTL = 600
+
 BASE_URL = 'https://app.alooma.com'
 
 
@@ -66,10 +86,70 @@ class FailedToCreateInputException(Exception):
     pass
 
 
+class FailedRestCallException(Exception):
+    def __init__(self, message, status_code=None):
+        """
+        :param status_code: the HTTP status of the failed call
+        """
+        super(FailedRestCallException, self).__init__(message)
+        self.status_code = status_code
+
+
 class Client(object):
     def __init__(self, username=None, password=None, account_name=None,
-                 base_url=None):
-
+                 base_url=None, session=None, tracer=None,
+                 rate_limiter=None, coalesce_gets=True,
+                 get_cache_window=DEFAULT_CACHE_WINDOW, conditional_gets=True,
+                 reuse_unchanged_results=False,
+                 capabilities_ttl=DEFAULT_CAPABILITIES_TTL,
+                 topology_ttl=DEFAULT_TOPOLOGY_TTL):
+        """
+        A Client may be shared by many threads. When the session expires,
+        a single thread logs in again while the others wait for it
+        :param username: the Alooma user
+        :param password: the user's password
+        :param account_name: optional account to log into, when the user
+                             has more than one
+        :param base_url: optional Alooma URL, defaults to BASE_URL
+        :param session: optional requests.Session to send the requests
+                        with, e.g. to share a connection pool between
+                        clients (see alooma.fleet), or to record and
+                        replay the traffic (see alooma.transport).
+                        Defaults to a new session
+        :param tracer: optional alooma.tracing tracer, e.g. a
+                       RecordingTracer or an OpenTelemetryTracer. Every
+                       public method call then opens a span, with the HTTP
+                       requests, retries, logins and sleeps as child spans
+        :param rate_limiter: optional alooma.ratelimit.RateLimiter bounding
+                             the request rate and the requests in flight,
+                             which slows down and retries on 429 / 503
+        :param coalesce_gets: if True, identical GET requests made by
+                              several threads at the same time share one
+                              network request and response
+        :param get_cache_window: seconds a GET response is also reused for
+                                 after it arrived, until the next request
+                                 changing the system. 0 disables it
+        :param conditional_gets: if True, get_config, get_structure,
+                                 get_tables, get_table_names,
+                                 get_event_types and get_all_transforms
+                                 send the ETag / Last-Modified of their
+                                 previous response, and use it again on
+                                 304 Not Modified
+        :param reuse_unchanged_results: if True, those methods return the
+                                        very same object as their previous
+                                        call when the content did not
+                                        change (by validators or content
+                                        hash), so callers can skip
+                                        processing it again with an `is`
+                                        check. Such results are shared and
+                                        must not be modified
+        :param capabilities_ttl: seconds the deployment info and feature
+                                 flags are cached for, see
+                                 get_capabilities
+        :param topology_ttl: seconds the topology (the structure without
+                             stats) is cached for, see get_topology. Any
+                             request changing the system drops it
+        """
         if base_url is None:
             base_url = BASE_URL
         # for backwards compatibility (alooma_dev.py)
@@ -83,56 +163,180 @@ class Client(object):
 
         self.username = username
         self.password = password
+        self.session = session if session is not None \
+            else requests.Session()
         self.cookie = None
         self.requests_params = {
             'timeout': DEFAULT_TIMEOUT,
             'cookies': self.cookie
         }
+        # incremented by every login, so a thread which got a 401 can tell
+        # whether another thread already logged in since its request
+        self._login_generation = 0
+        self._login_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._table_catalog = None
+        self._event_type_catalog = None
+        self._capabilities = CapabilityCache(self, capabilities_ttl)
+        self.topology_ttl = topology_ttl
+        # (fetch time, JSON content), each caller parses its own copy
+        self._topology = None
+        self._topology_epoch = 0
+        self.tracer = tracer or NOOP_TRACER
+        self.rate_limiter = rate_limiter
+        self._coalescer = RequestCoalescer(get_cache_window) \
+            if coalesce_gets else None
+        self._conditional_cache = ConditionalCache() \
+            if conditional_gets else None
+        self.reuse_unchanged_results = reuse_unchanged_results
+        if self.tracer.enabled:
+            instrument(self, self.tracer)
         self.account_name = self.__get_account_name()
 
+    def __request(self, func, url, **kwargs):
+        if self.rate_limiter is None:
+            return self.__traced_request(func, url, **kwargs)
+        method = func.__name__.upper()
+        attempt = 0
+        while True:
+            with self.rate_limiter.limit(method, url):
+                response = self.__traced_request(func, url, **kwargs)
+            self.rate_limiter.update(method, url, response)
+            if not self.rate_limiter.should_retry(method, response, attempt):
+                return response
+            attempt += 1
+
+    def __traced_request(self, func, url, **kwargs):
+        if not self.tracer.enabled:
+            return func(url, **kwargs)
+        attributes = {'http.method': func.__name__.upper(), 'http.url': url}
+        with self.tracer.span(SPAN_HTTP, attributes) as span:
+            response = func(url, **kwargs)
+            span.set_attribute('http.status_code', response.status_code)
+            return response
+
+    def __sleep(self, seconds):
+        with self.tracer.span(SPAN_SLEEP, {'seconds': seconds}):
+            time.sleep(seconds)
+
     def __send_request(self, func, url, is_recheck=False, **kwargs):
+        if func == self.session.get:
+            return self.__send_coalesced_request(func, url, is_recheck,
+                                                 **kwargs)
+        try:
+            return self.__send_coalesced_request(func, url, is_recheck,
+                                                 **kwargs)
+        finally:
+            self.__invalidate_caches()
+
+    def __invalidate_caches(self):
+        """
+        Drops the responses cached by the client, after a request which
+        may have changed the system
+        """
+        if self._coalescer is not None:
+            self._coalescer.invalidate()
+        # any change may add, remove or rewire nodes
+        with self._lock:
+            self._topology = None
+            self._topology_epoch += 1
+
+    def __send_coalesced_request(self, func, url, is_recheck=False,
+                                 **kwargs):
+        if self._coalescer is None or is_recheck:
+            return self.__send_single_request(func, url, is_recheck,
+                                              **kwargs)
+        if func == self.session.get and set(kwargs) <= set(['headers']):
+            # the response is shared, its content is parsed by every caller
+            # since some of them change the parsed result (see get_mapping)
+            key = (url, tuple(sorted((kwargs.get('headers') or {}).items())))
+            return self._coalescer.call(
+                key, lambda: self.__send_single_request(func, url, **kwargs))
+        try:
+            return self.__send_single_request(func, url, **kwargs)
+        finally:
+            self._coalescer.invalidate()
+
+    def __send_single_request(self, func, url, is_recheck=False, **kwargs):
+        generation = self._login_generation
         params = self.requests_params.copy()
         params.update(kwargs)
-        response = func(url, **params)
+        response = self.__request(func, url, **params)
 
-        if response_is_ok(response):
+        if response_is_ok(response) or (response.status_code == NOT_MODIFIED
+                                        and 'headers' in kwargs):
             return response
 
         if response.status_code == 401 and not is_recheck:
-            self.__login()
-
-            return self.__send_request(func, url, True, **kwargs)
-
-        raise Exception("The rest call to {url} failed\n"
-                        "failure reason: {failure_reason}"
-                        "{failure_content}"
-                        .format(url=response.url,
-                                failure_reason=response.reason,
-                                failure_content="\nfailure content: " +
-                                                response.content.decode()
-                                if response.content.decode() else ""))
+            with self.tracer.span(SPAN_RETRY, {'http.url': url}):
+                self.__relogin(generation)
+
+                return self.__send_request(func, url, True, **kwargs)
+
+        raise FailedRestCallException(
+            "The rest call to {url} failed\n"
+            "failure reason: {failure_reason}"
+            "{failure_content}"
+            .format(url=response.url,
+                    failure_reason=response.reason,
+                    failure_content="\nfailure content: " +
+                                    response.content.decode()
+                    if response.content.decode() else ""),
+            response.status_code)
 
     def __login(self):
         url = self.rest_url + 'login'
         login_data = {"email": self.username, "password": self.password}
-        response = requests.post(url, json=login_data)
+        with self.tracer.span(SPAN_LOGIN):
+            response = self.__request(self.session.post, url,
+                                      json=login_data)
         if response.status_code == 200:
             self.cookie = response.cookies
-            self.requests_params['cookies'] = self.cookie
+            # replaced rather than updated, other threads may be copying it
+            self.requests_params = dict(self.requests_params,
+                                        cookies=self.cookie)
+            self._login_generation += 1
         else:
             raise Exception('Failed logging in with user: {}'
                             .format(self.username))
 
+    def __relogin(self, generation):
+        """
+        Logs in again, unless another thread did since the given login
+        generation. Only one login runs at a time
+        """
+        with self._login_lock:
+            if self._login_generation == generation:
+                self.__login()
+
+    def __get_json(self, url):
+        """
+        GETs a JSON resource, conditionally if conditional_gets is set
+        """
+        if self._conditional_cache is None:
+            return parse_response_to_json(
+                self.__send_request(self.session.get, url))
+        headers = self._conditional_cache.validators(url)
+        if headers:
+            response = self.__send_request(self.session.get, url,
+                                           headers=headers)
+        else:
+            response = self.__send_request(self.session.get, url)
+        resource, _ = self._conditional_cache.update(url, response)
+        if self.reuse_unchanged_results:
+            return resource.parsed()
+        return resource.parse()
+
     def __get_account_name(self):
         url = self.rest_url + 'repository'
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
         return res.json().get('config_clientName')
 
     def add_user(self, email):
         post_data = {
             'email': email
         }
-        res = self.__send_request(requests.post, self.rest_url + 'user', json=post_data)
+        res = self.__send_request(self.session.post, self.rest_url + 'user', json=post_data)
         return res
 
 
@@ -140,12 +344,11 @@ class Client(object):
         """
         Exports the entire system configuration in dict format.
         This is also used periodically by Alooma for backup purposes,
+        see alooma.backup.ConfigBackupStore for incremental backups
         :return: a dict representation of the system configuration
         """
         url_get = self.rest_url + 'config/export'
-        response = self.__send_request(requests.get, url=url_get)
-        config_export = parse_response_to_json(response)
-        return config_export
+        return self.__get_json(url_get)
 
     def get_plumbing(self):
         """
@@ -163,8 +366,51 @@ class Client(object):
         :return: A dict representing the structure of the system
         """
         url_get = self.rest_url + 'plumbing/?resolution=1min'
-        response = self.__send_request(requests.get, url_get)
-        return parse_response_to_json(response)
+        return self.__get_json(url_get)
+
+    def get_topology(self, refresh=False):
+        """
+        Returns the structure of the system without the nodes' stats, for
+        lookups of inputs, outputs and processors. It is cached for
+        topology_ttl seconds, and dropped by any request changing the
+        system, so changes made by others may take that long to show
+        :param refresh: fetch it again even if cached
+        :return: A dict representing the structure of the system, with no
+                 'stats' in the nodes
+        """
+        with self._lock:
+            cached = self._topology
+            epoch = self._topology_epoch
+        if not refresh and cached is not None and \
+                time.time() - cached[0] <= self.topology_ttl:
+            return json.loads(cached[1])
+
+        response = self.__send_request(self.session.get,
+                                       self.rest_url + 'plumbing/')
+        content = response.content
+        topology = parse_response_to_json(response)
+        nodes = topology.get('nodes') or []
+        if any('stats' in node for node in nodes):
+            for node in nodes:
+                node.pop('stats', None)
+            content = json.dumps(topology)
+        with self._lock:
+            # a change made while fetching may be missing from it
+            if epoch == self._topology_epoch:
+                self._topology = (time.time(), content)
+        return topology
+
+    def get_node_stats(self, resolution=1):
+        """
+        Fetches the current stats of every node, e.g. throughput and
+        queue sizes
+        :param resolution: the resolution in minutes of the stats
+        :return: a dict from node id to the node's stats
+        """
+        url = self.rest_url + 'plumbing/?resolution=%dmin' % resolution
+        structure = self.__get_json(url)
+        return {node['id']: node.get('stats')
+                for node in structure.get('nodes') or []}
 
     def get_mapping_mode(self):
         """
@@ -173,7 +419,7 @@ class Client(object):
         alooma.MAPPING_MODES
         """
         url = self.rest_url + 'mapping-mode'
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
         return res.content
 
     def set_mapping_mode(self, mode):
@@ -182,7 +428,12 @@ class Client(object):
         mode should be one of the values in alooma.MAPPING_MODES
         """
         url = self.rest_url + 'mapping-mode'
-        res = requests.post(url, json=mode, **self.requests_params)
+        try:
+            # the response is returned as is, even if it failed
+            res = self.__request(self.session.post, url, json=mode,
+                                 **self.requests_params)
+        finally:
+            self.__invalidate_caches()
         return res
 
     def get_event_types(self):
@@ -191,8 +442,7 @@ class Client(object):
         exist in the system
         """
         url = self.rest_url + 'event-types'
-        res = self.__send_request(requests.get, url)
-        return parse_response_to_json(res)
+        return self.__get_json(url)
 
     def get_event_type(self, event_type):
         """
@@ -204,7 +454,7 @@ class Client(object):
         event_type = urllib.parse.quote(event_type, safe='')
         url = self.rest_url + 'event-types/' + event_type
 
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
         return parse_response_to_json(res)
 
     def get_mapping(self, event_type):
@@ -218,6 +468,24 @@ class Client(object):
         mapping = remove_stats(event_type)
         return mapping
 
+    def get_event_type_catalog(self, ttl=DEFAULT_EVENT_TYPE_TTL,
+                               max_size=DEFAULT_MAX_EVENT_TYPES):
+        """
+        Returns the client's alooma.event_types.EventTypeCatalog, which
+        lists event type names and downloads each event type only on its
+        first access, keeping it in an LRU with a TTL. It is kept up to
+        date by set_mapping, discard_event_type and delete_event_type
+        :param ttl: seconds an event type is kept, used when the catalog
+                    is first created
+        :param max_size: the max number of event types kept, used when
+                         the catalog is first created
+        """
+        with self._lock:
+            if self._event_type_catalog is None:
+                self._event_type_catalog = EventTypeCatalog(self, ttl,
+                                                            max_size)
+            return self._event_type_catalog
+
     def get_schemas(self):
         """
         Returns a dict representation of the redshift schema,
@@ -225,9 +493,15 @@ class Client(object):
 
         :return: A dict representation of the redshift schema
         """
+        capabilities = self._capabilities.get()
+        if capabilities.supports_schemas is False:
+            raise Exception("Schemas are supported from version {min} on, "
+                            "the server runs {version}"
+                            .format(min=SCHEMAS_MIN_VERSION,
+                                    version=capabilities.version_string))
         url = self.rest_url + "schemas/"
 
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
         return parse_response_to_json(res)
 
     def create_s3_input(self, name, key, secret, bucket, prefix='',
@@ -300,7 +574,8 @@ class Client(object):
                                  one_click=one_click)
 
     def create_input(self, input_post_data, one_click=True, validate=True):
-        structure = self.get_structure()
+        # fresh, the new input is found by comparing with this count
+        structure = self.get_topology(refresh=True)
         previous_nodes = [x for x in structure['nodes']
                           if x['name'] == input_post_data['name']]
         if one_click:
@@ -311,13 +586,13 @@ class Client(object):
         else:
             url = self.rest_url + 'plumbing/inputs'
 
-        self.__send_request(requests.post, url, json=input_post_data)
+        self.__send_request(self.session.post, url, json=input_post_data)
 
         new_id = None
         retries_left = 10
         while retries_left > 0:
             retries_left -= 1
-            structure = self.get_structure()
+            structure = self.get_topology(refresh=True)
             input_type_nodes = [x for x in structure['nodes'] if x['name'] ==
                                 input_post_data["name"]]
             if len(input_type_nodes) == len(previous_nodes) + 1:
@@ -329,25 +604,30 @@ class Client(object):
                     pass
 
                 return new_id
-            time.sleep(1)
+            self.__sleep(1)
 
         raise FailedToCreateInputException(
             'Failed to create {type} input'.format(
                 type=input_post_data["type"]))
 
     def edit_input(self, input_post_data):
+        """
+        :param input_post_data: the input's node, a dict or an
+                                alooma.models.Node
+        """
+        input_post_data = models.to_dict(input_post_data)
         input_id = input_post_data.get('id')
         if not input_id:
             raise Exception('Could not edit input without id')
 
         url = self.rest_url + ('inputs/%s' % input_id)
-        res = self.__send_request(requests.put, url, json=input_post_data)
+        res = self.__send_request(self.session.put, url, json=input_post_data)
         return res
 
     def create_schema(self, schema_post_data):
         url = self.rest_url + "schemas"
 
-        res = self.__send_request(requests.post, url, json=schema_post_data)
+        res = self.__send_request(self.session.post, url, json=schema_post_data)
         return res
 
     def get_transform_node_id(self):
@@ -367,7 +647,7 @@ class Client(object):
         """
         url = "{rest_url}plumbing/nodes/remove/{input_id}".format(
             rest_url=self.rest_url, input_id=input_id)
-        self.__send_request(requests.post, url)
+        self.__send_request(self.session.post, url)
 
     def set_transform_to_default(self):
         """
@@ -378,11 +658,18 @@ class Client(object):
         self.set_transform(transform=transform)
 
     def set_mapping(self, mapping, event_type, timeout=MAPPING_TIMEOUT):
-
+        """
+        :param mapping: the event type's mapping, a dict or an
+                        alooma.models.EventType
+        """
+        mapping = models.to_dict(mapping)
         event_type = urllib.parse.quote(event_type, safe='')
         url = self.rest_url + 'event-types/{event_type}/mapping'.format(
             event_type=event_type)
-        res = self.__send_request(requests.post, url, json=mapping, timeout=timeout)
+        res = self.__send_request(self.session.post, url, json=mapping, timeout=timeout)
+        if self._event_type_catalog is not None:
+            self._event_type_catalog.invalidate(
+                urllib.parse.unquote(event_type))
         return res
 
     def discard_event_type(self, event_type):
@@ -523,8 +810,8 @@ class Client(object):
         :return:            sleep time of the input with ID input_id
         """
         url = self.rest_url + 'inputSleepTime/%s' % input_id
-        res = requests.get(url, **self.requests_params)
-        return float(json.loads(res.content).get('inputSleepTime'))
+        res = self.__send_request(self.session.get, url)
+        return float(parse_response_to_json(res).get('inputSleepTime'))
 
     def set_input_sleep_time(self, input_id, sleep_time):
         """
@@ -533,7 +820,7 @@ class Client(object):
         :return:            result of the REST request
         """
         url = self.rest_url + 'inputSleepTime/%s' % input_id
-        res = requests.put(url, json=sleep_time, **self.requests_params)
+        res = self.__send_request(self.session.put, url, json=sleep_time)
         return res
 
     def get_samples_status_codes(self):
@@ -544,7 +831,7 @@ class Client(object):
                     sampling events according to the events' type & status.
         """
         url = self.rest_url + 'status-types'
-        res = requests.get(url, **self.requests_params)
+        res = self.__request(self.session.get, url, **self.requests_params)
         return json.loads(res.content)
 
     def get_samples_stats(self):
@@ -554,7 +841,7 @@ class Client(object):
                     code to the amount of samples for that event type & status
         """
         url = self.rest_url + 'samples/stats'
-        res = requests.get(url, **self.requests_params)
+        res = self.__request(self.session.get, url, **self.requests_params)
         return json.loads(res.content.decode())
 
     def get_samples(self, event_type=None, error_codes=None):
@@ -572,7 +859,7 @@ class Client(object):
             url += '?eventType=%s' % event_type
         if error_codes and isinstance(error_codes, list):
             url += ''.join(['&status=%s' % ec for ec in error_codes])
-        res = requests.get(url, **self.requests_params)
+        res = self.__request(self.session.get, url, **self.requests_params)
         return json.loads(res.content)
 
     def get_all_transforms(self):
@@ -580,19 +867,19 @@ class Client(object):
         Returns a map from module name to module code
         """
         url = self.rest_url + 'transform/functions'
-        res = self.__send_request(requests.get, url)
         # from list of CodeSnippets to {moduleName: code} mapping
-        return {item['functionName']: item['code'] for item in res.json()}
+        return {item['functionName']: item['code']
+                for item in self.__get_json(url)}
 
     def get_transform(self, module_name='main'):
         url = self.rest_url + 'transform/functions/{}'.format(module_name)
         try:
-            res = self.__send_request(requests.get, url)
+            res = self.__send_request(self.session.get, url)
             return parse_response_to_json(res)["code"]
         except:
             if module_name == 'main':
                 defaults_url = self.rest_url + 'transform/defaults'
-                res = self.__send_request(requests.get, defaults_url)
+                res = self.__send_request(self.session.get, defaults_url)
                 return parse_response_to_json(res)["PYTHON"]
             else:
                 # TODO: remove silent defaults?
@@ -603,12 +890,12 @@ class Client(object):
         data = {'language': 'PYTHON', 'code': transform,
                 'functionName': module_name}
         url = self.rest_url + 'transform/functions/{}'.format(module_name)
-        res = self.__send_request(requests.post, url, json=data)
+        res = self.__send_request(self.session.post, url, json=data)
         return res
 
     def delete_transform(self, module_name):
         url = self.rest_url + 'transform/functions/{}'.format(module_name)
-        return self.__send_request(requests.delete, url)
+        return self.__send_request(self.session.delete, url)
 
     def test_transform(self, sample, temp_transform=None):
         """
@@ -635,7 +922,8 @@ class Client(object):
             'code': temp_transform,
             'sample': sample
         }
-        res = requests.post(url, json=data, **self.requests_params)
+        res = self.__request(self.session.post, url, json=data,
+                             **self.requests_params)
         return json.loads(res.content)
 
     def test_transform_all_samples(self, event_type=None, status_code=None):
@@ -664,17 +952,23 @@ class Client(object):
                         results.append(s)
         return results
 
-    def get_metrics_by_names(self, metric_names, minutes, resolution=1):
+    def get_metrics_by_names(self, metric_names, minutes, resolution=1,
+                             as_series=False):
         """
         Fetches the historical metrics for the requested metric(s)
         :param metric_names: either a string or list of metric names
                              refer to METRICS_LIST for a list of metrics
         :param minutes: how many minutes to look back
         :param resolution: the resolution in minutes of each datapoint
+        :param as_series: if True, return alooma.metrics.MetricSeries
+                          objects instead of the raw response
         :return:    a list of dict(s) with the datapoints datapoints.
                     Each dictionary contains the following keys:
                         'target': <metric name>
                         'datapoints': List of [<value>, <timestamp>] pairs
+                    If as_series is True, a list of MetricSeries in the
+                    same order, holding a float values array (NaN for
+                    missing datapoints) and an int64 timestamps array
         """
         if type(metric_names) != list and type(metric_names) == str:
             metric_names = [metric_names]
@@ -692,18 +986,35 @@ class Client(object):
         url = self.rest_url + 'metrics?metrics=%s&from=-%dmin' \
                               '&resolution=%dmin' \
                               '' % (metrics_string, minutes, resolution)
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
 
         response = parse_response_to_json(res)
+        if as_series:
+            return series_from_response(response)
         return response
 
+    def get_metrics_snapshot(self, minutes, metrics=None, resolution=1):
+        """
+        Fetches several metrics in a single request and derives the
+        values of all the metric helpers from them
+        :param minutes: how many minutes to look back
+        :param metrics: optional list of metric names to fetch,
+                        defaults to alooma.metrics.SNAPSHOT_METRICS,
+                        which covers every derived value
+        :param resolution: the resolution in minutes of each datapoint
+        :return:    an alooma.metrics.MetricsSnapshot exposing
+                    incoming_queue, outputs_metrics, restream_queue,
+                    incoming_events_count, average_event_size and
+                    max_latency, as well as the series of each metric
+        """
+        metrics = list(metrics) if metrics is not None else SNAPSHOT_METRICS
+        series = self.get_metrics_by_names(metrics, minutes, resolution,
+                                           as_series=True)
+        return MetricsSnapshot(series, metrics, minutes)
+
     def get_incoming_queue_metric(self, minutes):
-        response = self.get_metrics_by_names("EVENTS_IN_PIPELINE", minutes)
-        incoming = non_empty_datapoint_values(response)
-        if incoming:
-            return max(incoming)
-        else:
-            return 0
+        return self.get_metrics_snapshot(
+            minutes, ['EVENTS_IN_PIPELINE']).incoming_queue
 
     def get_outputs_metrics(self, minutes):
         """
@@ -711,16 +1022,12 @@ class Client(object):
         the last X minutes
         :param minutes - number of minutes to check
         """
-        response = self.get_metrics_by_names(['UNMAPPED_EVENTS',
-                                              'IGNORED_EVENTS',
-                                              'ERROR_EVENTS',
-                                              'LOADED_EVENTS_RATE'],
-                                             minutes)
-        return tuple([sum(non_empty_datapoint_values([r])) for r in response])
+        return self.get_metrics_snapshot(
+            minutes, OUTPUTS_METRICS).outputs_metrics
 
     def get_restream_queue_metrics(self, minutes):
-        response = self.get_metrics_by_names("EVENTS_IN_TRANSIT", minutes)
-        return non_empty_datapoint_values(response)[0]
+        return self.get_metrics_snapshot(
+            minutes, ['EVENTS_IN_TRANSIT']).restream_queue
 
     def get_restream_stats(self):
         """
@@ -731,14 +1038,7 @@ class Client(object):
         :return: :type dict with the following keys; number_of_events,
                        size_used, max_size
         """
-        restream_stats = next(node["stats"]
-                              for node in self.get_structure()["nodes"]
-                              if node["type"] == RESTREAM_QUEUE_TYPE_NAME)
-        return {
-            "number_of_events": restream_stats["availbleForRestream"],
-            "size_used": restream_stats["currentQueueSize"],
-            "max_size": restream_stats["maxQueueSize"]
-        }
+        return restream_stats_from_structure(self.get_structure())
 
     def get_throughput_by_name(self, name):
         """
@@ -750,33 +1050,26 @@ class Client(object):
                 if x['name'] == name and not x['deleted']]
 
     def get_incoming_events_count(self, minutes):
-        response = self.get_metrics_by_names("INCOMING_EVENTS", minutes)
-        return sum(non_empty_datapoint_values(response))
+        return self.get_metrics_snapshot(
+            minutes, ['INCOMING_EVENTS']).incoming_events_count
 
     def get_average_event_size(self, minutes):
-        response = self.get_metrics_by_names("EVENT_SIZE_AVG", minutes)
-        values = non_empty_datapoint_values(response)
-        if not values:
-            return 0
-
-        return sum(values)/len(values)
+        return self.get_metrics_snapshot(
+            minutes, ['EVENT_SIZE_AVG']).average_event_size
 
     def get_max_latency(self, minutes):
         try:
-            response = self.get_metrics_by_names("LATENCY_MAX", minutes)
-            latencies = non_empty_datapoint_values(response)
-            if latencies:
-                return max(latencies) / 1000
-            else:
-                return 0
+            return self.get_metrics_snapshot(
+                minutes, ['LATENCY_MAX']).max_latency
         except Exception as e:
             raise Exception("Failed to get max latency, returning 0. "
                             "Reason: %s", e)
 
-    def create_table(self, table_name, columns):
+    def create_table(self, table_name, columns, schema=None):
         """
         :param table_name: self descriptive
         :param columns: self descriptive
+        :param schema: the table's schema, else use default
         columns example:
         columns = [
         {
@@ -792,16 +1085,19 @@ class Client(object):
         }
         ]
         """
-        url = self.rest_url + 'tables/' + table_name
+        schema_string = '%s/' % schema if schema is not None else ''
+        url = self.rest_url + 'tables/' + schema_string + table_name
 
-        res = self.__send_request(requests.post, url, json=columns)
+        res = self.__send_request(self.session.post, url, json=columns)
+        self.__mark_table_changed(table_name, schema)
 
         return parse_response_to_json(res)
 
-    def alter_table(self, table_name, columns):
+    def alter_table(self, table_name, columns, schema=None):
         """
         :param table_name: self descriptive
         :param columns: self descriptive
+        :param schema: the table's schema, else use default
         columns example:
         columns = [
         {
@@ -817,20 +1113,25 @@ class Client(object):
         }
         ]
         """
-        url = self.rest_url + 'tables/' + table_name
+        schema_string = '%s/' % schema if schema is not None else ''
+        url = self.rest_url + 'tables/' + schema_string + table_name
 
-        res = self.__send_request(requests.put, url, json=columns)
+        res = self.__send_request(self.session.put, url, json=columns)
+        self.__mark_table_changed(table_name, schema)
 
         return res
 
+    def __mark_table_changed(self, table_name, schema=None):
+        if self._table_catalog is not None:
+            self._table_catalog.mark_changed(table_name, schema)
+
     def get_table_names(self, schema=None):
         """
         :param schema - return tables from a specific schema, else use default
         """
         schema_string = '/%s' % schema if schema is not None else ''
         url = self.rest_url + 'tables%s?shallow=true' % schema_string
-        res = self.__send_request(requests.get, url)
-        return parse_response_to_json(res)
+        return self.__get_json(url)
 
     # TODO standardize the responses (handling of error code etc)
     def get_tables(self, shallow=False, schema=None):
@@ -843,38 +1144,104 @@ class Client(object):
 
         schema_string = '/%s' % schema if schema is not None else ''
         url = self.rest_url + 'tables%s' % schema_string
-        res = self.__send_request(requests.get, url)
-        return parse_response_to_json(res)
+        return self.__get_json(url)
+
+    def sync_tables(self, desired_tables, schema=None,
+                    max_workers=DEFAULT_MAX_WORKERS, dry_run=False):
+        """
+        Brings tables to the desired column specs, creating or altering
+        only the tables which differ from the server
+        :param desired_tables: a dict from table name to a list of columns
+                               (see create_table for the column format), or
+                               a list of tables in the format returned by
+                               get_tables
+        :param schema: the tables' schema, else use default
+        :param max_workers: the max number of concurrent create / alter
+                            calls
+        :param dry_run: only compute the plan, without applying it
+        :return: an alooma.table_sync.TableSyncReport with the plan (one
+                 action per desired table: create, alter or unchanged,
+                 along with the differences found) and a result for
+                 every applied action
+        """
+        return table_sync.sync_tables(self, desired_tables, schema=schema,
+                                      max_workers=max_workers,
+                                      dry_run=dry_run)
+
+    def get_table_catalog(self, ttl=DEFAULT_CATALOG_TTL):
+        """
+        Returns the client's alooma.catalog.TableCatalog, a cached index of
+        schema -> table -> column with O(1) lookups. It is refreshed
+        incrementally, and updated by create_table / alter_table
+        :param ttl: seconds before a schema's table names are listed
+                    again, used when the catalog is first created
+        """
+        with self._lock:
+            if self._table_catalog is None:
+                self._table_catalog = TableCatalog(self, ttl)
+            return self._table_catalog
 
     def get_notifications(self, epoch_time):
         url = self.rest_url + "notifications?from={epoch_time}". \
             format(epoch_time=epoch_time)
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
         return parse_response_to_json(res)
 
-    def get_inputs(self, name=None, input_type=None, input_id=None):
+    def stream_notifications(self, since=None, cursor=None, types=None,
+                             severities=None,
+                             min_interval=DEFAULT_MIN_POLL_INTERVAL,
+                             max_interval=DEFAULT_MAX_POLL_INTERVAL,
+                             stop_event=None, max_polls=None):
+        """
+        A generator of new notifications, polling get_notifications with a
+        cursor it keeps itself. Notifications seen in overlapping polls
+        are yielded once
+        :param since: epoch seconds to start from when the cursor is new,
+                      defaults to now
+        :param cursor: optional path of a file persisting the cursor, or
+                       an alooma.notifications.NotificationCursor
+        :param types: optional collection of notification types to yield
+        :param severities: optional collection of severities to yield,
+                           e.g. ['error', 'warning']
+        :param min_interval: seconds between polls while notifications
+                             arrive
+        :param max_interval: the longest interval between polls, reached
+                             gradually while there are no notifications
+        :param stop_event: optional threading.Event that stops the stream
+        :param max_polls: optional number of polls after which the stream
+                          ends
+        :return: a generator of alooma.notifications.Notification named
+                 tuples with id, timestamp, type, severity, description
+                 and raw (the message dict)
+        """
+        return stream_notifications(self, since=since, cursor=cursor,
+                                    types=types, severities=severities,
+                                    min_interval=min_interval,
+                                    max_interval=max_interval,
+                                    stop_event=stop_event,
+                                    max_polls=max_polls)
+
+    def get_inputs(self, name=None, input_type=None, input_id=None,
+                   with_stats=True):
         """
         Get a list of all the input nodes in the system
         :param name: Filter by name (accepts Regex)
         :param input_type: Filter by type (e.g. "mysql")
         :param input_id: Filter by node ID
+        :param with_stats: include the nodes' stats, else look the inputs
+                           up in the cached topology (see get_topology)
         :return: A list of all the inputs in the system, along
         with metadata and configurations
         """
-        nodes = [node for node in self.get_plumbing()['nodes']
-                 if node['category'] == 'INPUT']
-        if input_type:
-            nodes = [node for node in nodes if node['type'] == input_type]
-        if name:
-            regex = re.compile(name)
-            nodes = [node for node in nodes if regex.match(node['name'])]
-        if input_id:
-            nodes = [node for node in nodes if node['id'] == input_id]
-        return nodes
+        structure = self.get_structure() if with_stats \
+            else self.get_topology()
+        return inputs_from_structure(structure, name=name,
+                                     input_type=input_type,
+                                     input_id=input_id)
 
     def get_output_node(self):
         url = self.rest_url + 'plumbing/outputs'
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
         return parse_response_to_json(res)[0]
 
     def set_output(self, output_config, output_name=None):
@@ -929,14 +1296,13 @@ class Client(object):
             'deleted': False
         }
         url = self.rest_url + 'plumbing/nodes/' + output_node['id']
-        res = self.__send_request(requests.put, url, json=payload)
+        res = self.__send_request(self.session.put, url, json=payload)
         return parse_response_to_json(res)
 
     def __fix_bigquery_config(self, output_config):
-        config_url = self.rest_url + 'zk-configuration/featureUseBigQueryNewConnectConfiguration'
-        http_res = self.__send_request(requests.get, config_url)
-        json_res = parse_response_to_json(http_res)
-        if not json_res['featureUseBigQueryNewLoginConfiguration']:
+        capabilities = self._capabilities.get(
+            [FLAG_BIGQUERY_NEW_CONNECT_CONFIGURATION], strict=True)
+        if not capabilities.bigquery_new_connect_configuration:
             output_config['databaseName'] = output_config.pop('projectName')
             output_config['schemaName'] = output_config.pop('datasetName')
 
@@ -1131,7 +1497,7 @@ class Client(object):
         self.delete_s3_retention()
 
     def remove_all_inputs(self):
-        plumbing = self.get_plumbing()
+        plumbing = self.get_topology()
         for node in plumbing["nodes"]:
             if node["category"] == "INPUT" \
                     and node["type"] not in ["RESTREAM", "AGENT"]:
@@ -1147,23 +1513,26 @@ class Client(object):
         url = self.rest_url + 'event-types/{event_type}' \
             .format(event_type=event_type)
 
-        self.__send_request(requests.delete, url)
+        self.__send_request(self.session.delete, url)
+        if self._event_type_catalog is not None:
+            self._event_type_catalog.mark_deleted(
+                urllib.parse.unquote(event_type))
 
     def get_users(self):
         url = self.rest_url + 'users/'
 
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
         return parse_response_to_json(res)
 
     def get_settings(self):
         url = self.rest_url + 'settings/'
 
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
         return parse_response_to_json(res)
 
     def set_settings_email_notifications(self, email_settings_json):
         url = self.rest_url + "settings/email-notifications"
-        self.__send_request(requests.post, url, json=email_settings_json)
+        self.__send_request(self.session.post, url, json=email_settings_json)
 
     def set_s3_retention(self, aws_bucket_name, aws_access_key, aws_secret_key,
                          file_prefix=None, save_metadata=True, gzip=True,
@@ -1192,18 +1561,18 @@ class Client(object):
         if file_prefix is not None:
             s3_retention_config['filePrefix'] = file_prefix
         url = self.rest_url + 'settings/s3-retention'
-        self.__send_request(requests.post, url, json=s3_retention_config)
+        self.__send_request(self.session.post, url, json=s3_retention_config)
 
     def delete_s3_retention(self):
         url = self.rest_url + "settings/s3-retention"
-        self.__send_request(requests.delete, url)
+        self.__send_request(self.session.delete, url)
 
     def clean_restream_queue(self):
         self.purge_restream_queue()
 
     def purge_restream_queue(self):
         url = self.rest_url + 'plumbing/purge/restream'
-        self.__send_request(requests.delete, url)
+        self.__send_request(self.session.delete, url)
 
     def start_restream(self):
         """
@@ -1227,7 +1596,7 @@ class Client(object):
                 "deleted": False,
                 "state": None
             }
-            self.__send_request(requests.put, url,
+            self.__send_request(self.session.put, url,
                                 json=restream_click_button_json)
         else:
             raise Exception("Could not find '{restream_type}' type".format(
@@ -1238,8 +1607,8 @@ class Client(object):
         Returns the number of events currently held in the Restream Queue
         :return: an int representing the number of events in the queue
         """
-        restream_node = self._get_node_by("type", RESTREAM_QUEUE_TYPE_NAME)
-        return restream_node["stats"]["availbleForRestream"]
+        return restream_stats_from_structure(
+            self.get_structure())["number_of_events"]
 
     def _get_node_by(self, field, value):
         """
@@ -1250,7 +1619,7 @@ class Client(object):
         :return: first node that found, if no node found for this case return
         None
         """
-        plumbing = self.get_plumbing()
+        plumbing = self.get_topology()
         for node in plumbing["nodes"]:
             if node[field] == value:
                 return node
@@ -1293,10 +1662,35 @@ class Client(object):
     def get_deployment_info(self):
         """ Return dict with Deployment Info """
         url = self.rest_url + "deployInfo"
-        res = self.__send_request(requests.get, url)
+        res = self.__send_request(self.session.get, url)
 
         return res.json()
 
+    def get_feature_flag(self, name, key=None):
+        """
+        :param name: the name of the feature flag
+        :param key: the key of the flag's value in the response, defaults
+                    to name
+        :return: the value of the feature flag
+        """
+        url = self.rest_url + 'zk-configuration/' + name
+        res = self.__send_request(self.session.get, url)
+        return parse_response_to_json(res)[key or name]
+
+    def get_capabilities(self, flags=(), refresh=False):
+        """
+        Returns the server's alooma.capabilities.Capabilities: its
+        deployment info and version, and feature flags. They are fetched
+        once and cached for capabilities_ttl seconds, and methods such as
+        set_output and get_schemas branch on them without extra requests
+        :param flags: the names of the feature flags to include, fetched
+                      if not cached
+        :param refresh: fetch everything again
+        """
+        if refresh:
+            self._capabilities.invalidate()
+        return self._capabilities.get(flags)
+
     # SCHEDULED QUERIES #
     def get_scheduled_queries(self):
         """
@@ -1304,11 +1698,12 @@ class Client(object):
         :return: a dict representing all scheduled queries
         """
         url = self.rest_url + 'consolidation'
-        return requests.get(url, **self.requests_params).json()
+        res = self.__send_request(self.session.get, url)
+        return parse_response_to_json(res)
 
     def remove_scheduled_query(self, query_id):
         url = self.rest_url + 'consolidation/' + query_id
-        res = self.__send_request(requests.delete, url)
+        res = self.__send_request(self.session.delete, url)
         if not res.ok:
             raise Exception('Failed deleting query id=%s '
                             'status_code=%d response=%s' %
@@ -1351,7 +1746,7 @@ class Client(object):
             "run_at": run_at
         }
 
-        return self.__send_request(requests.post,
+        return self.__send_request(self.session.post,
                                    scheduled_query_url,
                                    json=data)
 
@@ -1380,13 +1775,45 @@ def parse_response_to_json(response):
 def non_empty_datapoint_values(data):
     """
     From a graphite like response, return the values of the
-    non-empty datapoints
+    non-empty datapoints. Zero is a valid value and is kept
     """
     if data:
-        return [t[0] for t in data[0]['datapoints'] if t[0]]
+        return [t[0] for t in data[0]['datapoints'] if t[0] is not None]
     return []
 
 
+def inputs_from_structure(structure, name=None, input_type=None,
+                          input_id=None):
+    """
+    Extracts the input nodes from a structure returned by
+    `Client.get_structure`, see `Client.get_inputs` for the filters
+    """
+    nodes = [node for node in structure['nodes']
+             if node['category'] == 'INPUT']
+    if input_type:
+        nodes = [node for node in nodes if node['type'] == input_type]
+    if name:
+        regex = re.compile(name)
+        nodes = [node for node in nodes if regex.match(node['name'])]
+    if input_id:
+        nodes = [node for node in nodes if node['id'] == input_id]
+    return nodes
+
+
+def restream_stats_from_structure(structure):
+    """
+    Extracts the restream stats from a structure returned by
+    `Client.get_structure`, see `Client.get_restream_stats`
+    """
+    restream_stats = next(node["stats"] for node in structure["nodes"]
+                          if node["type"] == RESTREAM_QUEUE_TYPE_NAME)
+    return {
+        "number_of_events": restream_stats["availbleForRestream"],
+        "size_used": restream_stats["currentQueueSize"],
+        "max_size": restream_stats["maxQueueSize"]
+    }
+
+
 def remove_stats(mapping):
     if 'stats' in mapping:
         del mapping['stats']
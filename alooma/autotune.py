@@ -0,0 +1,264 @@
+"""
+Closed-loop tuning of the inputs' sleep times (the pause between two
+polls of a source).
+
+A short sleep time lowers the latency of an input's events but polls its
+source, and the account, more often. The SleepTimeTuner watches the
+pipeline's 95th percentile latency (LATENCY_PERCENTILE_95), its backlog
+(EVENTS_IN_PIPELINE) and every input's throughput from the structure,
+and on every step:
+- when the latency is above the target, shortens the sleep time of the
+  inputs which have events, unless the backlog shows the pipeline itself
+  is the bottleneck (polling faster would only add to it)
+- when the latency is well below the target, lengthens the sleep times
+  to poll less
+- always lengthens the sleep time of idle inputs, which only cost polls
+
+Sleep times stay within [min_sleep, max_sleep], and a busy input never
+sleeps longer than its share of the latency target. Every decision is
+recorded in `audit` (and appended to audit_path as JSON lines), and
+nothing is changed in dry run mode.
+
+Usage:
+    tuner = SleepTimeTuner(client, latency_target=300, dry_run=True)
+    for change in tuner.step():
+        print(change)
+    tuner.run(interval=300, stop_event=stop)
+"""
+import collections
+import json
+import threading
+import time
+
+from .alooma import inputs_from_structure
+from .concurrency import DEFAULT_MAX_WORKERS, run_concurrently
+
+DEFAULT_MIN_SLEEP = 1
+DEFAULT_MAX_SLEEP = 3600
+DEFAULT_DECREASE_FACTOR = 0.5
+DEFAULT_INCREASE_FACTOR = 1.5
+DEFAULT_MAX_PIPELINE_EVENTS = 10 ** 6
+DEFAULT_METRICS_MINUTES = 15
+DEFAULT_TUNE_INTERVAL = 300
+
+# the latency below which the sleep times of busy inputs are lengthened,
+# as a fraction of the target
+SLACK_FRACTION = 0.5
+# the largest share of the latency target a busy input may sleep for
+SLEEP_SHARE_OF_TARGET = 0.5
+# relative changes smaller than this are not applied
+DEADBAND = 0.1
+
+LATENCY_METRIC = 'LATENCY_PERCENTILE_95'
+PIPELINE_METRIC = 'EVENTS_IN_PIPELINE'
+
+# input types which are not polled
+UNTUNED_INPUT_TYPES = ['RESTREAM', 'AGENT']
+
+REASON_LATENCY = 'latency above target'
+REASON_SLACK = 'latency below target'
+REASON_IDLE = 'idle input'
+REASON_BOUNDS = 'out of bounds'
+
+# A sleep time decision:
+# old / new - the sleep times in seconds
+# reason - one of the REASON_* constants
+# latency / pipeline_events - the metrics it was based on
+# throughput - the input's throughput from the structure
+# applied - whether it was sent (False in dry run or on error)
+# error - the error of set_input_sleep_time, if any
+SleepTimeChange = collections.namedtuple(
+    'SleepTimeChange',
+    ['timestamp', 'input_id', 'input_name', 'old', 'new', 'reason',
+     'latency', 'pipeline_events', 'throughput', 'applied', 'error'])
+
+
+class SleepTimeTuner(object):
+    def __init__(self, client, latency_target, min_sleep=DEFAULT_MIN_SLEEP,
+                 max_sleep=DEFAULT_MAX_SLEEP, input_ids=None,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR,
+                 increase_factor=DEFAULT_INCREASE_FACTOR,
+                 max_pipeline_events=DEFAULT_MAX_PIPELINE_EVENTS,
+                 metrics_minutes=DEFAULT_METRICS_MINUTES, dry_run=False,
+                 audit_path=None, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param client: an alooma.Client
+        :param latency_target: the p95 latency to meet, in seconds
+        :param min_sleep: the shortest sleep time set, in seconds
+        :param max_sleep: the longest sleep time set, in seconds
+        :param input_ids: optional list of the inputs to tune, defaults to
+                          every polled input
+        :param decrease_factor: the sleep time multiplier when the latency
+                                is too high
+        :param increase_factor: the sleep time multiplier when the latency
+                                has slack, or the input is idle
+        :param max_pipeline_events: a backlog above which the pipeline is
+                                    taken as the bottleneck, and sleep
+                                    times are not shortened
+        :param metrics_minutes: the minutes of metrics looked at
+        :param dry_run: only record the decisions, without applying them
+        :param audit_path: optional file to append every decision to, as
+                           JSON lines
+        :param max_workers: the max number of concurrent sleep time
+                            requests
+        """
+        self.client = client
+        self.latency_target = latency_target
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.input_ids = input_ids
+        self.decrease_factor = decrease_factor
+        self.increase_factor = increase_factor
+        self.max_pipeline_events = max_pipeline_events
+        self.metrics_minutes = metrics_minutes
+        self.dry_run = dry_run
+        self.audit_path = audit_path
+        self.max_workers = max_workers
+        self.audit = []
+        self._sleep_times = {}
+        self._lock = threading.Lock()
+
+    def _inputs(self, structure):
+        inputs = [node for node in inputs_from_structure(structure)
+                  if node['type'] not in UNTUNED_INPUT_TYPES and
+                  not node.get('deleted')]
+        if self.input_ids is not None:
+            inputs = [node for node in inputs if node['id'] in self.input_ids]
+        return inputs
+
+    def _read_sleep_times(self, input_ids):
+        """
+        Reads the sleep times of inputs seen for the first time, the
+        others are known from the previous steps
+        """
+        unknown = [input_id for input_id in input_ids
+                   if input_id not in self._sleep_times]
+        results = run_concurrently(self.client.get_input_sleep_time,
+                                   unknown, self.max_workers)
+        for input_id, (sleep_time, error) in zip(unknown, results):
+            if error is None:
+                self._sleep_times[input_id] = sleep_time
+
+    def forget(self):
+        """
+        Drops the known sleep times, they are read again on the next step,
+        e.g. after they were changed by someone else
+        """
+        with self._lock:
+            self._sleep_times = {}
+
+    def decide(self, old, throughput, latency, pipeline_events):
+        """
+        :return: a tuple of the new sleep time of an input and the reason,
+                 or (old, None) to keep it
+        """
+        busy = bool(throughput)
+        upper = self.max_sleep
+        if busy:
+            upper = max(min(upper, self.latency_target *
+                            SLEEP_SHARE_OF_TARGET), self.min_sleep)
+
+        new, reason = old, None
+        if not busy:
+            new, reason = old * self.increase_factor, REASON_IDLE
+        elif latency is not None and latency > self.latency_target:
+            if pipeline_events <= self.max_pipeline_events:
+                new, reason = old * self.decrease_factor, REASON_LATENCY
+        elif latency is not None and \
+                latency < self.latency_target * SLACK_FRACTION:
+            new, reason = old * self.increase_factor, REASON_SLACK
+
+        bounded = min(max(new, self.min_sleep), upper)
+        if reason is None:
+            if bounded == old:
+                return old, None
+            reason = REASON_BOUNDS
+        new = round(bounded, 1)
+        if new == old or (reason != REASON_BOUNDS and
+                          abs(new - old) < DEADBAND * old):
+            return old, None
+        return new, reason
+
+    def step(self):
+        """
+        Reads the metrics and the structure, and adjusts the sleep times
+        :return: a list of the SleepTimeChanges made (or, in dry run,
+                 proposed) in this step
+        """
+        with self._lock:
+            snapshot = self.client.get_metrics_snapshot(
+                self.metrics_minutes, [LATENCY_METRIC, PIPELINE_METRIC])
+            latency = snapshot[LATENCY_METRIC].last()
+            if latency is not None:
+                # the API reports latencies in milliseconds
+                latency /= 1000
+            pipeline_events = snapshot[PIPELINE_METRIC].last(default=0)
+            inputs = self._inputs(self.client.get_structure())
+            self._read_sleep_times([node['id'] for node in inputs])
+
+            changes = []
+            for node in inputs:
+                old = self._sleep_times.get(node['id'])
+                if old is None:
+                    continue
+                throughput = (node.get('stats') or {}).get('throughput')
+                new, reason = self.decide(old, throughput, latency,
+                                          pipeline_events)
+                if reason is None:
+                    continue
+                changes.append(SleepTimeChange(
+                    timestamp=time.time(), input_id=node['id'],
+                    input_name=node.get('name'), old=old, new=new,
+                    reason=reason, latency=latency,
+                    pipeline_events=pipeline_events,
+                    throughput=throughput, applied=False, error=None))
+
+            if not self.dry_run:
+                changes = self._apply(changes)
+            self._record(changes)
+            return changes
+
+    def _apply(self, changes):
+        results = run_concurrently(
+            lambda change: self.client.set_input_sleep_time(change.input_id,
+                                                            change.new),
+            changes, self.max_workers)
+        applied = []
+        for change, (_, error) in zip(changes, results):
+            if error is None:
+                self._sleep_times[change.input_id] = change.new
+                applied.append(change._replace(applied=True))
+            else:
+                applied.append(change._replace(error=repr(error)))
+        return applied
+
+    def _record(self, changes):
+        self.audit.extend(changes)
+        if self.audit_path and changes:
+            with open(self.audit_path, 'a') as f:
+                for change in changes:
+                    f.write(json.dumps(dict(change._asdict(),
+                                            dry_run=self.dry_run),
+                                       sort_keys=True) + '\n')
+
+    def run(self, interval=DEFAULT_TUNE_INTERVAL, iterations=None,
+            stop_event=None, on_step=None):
+        """
+        Steps every interval seconds
+        :param iterations: optional max number of steps
+        :param stop_event: optional threading.Event to stop running
+        :param on_step: optional callback, called with the list of changes
+                        of every step
+        :return: the number of steps made
+        """
+        stop_event = stop_event or threading.Event()
+        steps = 0
+        while iterations is None or steps < iterations:
+            changes = self.step()
+            steps += 1
+            if on_step is not None:
+                on_step(changes)
+            if (iterations is not None and steps >= iterations) or \
+                    stop_event.wait(interval):
+                break
+        return steps
@@ -0,0 +1,258 @@
+"""
+Incremental, content-addressed backups of `Client.get_config` exports.
+
+Each top level section of the export (inputs, mappings, transforms,
+settings, ...) is split into entries, and every entry is stored gzipped
+under the SHA-256 of its canonical JSON. A backup is a small manifest
+that references those hashes, so entries which did not change since a
+previous backup are never written again, and two backups can be diffed by
+comparing hashes without reading any entry.
+
+Layout of a store directory:
+    objects/<first 2 hash chars>/<hash>.json.gz
+    manifests/<backup id>.json
+"""
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+MANIFEST_VERSION = 1
+
+SECTION_DICT = 'dict'
+SECTION_LIST = 'list'
+SECTION_VALUE = 'value'
+
+OBJECTS_DIR = 'objects'
+MANIFESTS_DIR = 'manifests'
+MANIFEST_EXTENSION = '.json'
+OBJECT_EXTENSION = '.json.gz'
+
+
+def canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BackupStats(object):
+    def __init__(self):
+        self.objects_written = 0
+        self.objects_reused = 0
+        self.bytes_written = 0
+
+    def __repr__(self):
+        return '{cls}(written={written}, reused={reused}, ' \
+               'bytes_written={bytes})'.format(cls=self.__class__.__name__,
+                                               written=self.objects_written,
+                                               reused=self.objects_reused,
+                                               bytes=self.bytes_written)
+
+
+class ConfigBackupStore(object):
+    def __init__(self, path, compress_level=6):
+        """
+        :param path: the store directory, created if missing
+        :param compress_level: the gzip level of stored entries
+        """
+        self.path = path
+        self.compress_level = compress_level
+        for directory in (OBJECTS_DIR, MANIFESTS_DIR):
+            full_path = os.path.join(path, directory)
+            if not os.path.isdir(full_path):
+                os.makedirs(full_path)
+
+    def _object_path(self, object_hash):
+        return os.path.join(self.path, OBJECTS_DIR, object_hash[:2],
+                            object_hash + OBJECT_EXTENSION)
+
+    def _manifest_path(self, backup_id):
+        return os.path.join(self.path, MANIFESTS_DIR,
+                            backup_id + MANIFEST_EXTENSION)
+
+    def _atomic_write(self, path, data):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _put(self, value, stats):
+        data = canonical_json(value)
+        object_hash = content_hash(data)
+        path = self._object_path(object_hash)
+        if os.path.exists(path):
+            stats.objects_reused += 1
+            return object_hash
+
+        buf = io.BytesIO()
+        # mtime=0 keeps the compressed bytes deterministic
+        with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0,
+                           compresslevel=self.compress_level) as f:
+            f.write(data)
+        compressed = buf.getvalue()
+        self._atomic_write(path, compressed)
+        stats.objects_written += 1
+        stats.bytes_written += len(compressed)
+        return object_hash
+
+    def _get(self, object_hash):
+        with gzip.open(self._object_path(object_hash), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def _new_backup_id(self):
+        backup_id = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+        candidate, suffix = backup_id, 1
+        while os.path.exists(self._manifest_path(candidate)):
+            candidate = '%s-%d' % (backup_id, suffix)
+            suffix += 1
+        return candidate
+
+    def backup(self, config, backup_id=None, overwrite=False):
+        """
+        Stores a configuration export
+        :param config: the output of `Client.get_config`
+        :param backup_id: optional id for the backup, defaults to the
+                          current UTC time
+        :param overwrite: replace an existing backup with the same id,
+                          else raise
+        :return: a tuple of (manifest dict, BackupStats)
+        """
+        if backup_id and not overwrite and \
+                os.path.exists(self._manifest_path(backup_id)):
+            raise Exception('Backup %s already exists, pass overwrite=True '
+                            'to replace it' % backup_id)
+        stats = BackupStats()
+        sections = {}
+        for name, value in config.items():
+            if isinstance(value, dict):
+                sections[name] = {
+                    'type': SECTION_DICT,
+                    'entries': {key: self._put(item, stats)
+                                for key, item in value.items()}
+                }
+            elif isinstance(value, list):
+                sections[name] = {
+                    'type': SECTION_LIST,
+                    'entries': [self._put(item, stats) for item in value]
+                }
+            else:
+                sections[name] = {
+                    'type': SECTION_VALUE,
+                    'hash': self._put(value, stats)
+                }
+
+        backup_id = backup_id or self._new_backup_id()
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'id': backup_id,
+            'created': datetime.datetime.utcnow().isoformat() + 'Z',
+            'sections': sections
+        }
+        self._atomic_write(self._manifest_path(backup_id),
+                           canonical_json(manifest))
+        return manifest, stats
+
+    def backup_client(self, client, backup_id=None, overwrite=False):
+        """
+        Exports a client's configuration and stores it, see `backup`
+        """
+        return self.backup(client.get_config(), backup_id, overwrite)
+
+    def list_backups(self):
+        """
+        :return: the ids of all stored backups, oldest first
+        """
+        directory = os.path.join(self.path, MANIFESTS_DIR)
+        return sorted(name[:-len(MANIFEST_EXTENSION)]
+                      for name in os.listdir(directory)
+                      if name.endswith(MANIFEST_EXTENSION))
+
+    def latest_backup(self):
+        """
+        :return: the id of the newest backup, or None
+        """
+        backups = self.list_backups()
+        return backups[-1] if backups else None
+
+    def load_manifest(self, backup_id):
+        with open(self._manifest_path(backup_id), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def restore(self, backup_id, sections=None):
+        """
+        Reconstructs a configuration export from a backup
+        :param backup_id: the backup to reconstruct
+        :param sections: optional list of section names to reconstruct,
+                         defaults to all of them
+        :return: a dict equal to the backed up `Client.get_config` output
+        """
+        manifest = self.load_manifest(backup_id)
+        loaded = {}
+
+        def get(object_hash):
+            if object_hash not in loaded:
+                loaded[object_hash] = self._get(object_hash)
+            return loaded[object_hash]
+
+        config = {}
+        for name, section in manifest['sections'].items():
+            if sections is not None and name not in sections:
+                continue
+            if section['type'] == SECTION_DICT:
+                config[name] = {key: get(object_hash) for key, object_hash
+                                in section['entries'].items()}
+            elif section['type'] == SECTION_LIST:
+                config[name] = [get(object_hash)
+                                for object_hash in section['entries']]
+            else:
+                config[name] = get(section['hash'])
+        return config
+
+    @staticmethod
+    def _flatten(manifest):
+        entries = {}
+        for name, section in manifest['sections'].items():
+            if section['type'] == SECTION_DICT:
+                for key, object_hash in section['entries'].items():
+                    entries[(name, key)] = object_hash
+            elif section['type'] == SECTION_LIST:
+                for index, object_hash in enumerate(section['entries']):
+                    entries[(name, index)] = object_hash
+            else:
+                entries[(name,)] = section['hash']
+        return entries
+
+    def diff(self, old_backup_id, new_backup_id):
+        """
+        Compares two backups by their manifests only
+        :return: a dict with 'added', 'removed' and 'changed' keys, each
+                 holding a sorted list of entry paths, where a path is
+                 (section,) for a plain section, (section, key) for a dict
+                 section and (section, index) for a list section
+        """
+        old = self._flatten(self.load_manifest(old_backup_id))
+        new = self._flatten(self.load_manifest(new_backup_id))
+        return {
+            'added': sorted(set(new) - set(old), key=str),
+            'removed': sorted(set(old) - set(new), key=str),
+            'changed': sorted((path for path in set(old) & set(new)
+                               if old[path] != new[path]), key=str)
+        }
@@ -0,0 +1,165 @@
+"""
+A cache of what the server supports: its deployment info (and version)
+and the feature flags the Client branches on.
+
+The deployment info is fetched once and each feature flag on its first
+use, and all are kept for a TTL, so methods which depend on them, like
+`Client.set_output` for BigQuery, don't make an extra request on every
+call.
+
+Usage:
+    capabilities = api.get_capabilities()
+    if capabilities.at_least('0.5.15'):
+        schemas = api.get_schemas()
+"""
+import re
+import threading
+import time
+
+DEFAULT_CAPABILITIES_TTL = 3600
+
+FLAG_BIGQUERY_NEW_CONNECT_CONFIGURATION = \
+    'featureUseBigQueryNewConnectConfiguration'
+
+# flag name -> the key of its value in the zk-configuration response
+FLAG_RESPONSE_KEYS = {
+    FLAG_BIGQUERY_NEW_CONNECT_CONFIGURATION:
+        'featureUseBigQueryNewLoginConfiguration',
+}
+
+SCHEMAS_MIN_VERSION = '0.5.15'
+
+_VERSION_PART = re.compile(r'\d+')
+
+
+def parse_version(version):
+    """
+    :param version: a version string, e.g. '0.5.15' or 'v0.5.15-rc1'
+    :return: a tuple of ints, e.g. (0, 5, 15), None if there is none
+    """
+    if version is None:
+        return None
+    if isinstance(version, (tuple, list)):
+        return tuple(version)
+    parts = _VERSION_PART.findall(str(version).split('-')[0])
+    return tuple(int(part) for part in parts) if parts else None
+
+
+class Capabilities(object):
+    """
+    A typed view of the server's deployment info and feature flags. A
+    capability which could not be fetched is unknown (None), and the
+    methods depending on it act as if it is supported
+    """
+
+    def __init__(self, deploy_info=None, flags=None, error=None):
+        """
+        :param deploy_info: the result of `Client.get_deployment_info`
+        :param flags: a dict from flag name to its value
+        :param error: the error of fetching the deployment info, if any
+        """
+        self.deploy_info = deploy_info or {}
+        self.flags = dict(flags or {})
+        self.error = error
+        self.version_string = self.deploy_info.get('version')
+        self.version = parse_version(self.version_string)
+
+    def __repr__(self):
+        return '{cls}(version={version!r}, flags={flags!r})'.format(
+            cls=self.__class__.__name__, version=self.version_string,
+            flags=self.flags)
+
+    def at_least(self, version):
+        """
+        :return: whether the server's version is at least version, None if
+                 the server's version is unknown
+        """
+        if self.version is None:
+            return None
+        return self.version >= parse_version(version)
+
+    def flag(self, name):
+        """
+        :return: the value of a feature flag, None if unknown
+        """
+        return self.flags.get(name)
+
+    @property
+    def supports_schemas(self):
+        """ Whether `Client.get_schemas` is available, None if unknown """
+        return self.at_least(SCHEMAS_MIN_VERSION)
+
+    @property
+    def bigquery_new_connect_configuration(self):
+        """
+        Whether BigQuery outputs are configured with projectName and
+        datasetName (else databaseName and schemaName), None if unknown
+        """
+        return self.flag(FLAG_BIGQUERY_NEW_CONNECT_CONFIGURATION)
+
+
+class CapabilityCache(object):
+    def __init__(self, client, ttl=DEFAULT_CAPABILITIES_TTL):
+        """
+        :param client: an alooma.Client
+        :param ttl: seconds the deployment info and flags are kept
+        """
+        self.client = client
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._deploy_info = None
+        self._deploy_info_error = None
+        self._deploy_info_time = None
+        # flag name -> (fetch time, value)
+        self._flags = {}
+
+    def _fresh(self, fetched_at):
+        return fetched_at is not None and time.time() - fetched_at <= self.ttl
+
+    def get(self, flags=(), strict=False):
+        """
+        :param flags: the names of the feature flags needed, fetched if
+                      not cached
+        :param strict: raise the errors of fetching the flags, instead of
+                       leaving them unknown
+        :return: a Capabilities, the error of fetching the deployment info
+                 (kept for the TTL too) is in its `error`
+        """
+        with self._lock:
+            if not self._fresh(self._deploy_info_time):
+                try:
+                    self._deploy_info = self.client.get_deployment_info()
+                    self._deploy_info_error = None
+                except Exception as e:
+                    self._deploy_info = None
+                    self._deploy_info_error = e
+                self._deploy_info_time = time.time()
+
+            for name in flags:
+                cached = self._flags.get(name)
+                if cached is not None and self._fresh(cached[0]) and \
+                        not (strict and cached[1] is None):
+                    continue
+                try:
+                    value = self.client.get_feature_flag(
+                        name, FLAG_RESPONSE_KEYS.get(name))
+                except Exception:
+                    if strict:
+                        raise
+                    value = None
+                self._flags[name] = (time.time(), value)
+
+            return Capabilities(
+                self._deploy_info,
+                {name: value
+                 for name, (fetched_at, value) in self._flags.items()
+                 if self._fresh(fetched_at)},
+                self._deploy_info_error)
+
+    def invalidate(self):
+        """
+        Drops the cached deployment info and flags
+        """
+        with self._lock:
+            self._deploy_info_time = None
+            self._flags = {}
@@ -0,0 +1,194 @@
+import threading
+import time
+
+DEFAULT_CATALOG_TTL = 300
+
+
+def _table_name(table):
+    # shallow listings may contain table dicts or plain names
+    return table['tableName'] if isinstance(table, dict) else table
+
+
+class _SchemaIndex(object):
+    __slots__ = ('tables', 'columns', 'loaded_at', 'changed')
+
+    def __init__(self):
+        self.tables = {}
+        self.columns = {}
+        self.loaded_at = None
+        self.changed = set()
+
+    def index(self, tables):
+        """ Replaces the indexed tables with tables """
+        self.tables = {}
+        self.columns = {}
+        for table in tables:
+            name = table['tableName']
+            self.tables[name] = table
+            self.columns[name] = {column['columnName']: column
+                                  for column in table.get('columns') or []}
+
+    def drop(self, name):
+        self.tables.pop(name, None)
+        self.columns.pop(name, None)
+
+
+class TableCatalog(object):
+    """
+    A cached index of schema -> table -> column, built from
+    `Client.get_tables` and refreshed incrementally.
+
+    Every lookup is a dict access. A schema is loaded on its first lookup
+    and, once its TTL expires, refreshed by listing the table names with
+    `Client.get_table_names` (a shallow request). Full table definitions
+    are downloaded again only when that listing shows new tables, or when
+    tables were marked as changed - `Client.create_table` and
+    `Client.alter_table` mark the tables they touch automatically.
+
+    Tables altered outside of this client are only picked up after
+    `mark_changed`, `invalidate` or `refresh(force=True)`.
+
+    The default schema (schema=None) and its explicit name share one
+    index, once the name is known from the tables loaded for None.
+    """
+
+    def __init__(self, client, ttl=DEFAULT_CATALOG_TTL):
+        """
+        :param client: an alooma.Client
+        :param ttl: seconds before a schema's table names are listed again
+        """
+        self.client = client
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._schemas = {}
+        # learnt from the tables of the default schema
+        self._default_schema = None
+
+    def _key(self, schema):
+        if schema is not None and schema == self._default_schema:
+            return None
+        return schema
+
+    def _load(self, schema, index):
+        tables = self.client.get_tables(schema=schema)
+        index.index(tables)
+        if schema is None and self._default_schema is None:
+            names = set(table.get('schema') for table in tables)
+            if len(names) == 1 and None not in names:
+                self._default_schema = names.pop()
+                # from now on it is looked up under None
+                self._schemas.pop(self._default_schema, None)
+
+    def refresh(self, schema=None, force=False):
+        """
+        Refreshes the tables of a schema
+        :param schema: the schema to refresh, else use default
+        :param force: download every table definition, even if no table
+                      was added or changed
+        """
+        with self._lock:
+            schema = self._key(schema)
+            index = self._schemas.get(schema)
+            if index is None or index.loaded_at is None or force:
+                index = _SchemaIndex()
+                self._load(schema, index)
+                index.loaded_at = time.time()
+                self._schemas[schema] = index
+                return
+
+            names = set(_table_name(t)
+                        for t in self.client.get_table_names(schema))
+            for name in set(index.tables) - names:
+                index.drop(name)
+            to_fetch = (names - set(index.tables)) | \
+                (index.changed & names)
+            if to_fetch:
+                # there is no single table endpoint, so every definition
+                # is downloaded again, and all of them are kept
+                self._load(schema, index)
+            index.changed = set()
+            index.loaded_at = time.time()
+
+    def invalidate(self, schema=None):
+        """
+        Drops a schema from the catalog, it is fully loaded again on the
+        next lookup
+        """
+        with self._lock:
+            self._schemas.pop(self._key(schema), None)
+
+    def mark_changed(self, table_name, schema=None):
+        """
+        Marks a table as changed (or new), its definition is downloaded
+        again on the next lookup in its schema
+        """
+        with self._lock:
+            keys = [self._key(schema)]
+            if schema is not None and self._default_schema is None:
+                # it may be the default schema, whose name isn't known
+                keys.append(None)
+            for key in keys:
+                index = self._schemas.get(key)
+                if index is not None:
+                    index.changed.add(table_name)
+
+    def _index(self, schema):
+        with self._lock:
+            index = self._schemas.get(self._key(schema))
+            if index is None or index.loaded_at is None or index.changed \
+                    or time.time() - index.loaded_at > self.ttl:
+                self.refresh(schema)
+            return self._schemas[self._key(schema)]
+
+    def table_names(self, schema=None):
+        """
+        :return: a list of the table names in the schema
+        """
+        return list(self._index(schema).tables)
+
+    def tables(self, schema=None):
+        """
+        :return: a list of the table definitions in the schema, in the
+                 format returned by `Client.get_tables`
+        """
+        return list(self._index(schema).tables.values())
+
+    def table(self, table_name, schema=None):
+        """
+        :return: the table definition, or None if it does not exist
+        """
+        return self._index(schema).tables.get(table_name)
+
+    def has_table(self, table_name, schema=None):
+        return table_name in self._index(schema).tables
+
+    def columns(self, table_name, schema=None):
+        """
+        :return: a dict from column name to column definition, or None if
+                 the table does not exist
+        """
+        return self._index(schema).columns.get(table_name)
+
+    def column(self, table_name, column_name, schema=None):
+        """
+        :return: the column definition, or None if the table or the
+                 column do not exist
+        """
+        columns = self._index(schema).columns.get(table_name)
+        if columns is None:
+            return None
+        return columns.get(column_name)
+
+    def has_column(self, table_name, column_name, schema=None):
+        return self.column(table_name, column_name, schema) is not None
+
+    def column_type(self, table_name, column_name, schema=None):
+        """
+        :return: the columnType dict of the column, e.g.
+                 {'type': 'VARCHAR', 'length': 256, 'nonNull': False},
+                 or None if the table or the column do not exist
+        """
+        column = self.column(table_name, column_name, schema)
+        if column is None:
+            return None
+        return column.get('columnType')
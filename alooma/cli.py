@@ -0,0 +1,207 @@
+"""
+The `alooma` command line.
+
+Commands print JSON. The credentials come from the --username, --account
+and --base-url options (or the ALOOMA_USERNAME, ALOOMA_ACCOUNT and
+ALOOMA_BASE_URL variables) and the ALOOMA_PASSWORD variable.
+
+With --daemon (or ALOOMA_DAEMON=1) commands run in a local background
+daemon, started on first use, which keeps the session logged in and
+caches the structure and table catalog, see alooma.daemon. Otherwise
+every command logs in and downloads what it needs.
+
+Examples:
+    alooma inputs --type MYSQL
+    alooma --daemon tables list --schema public
+    alooma transforms set main transform.py
+    alooma daemon stop
+"""
+from __future__ import print_function
+
+import argparse
+import getpass
+import json
+import os
+import socket
+import sys
+
+from . import daemon
+
+TRUE_VALUES = ['1', 'true', 'yes']
+
+
+def _build_parser():
+    parser = argparse.ArgumentParser(
+        prog='alooma', description='Manage an Alooma account')
+    parser.add_argument('--username',
+                        default=os.environ.get('ALOOMA_USERNAME'))
+    parser.add_argument('--account',
+                        default=os.environ.get('ALOOMA_ACCOUNT'))
+    parser.add_argument('--base-url',
+                        default=os.environ.get('ALOOMA_BASE_URL'))
+    parser.add_argument('--daemon', action='store_true',
+                        default=os.environ.get('ALOOMA_DAEMON', '').lower()
+                        in TRUE_VALUES,
+                        help='run the command in the background daemon')
+    parser.add_argument('--socket', default=daemon.DEFAULT_SOCKET_PATH,
+                        help='the daemon socket (default: %(default)s)')
+    parser.add_argument('--refresh', action='store_true',
+                        help="don't use the daemon's cached structure "
+                             "and tables")
+    commands = parser.add_subparsers(dest='group', metavar='COMMAND')
+    commands.required = True
+
+    inputs = commands.add_parser('inputs', help='list inputs')
+    inputs.add_argument('--name', help='a regex of input names')
+    inputs.add_argument('--type', help='an input type, e.g. MYSQL')
+    inputs.add_argument('--id', help='an input id')
+    inputs.set_defaults(command='inputs')
+
+    mappings = commands.add_parser('mappings', help='event type mappings')
+    mappings_commands = mappings.add_subparsers(dest='action',
+                                                metavar='ACTION')
+    mappings_commands.required = True
+    mappings_commands.add_parser(
+        'list', help='list event types').set_defaults(
+        command='mappings.list')
+    mapping_get = mappings_commands.add_parser(
+        'get', help="show an event type's mapping")
+    mapping_get.add_argument('event_type')
+    mapping_get.set_defaults(command='mappings.get')
+
+    transforms = commands.add_parser('transforms',
+                                     help='Code Engine modules')
+    transforms_commands = transforms.add_subparsers(dest='action',
+                                                    metavar='ACTION')
+    transforms_commands.required = True
+    transforms_commands.add_parser(
+        'list', help='show all modules').set_defaults(
+        command='transforms.list')
+    transform_get = transforms_commands.add_parser(
+        'get', help="show a module's code")
+    transform_get.add_argument('module', nargs='?', default='main')
+    transform_get.set_defaults(command='transforms.get')
+    transform_set = transforms_commands.add_parser(
+        'set', help="deploy a module's code from a file")
+    transform_set.add_argument('module')
+    transform_set.add_argument('file')
+    transform_set.set_defaults(command='transforms.set')
+
+    metrics = commands.add_parser('metrics', help='system metrics')
+    metrics.add_argument('--minutes', type=int, default=60)
+    metrics.set_defaults(command='metrics')
+
+    restream = commands.add_parser('restream', help='the Restream Queue')
+    restream_commands = restream.add_subparsers(dest='action',
+                                                metavar='ACTION')
+    restream_commands.required = True
+    restream_commands.add_parser(
+        'stats', help='show the queue size').set_defaults(
+        command='restream.stats')
+    restream_commands.add_parser(
+        'start', help='start a restream').set_defaults(
+        command='restream.start')
+
+    tables = commands.add_parser('tables', help='output tables')
+    tables_commands = tables.add_subparsers(dest='action', metavar='ACTION')
+    tables_commands.required = True
+    tables_list = tables_commands.add_parser('list',
+                                             help='list table names')
+    tables_list.add_argument('--schema')
+    tables_list.set_defaults(command='tables.list')
+    table_get = tables_commands.add_parser('get', help="show a table")
+    table_get.add_argument('table')
+    table_get.add_argument('--schema')
+    table_get.set_defaults(command='tables.get')
+
+    daemon_parser = commands.add_parser('daemon',
+                                        help='the background daemon')
+    daemon_parser.add_argument('action',
+                               choices=['start', 'stop', 'status'])
+    daemon_parser.set_defaults(command='daemon')
+    return parser
+
+
+# options which are not command arguments
+_GLOBAL_OPTIONS = ['username', 'account', 'base_url', 'daemon', 'socket',
+                   'group', 'action', 'command', 'file']
+
+
+def _command_args(args):
+    command_args = {key: value for key, value in vars(args).items()
+                    if key not in _GLOBAL_OPTIONS and value is not None}
+    if getattr(args, 'file', None):
+        # read locally, the daemon may run with another working directory
+        with open(args.file) as f:
+            command_args['code'] = f.read()
+    return command_args
+
+
+def _credentials(args):
+    password = os.environ.get('ALOOMA_PASSWORD')
+    if password is None and sys.stdin.isatty():
+        password = getpass.getpass('Alooma password: ')
+    return {'username': args.username, 'password': password,
+            'account_name': args.account, 'base_url': args.base_url}
+
+
+def _run_locally(command, command_args, credentials):
+    from .commands import CommandContext, execute
+
+    context = CommandContext.connect(credentials)
+    return execute(context, command, command_args)
+
+
+def _run_in_daemon(socket_path, command, command_args, credentials):
+    try:
+        return daemon.send_command(socket_path, command, command_args,
+                                   credentials)
+    except socket.error:
+        if not daemon.start(socket_path):
+            raise Exception('The daemon did not start on {path}'
+                            .format(path=socket_path))
+        return daemon.send_command(socket_path, command, command_args,
+                                   credentials)
+
+
+def _daemon_action(args):
+    if args.action == 'start':
+        if not daemon.start(args.socket):
+            raise Exception('The daemon did not start on {path}'
+                            .format(path=args.socket))
+        return daemon.send_command(args.socket, 'status')
+    if not daemon.is_running(args.socket):
+        return {'running': False}
+    if args.action == 'stop':
+        try:
+            return daemon.send_command(args.socket, 'shutdown')
+        except socket.error:
+            # it exited meanwhile
+            return {'running': False}
+    return daemon.send_command(args.socket, 'status')
+
+
+def main(argv=None):
+    args = _build_parser().parse_args(argv)
+    try:
+        if args.command == 'daemon':
+            result = _daemon_action(args)
+        else:
+            command_args = _command_args(args)
+            credentials = _credentials(args)
+            if args.daemon:
+                result = _run_in_daemon(args.socket, args.command,
+                                        command_args, credentials)
+            else:
+                result = _run_locally(args.command, command_args,
+                                      credentials)
+    except Exception as e:
+        print('error: %s' % e, file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2, sort_keys=True,
+                     default=daemon.json_default))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
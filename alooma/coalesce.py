@@ -0,0 +1,93 @@
+"""
+Coalescing of identical concurrent requests.
+
+A RequestCoalescer runs a function once for all the callers asking for
+the same key at the same time: the first caller runs it, the others wait
+and get its result (or its exception). With a cache window, results are
+also reused by callers arriving shortly after.
+
+Callers which change the remote state call `invalidate`. Calls and
+results from before the invalidation are then not shared with later
+callers, so nobody reads a result older than their own writes.
+"""
+import threading
+import time
+
+DEFAULT_CACHE_WINDOW = 0
+
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer(object):
+    def __init__(self, window=DEFAULT_CACHE_WINDOW):
+        """
+        :param window: seconds a result is reused for after its call
+                       ended, 0 to share only calls in flight
+        """
+        self.window = window
+        self.coalesced = 0
+        self.cached = 0
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._in_flight = {}
+        self._recent = {}
+
+    def invalidate(self):
+        """
+        Stops sharing the calls in flight and the cached results
+        """
+        with self._lock:
+            self._epoch += 1
+            self._recent.clear()
+
+    def call(self, key, func):
+        """
+        :param key: a hashable identifying the call
+        :param func: a function of no arguments
+        :return: func's result, from this call or a concurrent one
+        """
+        now = time.time()
+        with self._lock:
+            key = (self._epoch, key)
+            recent = self._recent.get(key)
+            if recent is not None and recent[0] > now:
+                self.cached += 1
+                return recent[1]
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if self.window and call.error is None and \
+                        key[0] == self._epoch:
+                    now = time.time()
+                    for old_key in [old_key for old_key, (expires, _)
+                                    in self._recent.items()
+                                    if expires <= now]:
+                        del self._recent[old_key]
+                    self._recent[key] = (now + self.window, call.result)
+            call.event.set()
+        return call.result
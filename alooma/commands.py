@@ -0,0 +1,147 @@
+"""
+The operations of the `alooma` command line, shared by the CLI (which
+runs them in its own process) and the daemon (which runs them on warm,
+cached Clients, see alooma.daemon).
+
+Every command is a function of a CommandContext and a dict of JSON
+arguments, returning a JSON serializable result.
+"""
+import threading
+import time
+
+from .alooma import (Client, inputs_from_structure,
+                     restream_stats_from_structure)
+
+DEFAULT_STRUCTURE_TTL = 30
+
+
+class CommandContext(object):
+    def __init__(self, client, structure_ttl=0):
+        """
+        :param client: a logged in alooma.Client
+        :param structure_ttl: seconds the structure is reused for, 0 to
+                              download it on every use
+        """
+        self.client = client
+        self.structure_ttl = structure_ttl
+        self.lock = threading.RLock()
+        self._structure = None
+        self._structure_time = None
+
+    @classmethod
+    def connect(cls, credentials, structure_ttl=0):
+        """
+        :param credentials: a dict of Client arguments (username, password,
+                            account_name, base_url)
+        """
+        return cls(Client(**credentials), structure_ttl)
+
+    def structure(self):
+        with self.lock:
+            if self._structure is None or \
+                    time.time() - self._structure_time > self.structure_ttl:
+                self._structure = self.client.get_structure()
+                self._structure_time = time.time()
+            return self._structure
+
+    def catalog(self):
+        return self.client.get_table_catalog()
+
+    def event_types(self):
+        return self.client.get_event_type_catalog()
+
+    def invalidate(self, schema=None):
+        """
+        Drops the cached structure and event types, and the catalog's
+        tables of a schema
+        """
+        with self.lock:
+            self._structure = None
+            self.catalog().invalidate(schema)
+            self.event_types().invalidate()
+
+
+def _inputs(context, args):
+    return inputs_from_structure(context.structure(), name=args.get('name'),
+                                 input_type=args.get('type'),
+                                 input_id=args.get('id'))
+
+
+def _mappings_list(context, args):
+    return context.client.get_event_types()
+
+
+def _mappings_get(context, args):
+    return context.event_types().mapping(args['event_type'])
+
+
+def _transforms_list(context, args):
+    return context.client.get_all_transforms()
+
+
+def _transforms_get(context, args):
+    return context.client.get_transform(args.get('module') or 'main')
+
+
+def _transforms_set(context, args):
+    module = args.get('module') or 'main'
+    context.client.set_transform(args['code'], module_name=module)
+    return {'module': module}
+
+
+def _metrics(context, args):
+    return context.client.get_metrics_snapshot(args.get('minutes') or 60) \
+        .to_dict()
+
+
+def _restream_stats(context, args):
+    return restream_stats_from_structure(context.structure())
+
+
+def _restream_start(context, args):
+    context.client.start_restream()
+    return restream_stats_from_structure(context.client.get_structure())
+
+
+def _tables_list(context, args):
+    return context.catalog().table_names(args.get('schema'))
+
+
+def _tables_get(context, args):
+    return context.catalog().table(args['table'], args.get('schema'))
+
+
+# command name -> (function, whether it changes the system, which
+# invalidates the cached structure and catalog)
+COMMANDS = {
+    'inputs': (_inputs, False),
+    'mappings.list': (_mappings_list, False),
+    'mappings.get': (_mappings_get, False),
+    'transforms.list': (_transforms_list, False),
+    'transforms.get': (_transforms_get, False),
+    'transforms.set': (_transforms_set, True),
+    'metrics': (_metrics, False),
+    'restream.stats': (_restream_stats, False),
+    'restream.start': (_restream_start, True),
+    'tables.list': (_tables_list, False),
+    'tables.get': (_tables_get, False),
+}
+
+
+def execute(context, command, args):
+    """
+    Runs a command on a context
+    :param args: the command's arguments, with refresh=True the cached
+                 structure and catalog are dropped first
+    """
+    if command not in COMMANDS:
+        raise Exception("Unknown command '{command}'".format(command=command))
+    func, mutates = COMMANDS[command]
+    with context.lock:
+        if args.get('refresh'):
+            context.invalidate(args.get('schema'))
+        try:
+            return func(context, args)
+        finally:
+            if mutates:
+                context.invalidate()
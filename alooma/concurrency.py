@@ -0,0 +1,51 @@
+import threading
+
+from six.moves import queue
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def run_concurrently(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Calls func on every item, using up to max_workers threads
+    :param func: a function of a single item
+    :param items: an iterable of items
+    :param max_workers: the max number of concurrent calls, 1 runs the
+                        calls serially in the calling thread
+    :return: a list of (result, error) tuples in the order of items, where
+             error is the exception raised by func, or None
+    """
+    items = list(items)
+    results = [None] * len(items)
+
+    def call(index, item):
+        try:
+            results[index] = (func(item), None)
+        except Exception as e:
+            results[index] = (None, e)
+
+    if max_workers <= 1 or len(items) <= 1:
+        for index, item in enumerate(items):
+            call(index, item)
+        return results
+
+    work = queue.Queue()
+    for index, item in enumerate(items):
+        work.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = work.get_nowait()
+            except queue.Empty:
+                return
+            call(index, item)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(max_workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
@@ -0,0 +1,105 @@
+"""
+Conditional GET requests for the heavy read endpoints.
+
+A ConditionalCache keeps the last body of every URL it saw, with its
+validators (ETag / Last-Modified) and a content hash. The next request
+for the URL sends the validators; on 304 Not Modified the kept body is
+used instead of a download. Servers that send no validators still return
+the full body, and the content hash tells whether it changed, so an
+unchanged result can be reused without parsing it again.
+"""
+import hashlib
+import json
+import threading
+
+NOT_MODIFIED = 304
+
+DEFAULT_ENCODING = 'utf-8'
+
+
+class CachedResource(object):
+    __slots__ = ('etag', 'last_modified', 'digest', 'content', '_parsed')
+
+    def __init__(self, content, digest, etag=None, last_modified=None):
+        self.content = content
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+        self._parsed = None
+
+    def validators(self):
+        """
+        :return: the headers making a request conditional
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def parse(self):
+        """
+        :return: a newly parsed copy of the JSON body
+        """
+        return json.loads(self.content.decode(DEFAULT_ENCODING))
+
+    def parsed(self):
+        """
+        :return: the parsed JSON body, parsed once and shared by all callers
+        """
+        if self._parsed is None:
+            self._parsed = self.parse()
+        return self._parsed
+
+
+class ConditionalCache(object):
+    def __init__(self):
+        self.not_modified = 0
+        self.unchanged = 0
+        self.changed = 0
+        self._lock = threading.Lock()
+        self._resources = {}
+
+    def validators(self, url):
+        """
+        :return: the conditional headers for a request of the URL, empty if
+                 there is nothing cached or no validators were given
+        """
+        with self._lock:
+            resource = self._resources.get(url)
+        return resource.validators() if resource is not None else {}
+
+    def update(self, url, response):
+        """
+        Records the response of a request of the URL
+        :return: a tuple of the CachedResource and whether its content
+                 changed since the previous request
+        """
+        with self._lock:
+            old = self._resources.get(url)
+            if response.status_code == NOT_MODIFIED:
+                if old is None:
+                    raise Exception("Got 304 Not Modified for {url}, which "
+                                    "is not cached".format(url=url))
+                self.not_modified += 1
+                return old, False
+
+            content = response.content
+            digest = hashlib.sha256(content).hexdigest()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if old is not None and old.digest == digest:
+                old.etag = etag
+                old.last_modified = last_modified
+                self.unchanged += 1
+                return old, False
+
+            resource = CachedResource(content, digest, etag, last_modified)
+            self._resources[url] = resource
+            self.changed += 1
+            return resource, True
+
+    def clear(self):
+        with self._lock:
+            self._resources.clear()
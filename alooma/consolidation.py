@@ -0,0 +1,278 @@
+"""
+Management of scheduled (consolidation) queries at scale.
+
+ScheduledQueryManager caches the list returned by
+`Client.get_scheduled_queries`, detects which queries were added, removed
+or changed on every refresh, and keeps a history of status transitions
+so flapping queries can be found. It also schedules and removes queries
+in bulk with bounded concurrency, and syncs the scheduled queries with a
+declarative spec file.
+
+A spec file is a JSON list of queries:
+    [{"event_type": "events", "query": "...", "frequency": 8},
+     {"event_type": "users", "query": "...", "run_at": "0 2 * * *"}]
+"""
+import collections
+import hashlib
+import json
+import re
+import threading
+import time
+
+from .concurrency import DEFAULT_MAX_WORKERS, run_concurrently
+
+DEFAULT_QUERIES_TTL = 60
+DEFAULT_STATUS_HISTORY = 50
+DEFAULT_FLAPPING_TRANSITIONS = 3
+DEFAULT_FLAPPING_WINDOW = 24 * 60 * 60
+
+HEALTHY_STATUSES = ['active', 'done']
+
+QueryChanges = collections.namedtuple('QueryChanges',
+                                      ['added', 'removed', 'changed'])
+
+# supersedes - for every query of to_schedule, the id of the scheduled
+# query it replaces, or None
+QuerySyncPlan = collections.namedtuple('QuerySyncPlan',
+                                       ['to_schedule', 'to_remove',
+                                        'unchanged', 'supersedes'])
+
+
+def _query_text(query):
+    return query.get('custom_query', query.get('query'))
+
+
+def _normalize_query_text(text):
+    return re.sub(r'\s+', ' ', text or '').strip()
+
+
+def query_key(query):
+    """
+    The identity of a scheduled query: its event type, normalized query
+    text and schedule. Works for both server queries and spec entries
+    """
+    return (query.get('event_type'),
+            _normalize_query_text(_query_text(query)),
+            query.get('frequency'), query.get('run_at'))
+
+
+def load_query_spec(path):
+    """
+    :param path: a JSON file holding a list of queries, each with
+                 event_type, query and either frequency or run_at
+    :return: the list of queries
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def _digest(query):
+    return hashlib.sha1(json.dumps(query, sort_keys=True)
+                        .encode('utf-8')).hexdigest()
+
+
+class ScheduledQueryManager(object):
+    def __init__(self, client, ttl=DEFAULT_QUERIES_TTL,
+                 history_size=DEFAULT_STATUS_HISTORY,
+                 max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param client: an alooma.Client
+        :param ttl: seconds the cached query list is used before it is
+                    downloaded again
+        :param history_size: status transitions kept per query
+        :param max_workers: the max number of concurrent schedule / remove
+                            calls
+        """
+        self.client = client
+        self.ttl = ttl
+        self.history_size = history_size
+        self.max_workers = max_workers
+        self.last_changes = QueryChanges([], [], [])
+        self._lock = threading.RLock()
+        self._queries = None
+        self._digests = {}
+        self._loaded_at = None
+        self._history = {}
+
+    def refresh(self):
+        """
+        Downloads the scheduled queries, records status transitions and
+        the changes since the previous download
+        :return: a QueryChanges of added, removed and changed query ids
+        """
+        queries = self.client.get_scheduled_queries()
+        now = time.time()
+        with self._lock:
+            digests = {query_id: _digest(query)
+                       for query_id, query in queries.items()}
+            first_load = self._queries is None
+            old = self._digests
+            added = sorted(set(digests) - set(old))
+            removed = sorted(set(old) - set(digests))
+            changed = sorted(query_id for query_id in set(digests) & set(old)
+                             if digests[query_id] != old[query_id])
+
+            for query_id in added + changed:
+                status = queries[query_id].get('status')
+                history = self._history.setdefault(
+                    query_id, collections.deque(maxlen=self.history_size))
+                if not history or history[-1][1] != status:
+                    history.append((now, status))
+            for query_id in removed:
+                self._history.pop(query_id, None)
+
+            self._queries = queries
+            self._digests = digests
+            self._loaded_at = now
+            self.last_changes = QueryChanges([] if first_load else added,
+                                             removed, changed)
+            return self.last_changes
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def queries(self, force=False):
+        """
+        :param force: download the queries even if the cache is fresh
+        :return: a dict from query id to query, like
+                 `Client.get_scheduled_queries`
+        """
+        with self._lock:
+            if force or self._loaded_at is None or \
+                    time.time() - self._loaded_at > self.ttl:
+                self.refresh()
+            return self._queries
+
+    def in_error_state(self, force=False):
+        """
+        :return: the queries which have not successfully ran on the last
+                 attempt, like `Client.get_scheduled_queries_in_error_state`
+        """
+        return {query_id: query
+                for query_id, query in self.queries(force).items()
+                if query.get('status') not in HEALTHY_STATUSES}
+
+    def status_history(self, query_id):
+        """
+        :return: a list of (timestamp, status) transitions seen for the
+                 query, oldest first
+        """
+        with self._lock:
+            return list(self._history.get(query_id, []))
+
+    def flapping(self, min_transitions=DEFAULT_FLAPPING_TRANSITIONS,
+                 window=DEFAULT_FLAPPING_WINDOW):
+        """
+        :param min_transitions: the number of status changes that makes a
+                                query flapping
+        :param window: seconds back to count status changes in
+        :return: a dict from query id to its number of status changes in
+                 the window, for queries with at least min_transitions
+        """
+        since = time.time() - window
+        result = {}
+        with self._lock:
+            for query_id, history in self._history.items():
+                # the first entry is the initial status, not a transition
+                transitions = sum(1 for index, (timestamp, _)
+                                  in enumerate(history)
+                                  if index > 0 and timestamp >= since)
+                if transitions >= min_transitions:
+                    result[query_id] = transitions
+        return result
+
+    def schedule_many(self, queries):
+        """
+        Schedules many queries concurrently
+        :param queries: a list of dicts with event_type, query and either
+                        frequency or run_at
+        :return: a list of (query, response, error) tuples
+        """
+        def schedule(query):
+            return self.client.schedule_query(
+                query['event_type'], _query_text(query),
+                frequency=query.get('frequency'),
+                run_at=query.get('run_at'))
+
+        results = run_concurrently(schedule, queries, self.max_workers)
+        self.invalidate()
+        return [(query, response, error)
+                for query, (response, error) in zip(queries, results)]
+
+    def remove_many(self, query_ids):
+        """
+        Removes many queries concurrently
+        :return: a list of (query id, error) tuples
+        """
+        results = run_concurrently(self.client.remove_scheduled_query,
+                                   query_ids, self.max_workers)
+        self.invalidate()
+        return [(query_id, error)
+                for query_id, (_, error) in zip(query_ids, results)]
+
+    def plan_sync(self, spec, remove_extra=False):
+        """
+        Compares a spec with the scheduled queries. A query whose text or
+        schedule changed is scheduled again, and the scheduled query it
+        supersedes (of the same event type, with the same text or the same
+        schedule) is removed. Other scheduled queries are extra
+        :param spec: a list of queries, or the path of a spec file
+        :param remove_extra: also remove the extra scheduled queries
+        :return: a QuerySyncPlan of spec queries to schedule, query ids to
+                 remove and ids of queries which are already scheduled
+        """
+        if not isinstance(spec, list):
+            spec = load_query_spec(spec)
+        existing = {}
+        for query_id, query in self.queries(force=True).items():
+            existing.setdefault(query_key(query), []).append(query_id)
+
+        to_schedule, unchanged = [], []
+        for query in spec:
+            ids = existing.get(query_key(query))
+            if ids:
+                unchanged.append(ids.pop())
+            else:
+                to_schedule.append(query)
+
+        left = sorted((query_id, key) for key, ids in existing.items()
+                      for query_id in ids)
+        supersedes = []
+        for query in to_schedule:
+            event_type, text, frequency, run_at = query_key(query)
+            superseded = next(
+                (query_id for query_id, key in left
+                 if key[0] == event_type and
+                 (key[1] == text or key[2:] == (frequency, run_at))), None)
+            if superseded is not None:
+                left = [item for item in left if item[0] != superseded]
+            supersedes.append(superseded)
+
+        to_remove = [query_id for query_id in supersedes
+                     if query_id is not None]
+        if remove_extra:
+            to_remove.extend(query_id for query_id, _ in left)
+        return QuerySyncPlan(to_schedule, sorted(to_remove), unchanged,
+                             supersedes)
+
+    def sync(self, spec, remove_extra=False, dry_run=False):
+        """
+        Schedules the spec's queries which are not scheduled, then removes
+        the ones they supersede, and extra ones if remove_extra is set, see
+        `plan_sync`. A superseded query is kept when its replacement
+        failed to schedule
+        :return: a tuple of (QuerySyncPlan, schedule results, remove
+                 results), the results are empty on a dry run
+        """
+        plan = self.plan_sync(spec, remove_extra)
+        if dry_run:
+            return plan, [], []
+        scheduled = self.schedule_many(plan.to_schedule) \
+            if plan.to_schedule else []
+        kept = set(query_id for query_id, (_, _, error)
+                   in zip(plan.supersedes, scheduled) if error is not None)
+        to_remove = [query_id for query_id in plan.to_remove
+                     if query_id not in kept]
+        removed = self.remove_many(to_remove) if to_remove else []
+        return plan, scheduled, removed
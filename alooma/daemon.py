@@ -0,0 +1,277 @@
+"""
+A local background process holding warm, logged in Clients for the
+`alooma` command line.
+
+The daemon listens on a unix socket, only accessible by its user, and
+keeps one CommandContext (a Client with its cached structure and table
+catalog) per set of credentials. Repeated commands skip the login, the
+account lookup and most downloads. It exits after being idle for a while.
+
+The protocol is one JSON line per request and per response:
+    {"command": "inputs", "args": {...}, "credentials": {...}}
+    {"ok": true, "result": ...} or {"ok": false, "error": "..."}
+
+This module only imports alooma.alooma when it serves, so the CLI can use
+`send_command` without loading the Client.
+"""
+import argparse
+import errno
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from six.moves import socketserver
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.alooma',
+                                   'daemon.sock')
+DEFAULT_IDLE_TIMEOUT = 60 * 60
+DEFAULT_REQUEST_TIMEOUT = 5 * 60
+DEFAULT_START_TIMEOUT = 10
+
+DAEMON_COMMANDS = ['status', 'shutdown']
+
+
+def json_default(value):
+    """ Serializes numpy scalars and arrays """
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def _credentials_key(credentials):
+    password = (credentials.get('password') or '').encode('utf-8')
+    return (credentials.get('username'), credentials.get('account_name'),
+            credentials.get('base_url'), hashlib.sha256(password).hexdigest())
+
+
+class AloomaDaemon(object):
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH,
+                 structure_ttl=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+        :param socket_path: the unix socket to listen on
+        :param structure_ttl: seconds the structure is reused for, defaults
+                              to alooma.commands.DEFAULT_STRUCTURE_TTL
+        :param idle_timeout: seconds without requests after which the
+                             daemon exits
+        """
+        self.socket_path = socket_path
+        self.structure_ttl = structure_ttl
+        self.idle_timeout = idle_timeout
+        self.started_at = time.time()
+        self.last_request_at = self.started_at
+        self.requests = 0
+        self._contexts = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def context(self, credentials):
+        """
+        :return: the CommandContext of the credentials, logging in on first
+                 use
+        """
+        from .commands import CommandContext, DEFAULT_STRUCTURE_TTL
+
+        key = _credentials_key(credentials)
+        with self._lock:
+            entry = self._contexts.get(key)
+            if entry is None:
+                entry = self._contexts[key] = [threading.Lock(), None]
+        with entry[0]:
+            if entry[1] is None:
+                ttl = self.structure_ttl if self.structure_ttl is not None \
+                    else DEFAULT_STRUCTURE_TTL
+                entry[1] = CommandContext.connect(credentials, ttl)
+            return entry[1]
+
+    def status(self):
+        return {'pid': os.getpid(),
+                'uptime': time.time() - self.started_at,
+                'sessions': len(self._contexts),
+                'requests': self.requests}
+
+    def handle(self, request):
+        """
+        :param request: a request dict
+        :return: a response dict
+        """
+        from .commands import execute
+
+        with self._lock:
+            self.requests += 1
+            self.last_request_at = time.time()
+        command = request.get('command')
+        try:
+            if command == 'status':
+                result = self.status()
+            elif command == 'shutdown':
+                # the handler shuts down once the response is written
+                result = self.status()
+            else:
+                context = self.context(request.get('credentials') or {})
+                result = execute(context, command, request.get('args') or {})
+            return {'ok': True, 'result': result}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def _watch_idle(self):
+        while self._server is not None:
+            time.sleep(min(self.idle_timeout, 30))
+            if time.time() - self.last_request_at > self.idle_timeout:
+                self.shutdown()
+
+    def serve_forever(self):
+        directory = os.path.dirname(self.socket_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if os.path.exists(self.socket_path):
+            if is_running(self.socket_path):
+                raise Exception('A daemon already listens on {path}'
+                                .format(path=self.socket_path))
+            os.remove(self.socket_path)
+
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _ThreadingUnixServer(self.socket_path,
+                                                _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self._server.alooma_daemon = self
+        socket_inode = os.stat(self.socket_path).st_ino
+        watcher = threading.Thread(target=self._watch_idle)
+        watcher.daemon = True
+        watcher.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self._server = None
+            # unless a new daemon already replaced it
+            try:
+                if os.stat(self.socket_path).st_ino == socket_inode:
+                    os.remove(self.socket_path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        server = self._server
+        if server is not None:
+            server.shutdown()
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn,
+                           socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        daemon = self.server.alooma_daemon
+        shutdown = False
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except ValueError:
+            response = {'ok': False, 'error': 'Invalid request'}
+        else:
+            response = daemon.handle(request)
+            shutdown = request.get('command') == 'shutdown'
+        self.wfile.write((json.dumps(response, default=json_default) + '\n')
+                         .encode('utf-8'))
+        self.wfile.flush()
+        if shutdown:
+            # only now, the process exits as soon as the server stops
+            threading.Thread(target=daemon.shutdown).start()
+
+
+def send_command(socket_path, command, args=None, credentials=None,
+                 timeout=DEFAULT_REQUEST_TIMEOUT):
+    """
+    Sends a command to the daemon
+    :return: the command's result
+    :raises socket.error: if no daemon listens on the socket, or it
+                          closed the connection without a response (e.g.
+                          while exiting)
+    """
+    request = {'command': command, 'args': args or {},
+               'credentials': credentials or {}}
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(socket_path)
+        connection.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        chunks = []
+        while not chunks or not chunks[-1].endswith(b'\n'):
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        connection.close()
+    if not chunks:
+        raise socket.error(errno.ECONNRESET,
+                           'The daemon closed the connection without a '
+                           'response')
+    response = json.loads(b''.join(chunks).decode('utf-8'))
+    if not response['ok']:
+        raise Exception(response['error'])
+    return response['result']
+
+
+def is_running(socket_path):
+    try:
+        send_command(socket_path, 'status', timeout=DEFAULT_START_TIMEOUT)
+        return True
+    except socket.error as e:
+        # a daemon which is exiting may reset the connection
+        if e.errno not in (errno.ENOENT, errno.ECONNREFUSED, errno.EPIPE,
+                           errno.ECONNRESET, None):
+            raise
+        return False
+
+
+def start(socket_path=DEFAULT_SOCKET_PATH, structure_ttl=None,
+          idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=DEFAULT_START_TIMEOUT):
+    """
+    Starts a daemon in a detached process, unless one is running
+    :return: True once the daemon answers, False if it did not within the
+             timeout
+    """
+    if is_running(socket_path):
+        return True
+    command = [sys.executable, '-m', 'alooma.daemon', '--socket',
+               socket_path, '--idle-timeout', str(idle_timeout)]
+    if structure_ttl is not None:
+        command += ['--structure-ttl', str(structure_ttl)]
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen(command, stdin=devnull, stdout=devnull,
+                         stderr=devnull, close_fds=True,
+                         preexec_fn=os.setsid)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if is_running(socket_path):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Serve warm Alooma sessions to the alooma CLI')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH)
+    parser.add_argument('--structure-ttl', type=float, default=None)
+    parser.add_argument('--idle-timeout', type=float,
+                        default=DEFAULT_IDLE_TIMEOUT)
+    args = parser.parse_args(args)
+    AloomaDaemon(args.socket, structure_ttl=args.structure_ttl,
+                 idle_timeout=args.idle_timeout).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
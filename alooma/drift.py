@@ -0,0 +1,292 @@
+"""
+Detects drift between event type mappings and the warehouse tables they
+are mapped to.
+
+Mappings and tables are fetched concurrently (or taken from a catalog or
+from pre-fetched copies), the tables' columns are indexed by table, and
+every mapped field is then checked with dict lookups, so an analysis is
+linear in the number of fields.
+"""
+from collections import defaultdict
+
+from .concurrency import DEFAULT_MAX_WORKERS, run_concurrently
+
+DRIFT_MISSING_TABLE = 'missing_table'
+DRIFT_MISSING_COLUMN = 'missing_column'
+DRIFT_TYPE_MISMATCH = 'type_mismatch'
+DRIFT_LENGTH_MISMATCH = 'length_mismatch'
+DRIFT_NULLABILITY_MISMATCH = 'nullability_mismatch'
+DRIFT_DISCARDED_PRESENT = 'discarded_present'
+
+DRIFT_KINDS = [
+    DRIFT_MISSING_TABLE,
+    DRIFT_MISSING_COLUMN,
+    DRIFT_TYPE_MISMATCH,
+    DRIFT_LENGTH_MISMATCH,
+    DRIFT_NULLABILITY_MISMATCH,
+    DRIFT_DISCARDED_PRESENT
+]
+
+
+class DriftIssue(object):
+    __slots__ = ('event_type', 'kind', 'table', 'field_path', 'column',
+                 'expected', 'actual')
+
+    def __init__(self, event_type, kind, table, field_path=None,
+                 column=None, expected=None, actual=None):
+        """
+        :param event_type: the event type whose mapping drifted
+        :param kind: one of DRIFT_KINDS
+        :param table: the (schema, table name) the event type is mapped to
+        :param field_path: the dotted path of the field, e.g. 'a.b.c'
+        :param column: the column name
+        :param expected: the mapping's value (type, length, nonNull)
+        :param actual: the table's value
+        """
+        self.event_type = event_type
+        self.kind = kind
+        self.table = table
+        self.field_path = field_path
+        self.column = column
+        self.expected = expected
+        self.actual = actual
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return '{cls}({event_type!r}, {kind!r}, field={field!r}, ' \
+               'column={column!r}, expected={expected!r}, ' \
+               'actual={actual!r})'.format(cls=self.__class__.__name__,
+                                           event_type=self.event_type,
+                                           kind=self.kind,
+                                           field=self.field_path,
+                                           column=self.column,
+                                           expected=self.expected,
+                                           actual=self.actual)
+
+
+class DriftReport(object):
+    def __init__(self, issues, errors=None, event_types_checked=0):
+        """
+        :param issues: a list of DriftIssue
+        :param errors: a dict from event type (or schema) to the exception
+                       raised while fetching it
+        :param event_types_checked: the number of analyzed event types
+        """
+        self.issues = issues
+        self.errors = errors or {}
+        self.event_types_checked = event_types_checked
+
+    def __iter__(self):
+        return iter(self.issues)
+
+    def __len__(self):
+        return len(self.issues)
+
+    def by_kind(self):
+        grouped = defaultdict(list)
+        for issue in self.issues:
+            grouped[issue.kind].append(issue)
+        return dict(grouped)
+
+    def by_event_type(self):
+        grouped = defaultdict(list)
+        for issue in self.issues:
+            grouped[issue.event_type].append(issue)
+        return dict(grouped)
+
+
+def _schema_key(schema):
+    # an empty schema is the default schema
+    return schema or None
+
+
+def _lower(name):
+    return name.lower() if name else name
+
+
+def index_tables(tables_by_schema):
+    """
+    :param tables_by_schema: a dict from schema to the output of
+                             `Client.get_tables` for that schema
+    :return: a dict from (schema, lower case table name) to a dict from
+             lower case column name to column
+    """
+    index = {}
+    for schema, tables in tables_by_schema.items():
+        for table in tables:
+            index[(schema, _lower(table['tableName']))] = {
+                _lower(column['columnName']): column
+                for column in table.get('columns') or []}
+    return index
+
+
+def _iter_fields(mapping):
+    """ Yields (field path, field) for every nested field """
+    stack = [((), field) for field in reversed(mapping.get('fields') or [])]
+    while stack:
+        path, field = stack.pop()
+        field_path = path + (field['fieldName'],)
+        yield field_path, field
+        for child in reversed(field.get('fields') or []):
+            stack.append((field_path, child))
+
+
+def analyze_mapping(event_type, mapping, table_index):
+    """
+    Checks a single event type's mapping against indexed tables
+    :param event_type: the event type's name
+    :param mapping: the output of `Client.get_mapping`
+    :param table_index: the output of `index_tables`
+    :return: a list of DriftIssue
+    """
+    table_mapping = mapping.get('mapping') or {}
+    if table_mapping.get('isDiscarded') or not table_mapping.get('tableName'):
+        return []
+
+    table = (_schema_key(table_mapping.get('schema')),
+             table_mapping['tableName'])
+    columns = table_index.get((table[0], _lower(table[1])))
+    if columns is None:
+        return [DriftIssue(event_type, DRIFT_MISSING_TABLE, table)]
+
+    issues = []
+    for path, field in _iter_fields(mapping):
+        field_mapping = field.get('mapping')
+        if not field_mapping:
+            continue
+        field_path = '.'.join(path)
+
+        if field_mapping.get('isDiscarded'):
+            column_name = '_'.join(path)
+            column = columns.get(_lower(column_name))
+            if column is not None:
+                issues.append(DriftIssue(event_type, DRIFT_DISCARDED_PRESENT,
+                                         table, field_path,
+                                         column['columnName']))
+            continue
+
+        column_name = field_mapping.get('columnName')
+        if not column_name:
+            continue
+        column = columns.get(_lower(column_name))
+        if column is None:
+            issues.append(DriftIssue(event_type, DRIFT_MISSING_COLUMN, table,
+                                     field_path, column_name))
+            continue
+
+        expected = field_mapping.get('columnType') or {}
+        actual = column.get('columnType') or {}
+        expected_type = expected.get('type')
+        actual_type = actual.get('type')
+        if expected_type and actual_type and \
+                expected_type.upper() != actual_type.upper():
+            issues.append(DriftIssue(event_type, DRIFT_TYPE_MISMATCH, table,
+                                     field_path, column_name, expected_type,
+                                     actual_type))
+            continue
+        if expected.get('length') is not None and \
+                actual.get('length') is not None and \
+                expected['length'] != actual['length']:
+            issues.append(DriftIssue(event_type, DRIFT_LENGTH_MISMATCH,
+                                     table, field_path, column_name,
+                                     expected['length'], actual['length']))
+        if 'nonNull' in expected and 'nonNull' in actual and \
+                bool(expected['nonNull']) != bool(actual['nonNull']):
+            issues.append(DriftIssue(event_type, DRIFT_NULLABILITY_MISMATCH,
+                                     table, field_path, column_name,
+                                     expected['nonNull'], actual['nonNull']))
+    return issues
+
+
+def _mapped_schema(summary):
+    table_mapping = summary.get('mapping') or {}
+    if table_mapping.get('isDiscarded'):
+        return None, False
+    return _schema_key(table_mapping.get('schema')), True
+
+
+def analyze_drift(client, event_types=None, mappings=None,
+                  tables_by_schema=None, catalog=None,
+                  max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Finds event types whose mappings reference missing tables or columns,
+    or conflict with the columns' type, length or nullability, and
+    discarded fields whose column exists in the table
+    :param client: an alooma.Client
+    :param event_types: optional list of event type names to analyze,
+                        defaults to all the event types in the system
+    :param mappings: optional dict from event type name to a mapping
+                     (as returned by `Client.get_mapping`) to use instead
+                     of fetching it
+    :param tables_by_schema: optional dict from schema (None for the
+                             default schema) to the output of
+                             `Client.get_tables` to use instead of
+                             fetching it
+    :param catalog: optional alooma.catalog.TableCatalog to take the
+                    tables from instead of fetching them
+    :param max_workers: the max number of concurrent requests
+    :return: a DriftReport
+    """
+    mappings = dict(mappings or {})
+    tables_by_schema = dict(tables_by_schema or {})
+    errors = {}
+
+    if event_types is None:
+        summaries = client.get_event_types()
+        event_types = [summary['name'] for summary in summaries]
+        # the summaries tell which schemas are needed, so the tables can
+        # be fetched together with the mappings
+        schemas = set()
+        for summary in summaries:
+            schema, is_mapped = _mapped_schema(summary)
+            if is_mapped:
+                schemas.add(schema)
+    else:
+        schemas = set()
+
+    def fetch_tables(schema):
+        if catalog is not None:
+            return catalog.tables(schema)
+        return client.get_tables(schema=schema)
+
+    def fetch(job):
+        kind, key = job
+        if kind == 'mapping':
+            return client.get_mapping(key)
+        return fetch_tables(key)
+
+    def run(jobs):
+        for (kind, key), (result, error) in \
+                zip(jobs, run_concurrently(fetch, jobs, max_workers)):
+            if error is not None:
+                errors[key] = error
+            elif kind == 'mapping':
+                mappings[key] = result
+            else:
+                tables_by_schema[key] = result
+
+    run([('mapping', name) for name in event_types if name not in mappings] +
+        [('tables', schema) for schema in schemas
+         if schema not in tables_by_schema])
+
+    missing_schemas = set()
+    for name in event_types:
+        if name in mappings:
+            schema, is_mapped = _mapped_schema(mappings[name])
+            if is_mapped and schema not in tables_by_schema \
+                    and schema not in errors:
+                missing_schemas.add(schema)
+    if missing_schemas:
+        run([('tables', schema) for schema in missing_schemas])
+
+    table_index = index_tables(tables_by_schema)
+    issues = []
+    checked = 0
+    for name in event_types:
+        if name not in mappings:
+            continue
+        checked += 1
+        issues.extend(analyze_mapping(name, mappings[name], table_index))
+    return DriftReport(issues, errors, checked)
@@ -0,0 +1,159 @@
+import collections
+import copy
+import threading
+import time
+
+from .concurrency import DEFAULT_MAX_WORKERS, run_concurrently
+
+DEFAULT_EVENT_TYPE_TTL = 60
+DEFAULT_MAX_EVENT_TYPES = 256
+
+
+class EventTypeCatalog(object):
+    """
+    A lazy cache of event types, for scripts which touch a few of them.
+
+    `names` lists the event types from `Client.get_event_types` and keeps
+    the list for names_ttl seconds (with conditional GETs, listing them
+    again while nothing changed costs a 304). The details of an event type
+    are only downloaded, with `Client.get_event_type`, on its first
+    access, and kept for ttl seconds in an LRU of up to max_size types.
+    `prefetch` loads a chosen subset concurrently.
+
+    `Client.set_mapping` (and so `Client.discard_event_type`) and
+    `Client.delete_event_type` invalidate the event types they change.
+    Event types changed outside of this client are only picked up once
+    their TTL expires, or after `invalidate`.
+
+    The returned event types are shared by all the callers and must not
+    be modified, `mapping` returns a copy without the stats.
+    """
+
+    def __init__(self, client, ttl=DEFAULT_EVENT_TYPE_TTL,
+                 max_size=DEFAULT_MAX_EVENT_TYPES, names_ttl=None):
+        """
+        :param client: an alooma.Client
+        :param ttl: seconds an event type's details are kept
+        :param max_size: the max number of event types kept, the least
+                         recently used ones are dropped first
+        :param names_ttl: seconds the list of names is kept, defaults to
+                          ttl
+        """
+        self.client = client
+        self.ttl = ttl
+        self.max_size = max_size
+        self.names_ttl = ttl if names_ttl is None else names_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._names = None
+        self._names_loaded_at = None
+        # bumped by every invalidation, loads which started before it are
+        # returned to their caller but not kept
+        self._epoch = 0
+
+    def names(self, refresh=False):
+        """
+        :param refresh: list the names again even if the TTL did not expire
+        :return: a list of the event type names
+        """
+        with self._lock:
+            if not refresh and self._names is not None and \
+                    time.time() - self._names_loaded_at <= self.names_ttl:
+                return list(self._names)
+            epoch = self._epoch
+        names = [summary['name'] for summary in self.client.get_event_types()]
+        with self._lock:
+            if epoch == self._epoch:
+                self._names = names
+                self._names_loaded_at = time.time()
+        return list(names)
+
+    def get(self, name):
+        """
+        :return: the event type's mapping and metadata, in the format
+                 returned by `Client.get_event_type`
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and now - entry[0] <= self.ttl:
+                # most recently used last
+                self._entries[name] = self._entries.pop(name)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            epoch = self._epoch
+        return self._load(name, epoch)
+
+    def _load(self, name, epoch):
+        event_type = self.client.get_event_type(name)
+        with self._lock:
+            if epoch == self._epoch:
+                self._entries.pop(name, None)
+                self._entries[name] = (time.time(), event_type)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return event_type
+
+    def mapping(self, name):
+        """
+        :return: a copy of the event type's mapping without the stats, in
+                 the format returned by `Client.get_mapping`
+        """
+        from .alooma import remove_stats
+
+        return remove_stats(copy.deepcopy(self.get(name)))
+
+    def prefetch(self, names, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Loads the event types which are not cached, concurrently
+        :param names: the names of the event types to load
+        :param max_workers: the max number of concurrent requests
+        :return: a dict from name to the exception raised loading it, for
+                 the event types which failed to load
+        """
+        now = time.time()
+        with self._lock:
+            to_load = [name for name in collections.OrderedDict.fromkeys(
+                       names) if name not in self._entries or
+                       now - self._entries[name][0] > self.ttl]
+            epoch = self._epoch
+        results = run_concurrently(lambda name: self._load(name, epoch),
+                                   to_load, max_workers)
+        return {name: error for name, (_, error) in zip(to_load, results)
+                if error is not None}
+
+    def is_cached(self, name):
+        """
+        :return: whether the event type's details are cached and fresh
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry is not None and time.time() - entry[0] <= self.ttl
+
+    def invalidate(self, name=None):
+        """
+        Drops an event type's details, they are downloaded again on the
+        next access
+        :param name: the event type, else drop every event type and the
+                     list of names
+        """
+        with self._lock:
+            self._epoch += 1
+            if name is None:
+                self._entries.clear()
+                self._names = None
+            else:
+                self._entries.pop(name, None)
+
+    def mark_deleted(self, name):
+        """
+        Drops a deleted event type from the cached names and details
+        """
+        with self._lock:
+            self._epoch += 1
+            self._entries.pop(name, None)
+            if self._names is not None and name in self._names:
+                self._names.remove(name)
@@ -0,0 +1,314 @@
+"""
+A Prometheus / OpenMetrics exporter for Alooma pipeline metrics.
+
+The exporter refreshes the metrics and the per-node stats in a background
+thread every `interval` seconds, and serves the last rendered result on
+`/metrics`. Scrapes never hit the Alooma API, so scrape traffic and API
+traffic are independent.
+
+Usage:
+    exporter = MetricsExporter(alooma.Client(username, password))
+    exporter.serve_forever()
+
+or from the command line:
+    ALOOMA_PASSWORD=... python -m alooma.exporter --username <user>
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+
+from .alooma import (Client, METRICS_LIST, RESTREAM_QUEUE_TYPE_NAME,
+                     restream_stats_from_structure)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXPORTER_PORT = 9361
+DEFAULT_EXPORTER_INTERVAL = 60
+DEFAULT_EXPORTER_MINUTES = 5
+
+METRIC_PREFIX = 'alooma_'
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _metric_name(name):
+    return METRIC_PREFIX + name.lower()
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    return repr(float(value))
+
+
+class _MetricFamily(object):
+    def __init__(self, name, help_text, metric_type='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.samples = []
+
+    def add(self, value, **labels):
+        self.samples.append((labels, value))
+        return self
+
+    def render(self):
+        lines = ['# HELP {name} {help}'.format(name=self.name,
+                                               help=self.help_text),
+                 '# TYPE {name} {type}'.format(name=self.name,
+                                               type=self.metric_type)]
+        for labels, value in self.samples:
+            label_string = ''
+            if labels:
+                label_string = '{%s}' % ','.join(
+                    '{k}="{v}"'.format(k=k, v=_escape_label_value(v))
+                    for k, v in sorted(labels.items()))
+            lines.append('{name}{labels} {value}'.format(
+                name=self.name, labels=label_string,
+                value=_format_value(value)))
+        return '\n'.join(lines)
+
+
+class MetricsExporter(object):
+    def __init__(self, client, interval=DEFAULT_EXPORTER_INTERVAL,
+                 minutes=DEFAULT_EXPORTER_MINUTES, resolution=1,
+                 address='', port=DEFAULT_EXPORTER_PORT, metrics=None):
+        """
+        :param client: an alooma.Client
+        :param interval: seconds between background refreshes
+        :param minutes: how many minutes of metrics to fetch on each
+                        refresh. The exported value of each metric is its
+                        last non-empty datapoint in that window
+        :param resolution: the resolution in minutes of each datapoint
+        :param address: the address to serve /metrics on
+        :param port: the port to serve /metrics on
+        :param metrics: optional list of metric names to export,
+                        defaults to alooma.METRICS_LIST
+        """
+        self.client = client
+        self.interval = interval
+        self.minutes = minutes
+        self.resolution = resolution
+        self.address = address
+        self.port = port
+        self.metrics = list(metrics) if metrics is not None \
+            else METRICS_LIST
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresh_thread = None
+        self._server = None
+        self._server_thread = None
+
+        self._payload = ''
+        self._last_refresh = None
+        self._last_refresh_duration = None
+        self._refresh_errors = 0
+        self._up = 0
+
+    def refresh(self):
+        """
+        Fetches the metrics and the structure (2 API requests), and
+        renders the exposition payload served on /metrics
+        """
+        start = time.time()
+        try:
+            series = self.client.get_metrics_by_names(
+                self.metrics, self.minutes, self.resolution, as_series=True)
+            structure = self.client.get_structure()
+            families = self._metric_families(series) + \
+                self._structure_families(structure)
+            up = 1
+        except Exception:
+            logger.exception('Failed refreshing Alooma metrics')
+            families = []
+            up = 0
+
+        with self._lock:
+            self._up = up
+            if up:
+                self._last_refresh = time.time()
+            else:
+                self._refresh_errors += 1
+            self._last_refresh_duration = time.time() - start
+            if up or not self._payload:
+                self._payload = '\n'.join(f.render() for f in families)
+
+    def _metric_families(self, series):
+        families = []
+        for s in series:
+            family = _MetricFamily(
+                _metric_name(s.target),
+                'Alooma metric {name}, last value in the last {minutes} '
+                'minutes'.format(name=s.target, minutes=self.minutes))
+            families.append(family.add(s.last()))
+        return families
+
+    @staticmethod
+    def _structure_families(structure):
+        throughput = _MetricFamily(_metric_name('node_throughput'),
+                                   'Throughput of each node in the '
+                                   'structure')
+        for node in structure['nodes']:
+            if node.get('deleted'):
+                continue
+            stats = node.get('stats') or {}
+            if stats.get('throughput') is None:
+                continue
+            throughput.add(stats['throughput'], node_id=node['id'],
+                           node_name=node['name'], node_type=node['type'],
+                           category=node.get('category', ''))
+        families = [throughput]
+
+        has_restream = any(node['type'] == RESTREAM_QUEUE_TYPE_NAME
+                           for node in structure['nodes'])
+        if has_restream:
+            restream = restream_stats_from_structure(structure)
+            max_size = restream['max_size']
+            usage = float(restream['size_used']) / max_size \
+                if max_size else None
+            families.extend([
+                _MetricFamily(_metric_name('restream_available_events'),
+                              'Number of events available for restream')
+                .add(restream['number_of_events']),
+                _MetricFamily(_metric_name('restream_queue_used_bytes'),
+                              'Restream queue used size in bytes')
+                .add(restream['size_used']),
+                _MetricFamily(_metric_name('restream_queue_max_bytes'),
+                              'Restream queue max size in bytes')
+                .add(max_size),
+                _MetricFamily(_metric_name('restream_queue_usage_ratio'),
+                              'Restream queue used size out of its max '
+                              'size')
+                .add(usage)
+            ])
+        return families
+
+    def render(self):
+        """
+        :return: the exposition payload from the last refresh, along
+                 with the exporter's own metrics
+        """
+        with self._lock:
+            payload = self._payload
+            own = [
+                _MetricFamily(_metric_name('up'),
+                              'Whether the last refresh succeeded')
+                .add(self._up),
+                _MetricFamily(_metric_name('exporter_refresh_errors_total'),
+                              'Number of failed refreshes', 'counter')
+                .add(self._refresh_errors),
+                _MetricFamily(
+                    _metric_name('exporter_last_refresh_timestamp_seconds'),
+                    'Time of the last successful refresh')
+                .add(self._last_refresh),
+                _MetricFamily(
+                    _metric_name('exporter_refresh_duration_seconds'),
+                    'Duration of the last refresh')
+                .add(self._last_refresh_duration)
+            ]
+        parts = [payload] if payload else []
+        parts.extend(f.render() for f in own)
+        return '\n'.join(parts) + '\n'
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            self.refresh()
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        """
+        Starts the background refresh and the HTTP server, without
+        blocking
+        """
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop,
+                                                name='alooma-exporter')
+        self._refresh_thread.daemon = True
+        self._refresh_thread.start()
+
+        self._server = _ExporterHTTPServer((self.address, self.port),
+                                           _ExporterRequestHandler)
+        self._server.exporter = self
+        # port 0 binds a random free port
+        self.port = self._server.server_address[1]
+        self._server_thread = threading.Thread(
+            target=self._server.serve_forever, name='alooma-exporter-http')
+        self._server_thread.daemon = True
+        self._server_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while not self._stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+class _ExporterHTTPServer(socketserver.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ExporterRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = self.server.exporter.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve Alooma pipeline metrics for Prometheus')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password',
+                        default=os.environ.get('ALOOMA_PASSWORD'),
+                        help='defaults to $ALOOMA_PASSWORD')
+    parser.add_argument('--account-name')
+    parser.add_argument('--base-url')
+    parser.add_argument('--address', default='')
+    parser.add_argument('--port', type=int, default=DEFAULT_EXPORTER_PORT)
+    parser.add_argument('--interval', type=int,
+                        default=DEFAULT_EXPORTER_INTERVAL)
+    parser.add_argument('--minutes', type=int,
+                        default=DEFAULT_EXPORTER_MINUTES)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    client = Client(username=args.username, password=args.password,
+                    account_name=args.account_name, base_url=args.base_url)
+    MetricsExporter(client, interval=args.interval, minutes=args.minutes,
+                    address=args.address, port=args.port).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
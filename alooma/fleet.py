@@ -0,0 +1,125 @@
+"""
+Operations across many Alooma accounts.
+
+A Fleet holds one Client per account. All the clients send their requests
+through one shared connection pool (a single requests HTTPAdapter mounted
+on every client's session), while each client keeps its own session
+cookies. Clients are created, and so log in, on first use.
+
+Usage:
+    fleet = Fleet(['account-a', 'account-b'], username, password)
+    results = fleet.map(lambda c: c.get_outputs_metrics(60))
+    for account, result in results.items():
+        print(account, result.value if result.ok else result.error)
+"""
+import collections
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .alooma import Client
+from .concurrency import DEFAULT_MAX_WORKERS, run_concurrently
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 50
+
+
+class FleetResult(collections.namedtuple('FleetResult',
+                                         ['account', 'value', 'error'])):
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class Fleet(object):
+    def __init__(self, accounts, username=None, password=None,
+                 base_url=None, max_workers=DEFAULT_MAX_WORKERS,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        """
+        :param accounts: a list of account names, or a dict from account
+                         name to Client keyword arguments overriding the
+                         defaults below (username, password, base_url)
+        :param username: the default user for all accounts
+        :param password: the default password for all accounts
+        :param base_url: the default Alooma URL for all accounts
+        :param max_workers: the max number of accounts operated on at once
+        :param pool_connections: the number of hosts to keep pools for
+        :param pool_maxsize: the max connections kept per host
+        """
+        if not isinstance(accounts, dict):
+            accounts = {name: {} for name in accounts}
+        self.accounts = accounts
+        self.defaults = {'username': username, 'password': password,
+                         'base_url': base_url}
+        self.max_workers = max_workers
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize)
+        self._clients = {}
+        self._locks = {name: threading.Lock() for name in accounts}
+
+    @property
+    def account_names(self):
+        return sorted(self.accounts)
+
+    def _new_session(self):
+        session = requests.Session()
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def client(self, account):
+        """
+        :return: the account's Client, created (and logged in) on first use
+        """
+        if account not in self.accounts:
+            raise KeyError("Account '{account}' is not part of the fleet"
+                           .format(account=account))
+        client = self._clients.get(account)
+        if client is not None:
+            return client
+        with self._locks[account]:
+            client = self._clients.get(account)
+            if client is None:
+                kwargs = dict(self.defaults)
+                kwargs.update(self.accounts[account])
+                kwargs.setdefault('account_name', account)
+                client = Client(session=self._new_session(), **kwargs)
+                self._clients[account] = client
+        return client
+
+    def map(self, func, accounts=None):
+        """
+        Calls func with the Client of every account, concurrently
+        :param func: a function of a single Client
+        :param accounts: optional list of accounts, defaults to all
+        :return: an OrderedDict from account name to FleetResult, whose
+                 value is func's result, or whose error is the exception
+                 raised while logging in or by func
+        """
+        accounts = list(accounts) if accounts is not None \
+            else self.account_names
+
+        def call(account):
+            return func(self.client(account))
+
+        results = run_concurrently(call, accounts, self.max_workers)
+        return collections.OrderedDict(
+            (account, FleetResult(account, value, error))
+            for account, (value, error) in zip(accounts, results))
+
+    def call(self, method_name, *args, **kwargs):
+        """
+        Calls a Client method on every account, see `map`
+        e.g. fleet.call('get_outputs_metrics', 60)
+        """
+        return self.map(lambda client: getattr(client, method_name)(
+            *args, **kwargs))
+
+    def close(self):
+        self.adapter.close()
+        for client in self._clients.values():
+            client.session.close()
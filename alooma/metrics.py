@@ -0,0 +1,318 @@
+import numpy as np
+
+SECONDS_IN_MINUTE = 60
+
+RESAMPLE_METHODS = ['sum', 'mean', 'max', 'min', 'count']
+
+# the metrics needed by every MetricsSnapshot property
+SNAPSHOT_METRICS = [
+    'EVENTS_IN_PIPELINE',
+    'UNMAPPED_EVENTS',
+    'IGNORED_EVENTS',
+    'ERROR_EVENTS',
+    'LOADED_EVENTS_RATE',
+    'EVENTS_IN_TRANSIT',
+    'INCOMING_EVENTS',
+    'EVENT_SIZE_AVG',
+    'LATENCY_MAX'
+]
+
+OUTPUTS_METRICS = [
+    'UNMAPPED_EVENTS',
+    'IGNORED_EVENTS',
+    'ERROR_EVENTS',
+    'LOADED_EVENTS_RATE'
+]
+
+
+def _whole(value):
+    """
+    :return: value as an int if it is a whole float, e.g. an event count
+             computed from the float64 series, else value as is
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class MetricSeries(object):
+    """
+    A single metric series backed by NumPy arrays.
+    `values` is a float64 array where missing datapoints are NaN, and
+    `timestamps` is an int64 array of epoch seconds of the same length.
+    Zero is a legitimate value and is never treated as missing.
+    """
+    __slots__ = ('target', 'timestamps', 'values')
+
+    def __init__(self, target, timestamps, values):
+        self.target = target
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        if self.timestamps.shape != self.values.shape:
+            raise ValueError("timestamps and values must have the same "
+                             "length, got {ts} and {vs}"
+                             .format(ts=len(self.timestamps),
+                                     vs=len(self.values)))
+
+    @classmethod
+    def from_datapoints(cls, target, datapoints):
+        """
+        Builds a series from a graphite like list of
+        [<value>, <timestamp>] pairs, where value may be None
+        """
+        if not datapoints:
+            return cls(target, [], [])
+        # a float conversion turns None values into NaN in one pass
+        pairs = np.array(datapoints, dtype=np.float64).reshape(-1, 2)
+        return cls(target, pairs[:, 1], pairs[:, 0])
+
+    @classmethod
+    def from_response(cls, response):
+        """
+        Builds a series from a single element of the list returned
+        by `Client.get_metrics_by_names`
+        """
+        return cls.from_datapoints(response['target'],
+                                   response['datapoints'])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return '{cls}(target={target!r}, points={points}, valid={valid})' \
+            .format(cls=self.__class__.__name__, target=self.target,
+                    points=len(self), valid=self.count())
+
+    @property
+    def mask(self):
+        """ A boolean array, True where the datapoint has a value """
+        return ~np.isnan(self.values)
+
+    @property
+    def valid_values(self):
+        """ The values of the non-empty datapoints """
+        return self.values[self.mask]
+
+    @property
+    def step(self):
+        """
+        The resolution of the series in seconds, inferred from the
+        timestamps. None if the series has less than two datapoints
+        """
+        if len(self.timestamps) < 2:
+            return None
+        return int(np.median(np.diff(self.timestamps)))
+
+    def count(self):
+        return int(np.count_nonzero(self.mask))
+
+    def sum(self):
+        return float(np.nansum(self.values))
+
+    def mean(self, default=None):
+        values = self.valid_values
+        if not len(values):
+            return default
+        return float(values.mean())
+
+    def max(self, default=None):
+        values = self.valid_values
+        if not len(values):
+            return default
+        return float(values.max())
+
+    def min(self, default=None):
+        values = self.valid_values
+        if not len(values):
+            return default
+        return float(values.min())
+
+    def first(self, default=None):
+        values = self.valid_values
+        if not len(values):
+            return default
+        return float(values[0])
+
+    def last(self, default=None):
+        values = self.valid_values
+        if not len(values):
+            return default
+        return float(values[-1])
+
+    def percentile(self, q, default=None):
+        """
+        :param q: a percentile (0-100) or a sequence of percentiles
+        :param default: returned when the series has no values
+        :return: a float, or an array of floats if q is a sequence
+        """
+        values = self.valid_values
+        if not len(values):
+            return default
+        result = np.percentile(values, q)
+        if np.ndim(result) == 0:
+            return float(result)
+        return result
+
+    def rate(self, per=1):
+        """
+        Converts a series of per-datapoint counts into a series of
+        rates, e.g. events per second.
+        :param per: the rate unit in seconds (1 - per second,
+                    60 - per minute)
+        :return: a new MetricSeries
+        """
+        step = self.step
+        if not step:
+            raise ValueError("Cannot compute a rate for a series with "
+                             "less than two datapoints")
+        return MetricSeries(self.target, self.timestamps,
+                            self.values * (float(per) / step))
+
+    def resample(self, minutes, how='mean'):
+        """
+        Aggregates the series into buckets of the given size
+        :param minutes: the bucket size in minutes
+        :param how: one of RESAMPLE_METHODS
+        :return: a new MetricSeries, one datapoint per bucket, stamped
+                 with the bucket's start time. Buckets without values
+                 are NaN (0 for 'sum' and 'count')
+        """
+        if how not in RESAMPLE_METHODS:
+            raise ValueError("Resample method '{how}' is not supported, "
+                             "please use one of those: {methods}"
+                             .format(how=how, methods=RESAMPLE_METHODS))
+        if not len(self):
+            return MetricSeries(self.target, [], [])
+
+        bucket_size = int(minutes * SECONDS_IN_MINUTE)
+        order = np.argsort(self.timestamps, kind='mergesort')
+        timestamps = self.timestamps[order]
+        values = self.values[order]
+        buckets = timestamps - timestamps % bucket_size
+        bucket_starts, starts = np.unique(buckets, return_index=True)
+
+        mask = ~np.isnan(values)
+        counts = np.add.reduceat(mask.astype(np.int64), starts)
+        if how == 'count':
+            result = counts.astype(np.float64)
+        elif how in ('sum', 'mean'):
+            result = np.add.reduceat(np.where(mask, values, 0.0), starts)
+            if how == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result = np.where(counts > 0, result / counts, np.nan)
+        elif how == 'max':
+            # fmax / fmin ignore NaN unless the whole bucket is NaN
+            result = np.fmax.reduceat(values, starts)
+        else:
+            result = np.fmin.reduceat(values, starts)
+        return MetricSeries(self.target, bucket_starts, result)
+
+    def to_datapoints(self):
+        """
+        Converts the series back to a graphite like list of
+        [<value>, <timestamp>] pairs
+        """
+        return [[None if np.isnan(value) else float(value), int(timestamp)]
+                for value, timestamp in zip(self.values, self.timestamps)]
+
+
+def series_from_response(response):
+    """
+    Converts the response of `Client.get_metrics_by_names` to a list
+    of MetricSeries, in the same order
+    """
+    return [MetricSeries.from_response(r) for r in response]
+
+
+class MetricsSnapshot(object):
+    """
+    The result of a single metrics request for several metrics,
+    exposing the values derived by the Client's metric helpers
+    (get_incoming_queue_metric, get_outputs_metrics, etc.)
+    """
+
+    def __init__(self, series, metric_names, minutes):
+        """
+        :param series: a list of MetricSeries, one per metric name in the
+                       same order
+        :param metric_names: the metric names that were requested
+        :param minutes: how many minutes back the snapshot covers
+        """
+        self.minutes = minutes
+        self.metric_names = list(metric_names)
+        series = list(series)
+        if len(series) == len(self.metric_names):
+            # the response is in the order of the request, and its targets
+            # may not be spelled like the requested names
+            self.series = dict(zip(self.metric_names, series))
+        else:
+            self.series = {s.target: s for s in series}
+
+    def __getitem__(self, metric_name):
+        """
+        :return: the MetricSeries of the given metric. A metric that was
+                 requested but returned no data is an empty series
+        """
+        if metric_name in self.series:
+            return self.series[metric_name]
+        if metric_name in self.metric_names:
+            return MetricSeries(metric_name, [], [])
+        raise KeyError("Metric '{name}' is not part of this snapshot, "
+                       "it contains: {metrics}"
+                       .format(name=metric_name, metrics=self.metric_names))
+
+    def __contains__(self, metric_name):
+        return metric_name in self.metric_names
+
+    def __repr__(self):
+        return '{cls}(minutes={minutes}, metrics={metrics})'.format(
+            cls=self.__class__.__name__, minutes=self.minutes,
+            metrics=self.metric_names)
+
+    @property
+    def incoming_queue(self):
+        """ The max number of events in the pipeline """
+        return _whole(self['EVENTS_IN_PIPELINE'].max(default=0))
+
+    @property
+    def outputs_metrics(self):
+        """
+        A tuple of the number of events erred / unmapped / discarded /
+        loaded, see `Client.get_outputs_metrics`
+        """
+        return tuple([_whole(self[name].sum()) for name in OUTPUTS_METRICS])
+
+    @property
+    def restream_queue(self):
+        """ The first non-empty number of events in transit """
+        return _whole(self['EVENTS_IN_TRANSIT'].first(default=0))
+
+    @property
+    def incoming_events_count(self):
+        return _whole(self['INCOMING_EVENTS'].sum())
+
+    @property
+    def average_event_size(self):
+        return self['EVENT_SIZE_AVG'].mean(default=0)
+
+    @property
+    def max_latency(self):
+        """ The max latency in seconds """
+        return self['LATENCY_MAX'].max(default=0) / 1000
+
+    def to_dict(self):
+        """
+        :return: a dict of all the derived values whose metrics are
+                 part of this snapshot
+        """
+        derived = {
+            'incoming_queue': ['EVENTS_IN_PIPELINE'],
+            'outputs_metrics': OUTPUTS_METRICS,
+            'restream_queue': ['EVENTS_IN_TRANSIT'],
+            'incoming_events_count': ['INCOMING_EVENTS'],
+            'average_event_size': ['EVENT_SIZE_AVG'],
+            'max_latency': ['LATENCY_MAX']
+        }
+        return {name: getattr(self, name)
+                for name, needed in derived.items()
+                if all(metric in self for metric in needed)}
@@ -0,0 +1,337 @@
+"""
+Compact representations of structure nodes, mapping fields and table
+columns, for holding many structure snapshots or mappings in memory.
+
+The API returns them as nested dicts, which cost a dict (and a string per
+key) for every node, field and column. The models here use `__slots__`,
+intern the names, types and categories shared between objects and
+snapshots, and share a single ColumnType between all the columns and
+fields with the same type. Sub-fields are kept in their raw form and only
+parsed on first access.
+
+Conversions are lossless: `Model.from_dict(d).to_dict() == d`. Keys the
+models don't know are kept as they are, so the dicts can be sent back
+with `Client.set_mapping` or `Client.edit_input` (which also accept the
+models themselves).
+
+Usage:
+    nodes = [Node.from_dict(node)
+             for node in api.get_structure()['nodes']]
+    event_type = EventType.from_dict(api.get_event_type('events'))
+    tables = [Table.from_dict(table) for table in api.get_tables()]
+"""
+import copy
+import threading
+
+from six.moves import intern
+
+# distinct column types are few, cache them up to this many
+MAX_SHARED_COLUMN_TYPES = 4096
+
+_MISSING = object()
+
+# value conversions of the spec tables
+_RAW = 'raw'
+_INTERNED = 'interned'
+_INTERNED_KEYS = 'interned_keys'
+
+
+def _intern(value):
+    try:
+        return intern(value)
+    except TypeError:
+        # not a str, e.g. unicode on python 2
+        return value
+
+
+class Model(object):
+    """
+    The base of the compact models. Subclasses list their known keys in
+    _SPEC as (attribute, JSON key, conversion) tuples, where conversion is
+    one of _RAW, _INTERNED, _INTERNED_KEYS, a Model subclass, or a
+    one-item list of a Model subclass for a lazily parsed list
+    """
+    __slots__ = ('_extra',)
+
+    _SPEC = ()
+    _BY_KEY = {}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: a dict in the API's format
+        """
+        self = cls.__new__(cls)
+        for attribute, _, _ in cls._SPEC:
+            setattr(self, attribute, _MISSING)
+        extra = None
+        for key, value in data.items():
+            spec = cls._BY_KEY.get(key)
+            if spec is None:
+                if extra is None:
+                    extra = {}
+                extra[_intern(key)] = value
+                continue
+            attribute, conversion = spec
+            setattr(self, attribute, _parse(conversion, value))
+        self._extra = extra
+        return self
+
+    def to_dict(self):
+        """
+        :return: a new dict equal to the one the model was parsed from,
+                 the values of unknown keys, stats and configuration are
+                 shared with the model
+        """
+        result = {}
+        for attribute, key, conversion in self._SPEC:
+            value = getattr(self, attribute)
+            if value is not _MISSING:
+                result[key] = _dump(conversion, value)
+        if self._extra:
+            result.update(self._extra)
+        return result
+
+    def get(self, key, default=None):
+        """
+        :return: the value of a JSON key, like dict.get
+        """
+        spec = self._BY_KEY.get(key)
+        if spec is None:
+            return (self._extra or {}).get(key, default)
+        # through the property of lazily parsed lists
+        value = getattr(self, spec[0].lstrip('_'))
+        return default if value is _MISSING else value
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{cls}({fields})'.format(
+            cls=type(self).__name__,
+            fields=', '.join('%s=%r' % (attribute, getattr(self, attribute))
+                             for attribute, _, conversion in self._SPEC
+                             if conversion in (_INTERNED, _RAW) and
+                             getattr(self, attribute) is not _MISSING))
+
+
+def _parse(conversion, value):
+    if value is None or conversion == _RAW:
+        return value
+    if conversion == _INTERNED:
+        return _intern(value)
+    if conversion == _INTERNED_KEYS:
+        if not isinstance(value, dict):
+            return value
+        return {_intern(key): item for key, item in value.items()}
+    if isinstance(conversion, list):
+        # parsed on first access, see _LazyList
+        return _LazyList(conversion[0], value)
+    return conversion.from_dict(value)
+
+
+def _dump(conversion, value):
+    if value is None or conversion in (_RAW, _INTERNED):
+        return value
+    if conversion == _INTERNED_KEYS:
+        return dict(value) if isinstance(value, dict) else value
+    if isinstance(value, _LazyList):
+        return value.to_list()
+    if isinstance(value, list):
+        return [item.to_dict() if isinstance(item, Model) else item
+                for item in value]
+    return value.to_dict() if isinstance(value, Model) else value
+
+
+class _LazyList(object):
+    """
+    A list of raw dicts, parsed into models on first access
+    """
+    __slots__ = ('model', 'raw')
+
+    def __init__(self, model, raw):
+        self.model = model
+        self.raw = raw
+
+    def parse(self):
+        return [self.model.from_dict(item) for item in self.raw]
+
+    def to_list(self):
+        return copy.deepcopy(self.raw)
+
+
+def _lazy_list_property(attribute):
+    def getter(self):
+        value = getattr(self, attribute)
+        if isinstance(value, _LazyList):
+            value = value.parse()
+            setattr(self, attribute, value)
+        return value
+
+    def setter(self, value):
+        setattr(self, attribute, value)
+
+    return property(getter, setter)
+
+
+def _model(cls):
+    """
+    Indexes a model's _SPEC by JSON key, and adds a property for every
+    lazily parsed list
+    """
+    cls._BY_KEY = {key: (attribute, conversion)
+                   for attribute, key, conversion in cls._SPEC}
+    for attribute, key, conversion in cls._SPEC:
+        if isinstance(conversion, list):
+            setattr(cls, attribute.lstrip('_'),
+                    _lazy_list_property(attribute))
+    return cls
+
+
+@_model
+class ColumnType(Model):
+    """
+    A column type, e.g. {'type': 'VARCHAR', 'length': 256,
+    'nonNull': False}. Equal column types are shared, use `of` to
+    create one and don't modify it
+    """
+    __slots__ = ('type', 'length', 'precision', 'scale', 'non_null')
+
+    _SPEC = (('type', 'type', _INTERNED),
+             ('length', 'length', _RAW),
+             ('precision', 'precision', _RAW),
+             ('scale', 'scale', _RAW),
+             ('non_null', 'nonNull', _RAW))
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def of(cls, data):
+        """
+        :return: the shared ColumnType equal to data
+        """
+        try:
+            # with the types, so True and 1 are not shared
+            key = tuple(sorted((name, type(value), value)
+                               for name, value in data.items()))
+            hash(key)
+        except TypeError:
+            # nested values, can't be shared
+            return super(ColumnType, cls).from_dict(data)
+        column_type = cls._shared.get(key)
+        if column_type is None:
+            column_type = super(ColumnType, cls).from_dict(data)
+            with cls._shared_lock:
+                if len(cls._shared) < MAX_SHARED_COLUMN_TYPES:
+                    column_type = cls._shared.setdefault(key, column_type)
+        return column_type
+
+    from_dict = of
+
+
+@_model
+class Column(Model):
+    """ A table column, in the format returned by `Client.get_tables` """
+    __slots__ = ('name', 'column_type', 'dist_key', 'primary_key',
+                 'sort_key_index')
+
+    _SPEC = (('name', 'columnName', _INTERNED),
+             ('column_type', 'columnType', ColumnType),
+             ('dist_key', 'distKey', _RAW),
+             ('primary_key', 'primaryKey', _RAW),
+             ('sort_key_index', 'sortKeyIndex', _RAW))
+
+
+@_model
+class Table(Model):
+    """ A table, in the format returned by `Client.get_tables` """
+    __slots__ = ('name', 'schema', '_columns')
+
+    _SPEC = (('name', 'tableName', _INTERNED),
+             ('schema', 'schema', _INTERNED),
+             ('_columns', 'columns', [Column]))
+
+
+@_model
+class FieldMapping(Model):
+    """ The mapping of a field to a column """
+    __slots__ = ('column_name', 'column_type', 'is_discarded')
+
+    _SPEC = (('column_name', 'columnName', _INTERNED),
+             ('column_type', 'columnType', ColumnType),
+             ('is_discarded', 'isDiscarded', _RAW))
+
+
+@_model
+class MappingField(Model):
+    """
+    A field of an event type's mapping, with its sub-fields (parsed on
+    first access)
+    """
+    __slots__ = ('name', 'mapping', 'stats', '_fields')
+
+    _SPEC = (('name', 'fieldName', _INTERNED),
+             ('mapping', 'mapping', FieldMapping),
+             ('stats', 'stats', _INTERNED_KEYS),
+             ('_fields', 'fields', []))
+
+
+# sub-fields are MappingFields too, which only exists now
+MappingField._SPEC[-1][2].append(MappingField)
+
+
+@_model
+class EventType(Model):
+    """
+    An event type, in the format returned by `Client.get_event_type`, with
+    its fields parsed on first access
+    """
+    __slots__ = ('name', 'mapping_mode', 'input_label', 'mapping', 'stats',
+                 '_fields')
+
+    _SPEC = (('name', 'name', _INTERNED),
+             ('mapping_mode', 'mappingMode', _INTERNED),
+             ('input_label', 'origInputLabel', _INTERNED),
+             ('mapping', 'mapping', _INTERNED_KEYS),
+             ('stats', 'stats', _INTERNED_KEYS),
+             ('_fields', 'fields', [MappingField]))
+
+
+@_model
+class Node(Model):
+    """
+    A structure node (an input, a processor or an output), in the format
+    of `Client.get_structure()['nodes']`
+    """
+    __slots__ = ('id', 'name', 'type', 'category', 'deleted',
+                 'configuration', 'stats')
+
+    _SPEC = (('id', 'id', _INTERNED),
+             ('name', 'name', _INTERNED),
+             ('type', 'type', _INTERNED),
+             ('category', 'category', _INTERNED),
+             ('deleted', 'deleted', _RAW),
+             ('configuration', 'configuration', _INTERNED_KEYS),
+             ('stats', 'stats', _INTERNED_KEYS))
+
+
+def nodes_from_structure(structure):
+    """
+    :param structure: the result of `Client.get_structure`
+    :return: a list of Node
+    """
+    return [Node.from_dict(node) for node in structure['nodes']]
+
+
+def to_dict(value):
+    """
+    :return: value as a dict if it is a Model, else value
+    """
+    return value.to_dict() if isinstance(value, Model) else value
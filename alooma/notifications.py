@@ -0,0 +1,133 @@
+import collections
+import json
+import os
+import threading
+import time
+
+DEFAULT_MIN_POLL_INTERVAL = 5
+DEFAULT_MAX_POLL_INTERVAL = 300
+DEFAULT_POLL_BACKOFF = 2.0
+
+# notification timestamps above this are in milliseconds
+_MILLISECONDS_THRESHOLD = 10 ** 11
+
+Notification = collections.namedtuple(
+    'Notification',
+    ['id', 'timestamp', 'type', 'severity', 'description', 'raw'])
+
+
+def _epoch_seconds(timestamp):
+    if timestamp > _MILLISECONDS_THRESHOLD:
+        return int(timestamp // 1000)
+    return int(timestamp)
+
+
+def _dedupe_key(message):
+    return '%s|%s|%s' % (message.get('id'), message.get('timestamp'),
+                         message.get('typeDescription'))
+
+
+class NotificationCursor(object):
+    """
+    The position of a notifications stream: the epoch second to poll
+    from, and the keys of the notifications already seen in that second
+    (the polls overlap by one second so that nothing is missed).
+    Optionally persisted to a JSON file.
+    """
+
+    def __init__(self, path=None, since=None):
+        """
+        :param path: optional path of a JSON file holding the cursor. If it
+                     exists, the stream resumes from it
+        :param since: epoch seconds to start from when there is no saved
+                      cursor, defaults to now
+        """
+        self.path = path
+        self.epoch = int(since if since is not None else time.time())
+        self.seen = set()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.epoch = state['epoch']
+            self.seen = set(state.get('seen', []))
+
+    def is_new(self, message):
+        timestamp = message.get('timestamp')
+        if timestamp is not None and _epoch_seconds(timestamp) < self.epoch:
+            return False
+        return _dedupe_key(message) not in self.seen
+
+    def advance(self, message):
+        timestamp = message.get('timestamp')
+        if timestamp is not None:
+            epoch = _epoch_seconds(timestamp)
+            if epoch > self.epoch:
+                self.epoch = epoch
+                self.seen = set()
+        self.seen.add(_dedupe_key(message))
+
+    def save(self):
+        if self.path is None:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'epoch': self.epoch, 'seen': sorted(self.seen)}, f)
+        os.rename(temp_path, self.path)
+
+
+def _to_notification(message):
+    return Notification(id=message.get('id'),
+                        timestamp=message.get('timestamp'),
+                        type=message.get('type'),
+                        severity=message.get('severity'),
+                        description=message.get('typeDescription'),
+                        raw=message)
+
+
+def stream_notifications(client, since=None, cursor=None, types=None,
+                         severities=None,
+                         min_interval=DEFAULT_MIN_POLL_INTERVAL,
+                         max_interval=DEFAULT_MAX_POLL_INTERVAL,
+                         backoff=DEFAULT_POLL_BACKOFF, stop_event=None,
+                         max_polls=None):
+    """
+    See `Client.stream_notifications`
+    """
+    if cursor is None or not isinstance(cursor, NotificationCursor):
+        cursor = NotificationCursor(path=cursor, since=since)
+    types = set(types) if types is not None else None
+    severities = set(s.lower() for s in severities) \
+        if severities is not None else None
+    stop_event = stop_event or threading.Event()
+
+    interval = min_interval
+    polls = 0
+    try:
+        while not stop_event.is_set():
+            response = client.get_notifications(cursor.epoch)
+            polls += 1
+            new_messages = 0
+            for message in response.get('messages') or []:
+                if not cursor.is_new(message):
+                    continue
+                cursor.advance(message)
+                new_messages += 1
+                # filter the raw dicts, objects are built only for matches
+                if types is not None and message.get('type') not in types:
+                    continue
+                if severities is not None and (message.get('severity') or
+                                               '').lower() not in severities:
+                    continue
+                yield _to_notification(message)
+            if new_messages:
+                cursor.save()
+                interval = min_interval
+            else:
+                interval = min(interval * backoff, max_interval)
+
+            if max_polls is not None and polls >= max_polls:
+                return
+            stop_event.wait(interval)
+    finally:
+        # also keeps the position when the consumer stops mid batch
+        cursor.save()
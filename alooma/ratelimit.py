@@ -0,0 +1,324 @@
+"""
+Client side rate limiting of the requests sent to an Alooma account.
+
+A RateLimiter sorts requests into endpoint classes, reads and writes by
+default, and gives every class a token bucket (requests per second, with
+a burst) and a max number of requests in flight. Writes such as
+set_mapping or create_input get a stricter limit than reads.
+
+When the server answers 429 or 503, the class's rate is halved (and the
+bucket paused for the Retry-After period, if given). Every successful
+request raises the rate back a little, by recovery_step of the configured
+rate per second of traffic, up to the configured rate, so bulk jobs
+settle at the fastest rate the account accepts.
+
+With `shared_dir`, the token buckets are files locked with flock, shared
+by every process using the same directory and key. The in-flight limit
+always applies per process.
+
+Usage:
+    limiter = RateLimiter(key='my-account')
+    api = alooma.Client(username, password, rate_limiter=limiter)
+
+Use one limiter per account, shared by all the clients and threads
+sending requests to it.
+"""
+import collections
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+ENDPOINT_CLASS_READ = 'read'
+ENDPOINT_CLASS_WRITE = 'write'
+
+READ_METHODS = ['GET', 'HEAD', 'OPTIONS']
+
+THROTTLE_STATUSES = [429, 503]
+
+# requests per second, the bucket size, and the max requests in flight
+RateLimit = collections.namedtuple('RateLimit',
+                                   ['rate', 'burst', 'max_in_flight'])
+
+DEFAULT_LIMITS = {
+    ENDPOINT_CLASS_READ: RateLimit(rate=10, burst=20, max_in_flight=8),
+    ENDPOINT_CLASS_WRITE: RateLimit(rate=2, burst=4, max_in_flight=2),
+}
+
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_RECOVERY_STEP = 0.05
+DEFAULT_MIN_RATE_FRACTION = 0.05
+DEFAULT_MAX_RETRIES = 3
+# throttled responses within this many seconds of a slowdown are taken as
+# part of it, so concurrent requests don't divide the rate several times
+SLOWDOWN_COOLDOWN = 1.0
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        """
+        :param rate: tokens added per second
+        :param burst: the max number of tokens
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _take(self, now):
+        """
+        :return: 0 if a token was taken, else the seconds to wait for one
+        """
+        with self._lock:
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        Blocks until a token is available
+        :return: the seconds waited
+        """
+        waited = 0
+        while True:
+            wait = self._take(time.time())
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = float(rate)
+
+    def pause(self, seconds):
+        """ Hands out no tokens for the next seconds """
+        with self._lock:
+            self._paused_until = max(self._paused_until,
+                                     time.time() + seconds)
+            self._tokens = 0
+
+
+class FileTokenBucket(TokenBucket):
+    def __init__(self, path, rate, burst):
+        """
+        A token bucket whose state is kept in a file, shared by all the
+        processes using it. The rate is per process (see set_rate), the
+        tokens and pauses are shared
+        :param path: the bucket file
+        """
+        if fcntl is None:
+            raise Exception('Sharing rate limits between processes '
+                            'requires fcntl (a POSIX system)')
+        super(FileTokenBucket, self).__init__(rate, burst)
+        self.path = path
+
+    @contextlib.contextmanager
+    def _state(self):
+        """ Yields the locked state dict, and writes it back """
+        with self._lock:
+            with open(self.path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read())
+                    except ValueError:
+                        state = {'tokens': self.burst,
+                                 'updated': time.time(), 'paused_until': 0}
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _take(self, now):
+        with self._state() as state:
+            if now < state['paused_until']:
+                return state['paused_until'] - now
+            state['tokens'] = min(self.burst, state['tokens'] +
+                                  max(now - state['updated'], 0) * self.rate)
+            state['updated'] = now
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+                return 0
+            return (1 - state['tokens']) / self.rate
+
+    def pause(self, seconds):
+        with self._state() as state:
+            state['paused_until'] = max(state['paused_until'],
+                                        time.time() + seconds)
+            state['tokens'] = 0
+
+
+class _EndpointClass(object):
+    def __init__(self, limit, bucket, min_rate_fraction):
+        self.limit = limit
+        self.bucket = bucket
+        self.in_flight = threading.BoundedSemaphore(limit.max_in_flight)
+        self.min_rate = limit.rate * min_rate_fraction
+        self.last_slowdown = 0
+
+
+class RateLimiter(object):
+    def __init__(self, limits=None, endpoint_classes=None, key='default',
+                 shared_dir=None, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 recovery_step=DEFAULT_RECOVERY_STEP,
+                 min_rate_fraction=DEFAULT_MIN_RATE_FRACTION,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        """
+        :param limits: a dict from endpoint class to RateLimit, merged with
+                       DEFAULT_LIMITS
+        :param endpoint_classes: optional list of (regex, class) pairs,
+                                 checked in order against the URL
+                                 before the read / write classes, e.g.
+                                 [(r'/metrics', 'metrics')]
+        :param key: the name of the limited account, used in the names of
+                    the shared bucket files
+        :param shared_dir: optional directory for bucket files shared with
+                           other processes
+        :param backoff_factor: the rate multiplier on 429 / 503
+        :param recovery_step: the fraction of the configured rate added
+                              back per second of successful requests
+        :param min_rate_fraction: the rate never goes below this fraction
+                                  of the configured rate
+        :param max_retries: the max number of times a throttled request is
+                            sent again (503 only for reads)
+        """
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.endpoint_classes = [(re.compile(pattern), name)
+                                 for pattern, name in endpoint_classes or []]
+        self.key = key
+        self.shared_dir = shared_dir
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+        self.min_rate_fraction = min_rate_fraction
+        self.max_retries = max_retries
+        self.throttled = 0
+        self.waited = 0.0
+        self._classes = {}
+        self._lock = threading.Lock()
+        if shared_dir and not os.path.isdir(shared_dir):
+            os.makedirs(shared_dir)
+
+    def endpoint_class(self, method, url):
+        """
+        :return: the endpoint class of a request
+        """
+        for regex, name in self.endpoint_classes:
+            if regex.search(url):
+                return name
+        return ENDPOINT_CLASS_READ if method.upper() in READ_METHODS \
+            else ENDPOINT_CLASS_WRITE
+
+    def _class(self, name):
+        with self._lock:
+            endpoint_class = self._classes.get(name)
+            if endpoint_class is None:
+                limit = self.limits.get(name,
+                                        self.limits[ENDPOINT_CLASS_READ])
+                if self.shared_dir:
+                    bucket = FileTokenBucket(
+                        os.path.join(self.shared_dir, '%s-%s.bucket'
+                                     % (self.key, name)),
+                        limit.rate, limit.burst)
+                else:
+                    bucket = TokenBucket(limit.rate, limit.burst)
+                endpoint_class = _EndpointClass(limit, bucket,
+                                                self.min_rate_fraction)
+                self._classes[name] = endpoint_class
+            return endpoint_class
+
+    def rate(self, name):
+        """
+        :return: the current rate of an endpoint class
+        """
+        return self._class(name).bucket.rate
+
+    @contextlib.contextmanager
+    def limit(self, method, url):
+        """
+        Waits for a token and an in-flight slot of the request's class,
+        and holds the slot until the block exits
+        """
+        endpoint_class = self._class(self.endpoint_class(method, url))
+        endpoint_class.in_flight.acquire()
+        try:
+            waited = endpoint_class.bucket.acquire()
+            if waited:
+                with self._lock:
+                    self.waited += waited
+            yield
+        finally:
+            endpoint_class.in_flight.release()
+
+    def update(self, method, url, response):
+        """
+        Adapts the rate of the request's class to its response
+        """
+        endpoint_class = self._class(self.endpoint_class(method, url))
+        bucket = endpoint_class.bucket
+        if response.status_code not in THROTTLE_STATUSES:
+            if bucket.rate < endpoint_class.limit.rate:
+                # at the current rate, the steps add up to recovery_step of
+                # the configured rate per second
+                step = endpoint_class.limit.rate * self.recovery_step / \
+                    bucket.rate
+                bucket.set_rate(min(endpoint_class.limit.rate,
+                                    bucket.rate + step))
+            return
+
+        now = time.time()
+        with self._lock:
+            self.throttled += 1
+            slow_down = now - endpoint_class.last_slowdown > \
+                SLOWDOWN_COOLDOWN
+            if slow_down:
+                endpoint_class.last_slowdown = now
+        if slow_down:
+            bucket.set_rate(max(endpoint_class.min_rate,
+                                bucket.rate * self.backoff_factor))
+        # drop the burst, and wait out the Retry-After period if given
+        bucket.pause(_retry_after(response) or 0)
+
+    def should_retry(self, method, response, attempt):
+        """
+        :param attempt: the number of retries already made
+        :return: whether to send a throttled request again
+        """
+        if attempt >= self.max_retries:
+            return False
+        if response.status_code == 429:
+            return True
+        return response.status_code == 503 and \
+            method.upper() in READ_METHODS
+
+
+def _retry_after(response):
+    """
+    :return: the seconds of the Retry-After header, None if missing or
+             given as a date
+    """
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
@@ -0,0 +1,422 @@
+"""
+Brings an account to the state described by a `Client.get_config` export
+or by a backup from alooma.backup.ConfigBackupStore.
+
+A restore is done in two phases:
+    plan = engine.plan(config)    # compares with the live account
+    report = engine.apply(plan)   # runs the needed steps
+
+The plan holds one step per resource (output, email notification
+settings, code engine modules, inputs and event type mappings), each with
+the resources it depends on. Resources which are already identical in the
+live account are skipped. Independent steps run in parallel, in waves of
+steps whose dependencies are done. When a state file is given, every
+completed step is recorded in it with a fingerprint of its payload, and
+a later apply of the same plan resumes after the last failure. Recorded
+steps whose fingerprint doesn't match the plan being applied, e.g. of a
+restore of another backup, are run again.
+"""
+import copy
+import json
+import os
+import threading
+
+from .alooma import FailedRestCallException, remove_stats
+from .backup import canonical_json, content_hash
+from .concurrency import DEFAULT_MAX_WORKERS, run_concurrently
+
+NOT_FOUND = 404
+
+STEP_OUTPUT = 'output'
+STEP_EMAIL_NOTIFICATIONS = 'email_notifications'
+STEP_TRANSFORM = 'transform'
+STEP_INPUT = 'input'
+STEP_MAPPING = 'mapping'
+
+ACTION_CREATE = 'create'
+ACTION_UPDATE = 'update'
+ACTION_SKIP = 'skip'
+
+STATUS_DONE = 'done'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+STATUS_BLOCKED = 'blocked'
+
+# input types which exist in every account and are never restored
+SYSTEM_INPUT_TYPES = ['RESTREAM', 'AGENT']
+
+# node attributes which are not part of an input's desired state
+INPUT_STATE_KEYS = ['name', 'type', 'configuration']
+
+
+def _as_dict(value, key_field):
+    """ Accepts a dict, or a list of dicts keyed by key_field """
+    if value is None:
+        return {}
+    if isinstance(value, dict):
+        return value
+    return {item[key_field]: item for item in value}
+
+
+def desired_state_from_config(config):
+    """
+    Extracts the restorable resources of a `Client.get_config` export
+    :param config: a dict with any of the following keys:
+        'inputs': a list of input nodes (name, type, configuration)
+        'mappings': event types by name, or a list of event types,
+                    in the format returned by `Client.get_mapping`
+        'transforms': code by module name, or a list of
+                      {'functionName', 'code'} code snippets
+        'output': the output node, or its configuration
+        'settings': a dict which may contain 'emailNotifications'
+    :return: a dict with 'inputs', 'mappings', 'transforms', 'output' and
+             'email_notifications' keys
+    """
+    transforms = config.get('transforms') or {}
+    if not isinstance(transforms, dict):
+        transforms = {item['functionName']: item['code']
+                      for item in transforms}
+    transforms = {name: item['code'] if isinstance(item, dict) else item
+                  for name, item in transforms.items()}
+
+    inputs = {}
+    for node in config.get('inputs') or []:
+        if node.get('type') in SYSTEM_INPUT_TYPES or node.get('deleted'):
+            continue
+        inputs[node['name']] = {key: node.get(key)
+                                for key in INPUT_STATE_KEYS}
+
+    mappings = {name: remove_stats(copy.deepcopy(mapping)) for name, mapping
+                in _as_dict(config.get('mappings'), 'name').items()}
+
+    settings = config.get('settings') or {}
+    return {
+        'inputs': inputs,
+        'mappings': mappings,
+        'transforms': transforms,
+        'output': config.get('output'),
+        'email_notifications': settings.get('emailNotifications')
+    }
+
+
+class RestoreStep(object):
+    def __init__(self, kind, name, action, payload=None, depends_on=None):
+        """
+        :param kind: one of the STEP_* kinds
+        :param name: the resource name, e.g. the event type
+        :param action: ACTION_CREATE, ACTION_UPDATE or ACTION_SKIP when the
+                       live resource is already identical
+        :param payload: the desired state of the resource
+        :param depends_on: a list of step ids which must be done first
+        """
+        self.kind = kind
+        self.name = name
+        self.action = action
+        self.payload = payload
+        self.depends_on = depends_on or []
+
+    @property
+    def id(self):
+        if self.name is None:
+            return self.kind
+        return '%s:%s' % (self.kind, self.name)
+
+    @property
+    def fingerprint(self):
+        """ A hash of the step's resource and desired state """
+        return content_hash(canonical_json([self.kind, self.name,
+                                            self.payload]))
+
+    def __repr__(self):
+        return '{cls}({id!r}, {action!r})'.format(
+            cls=self.__class__.__name__, id=self.id, action=self.action)
+
+
+class RestorePlan(object):
+    def __init__(self, steps):
+        self.steps = steps
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    @property
+    def pending(self):
+        return [step for step in self.steps if step.action != ACTION_SKIP]
+
+    def summary(self):
+        """
+        :return: a dict from step kind to a dict from action to count
+        """
+        summary = {}
+        for step in self.steps:
+            actions = summary.setdefault(step.kind, {})
+            actions[step.action] = actions.get(step.action, 0) + 1
+        return summary
+
+
+class RestoreReport(object):
+    def __init__(self, plan):
+        self.plan = plan
+        self.statuses = {}
+        self.errors = {}
+
+    @property
+    def ok(self):
+        return not self.errors and all(
+            status in (STATUS_DONE, STATUS_SKIPPED)
+            for status in self.statuses.values())
+
+    def steps_with_status(self, status):
+        return [step for step in self.plan
+                if self.statuses.get(step.id) == status]
+
+
+class RestoreEngine(object):
+    def __init__(self, client, max_workers=DEFAULT_MAX_WORKERS,
+                 state_path=None):
+        """
+        :param client: an alooma.Client of the account to restore into
+        :param max_workers: the max number of steps running at once
+        :param state_path: optional path of a JSON file recording the
+                           completed steps, used to resume after a failure
+        """
+        self.client = client
+        self.max_workers = max_workers
+        self.state_path = state_path
+        self._state_lock = threading.Lock()
+
+    def _live_state(self, desired):
+        """ Fetches the live resources the desired state refers to """
+        client = self.client
+        jobs = [('inputs', None), ('transforms', None)]
+        if desired['output'] is not None:
+            jobs.append(('output', None))
+        if desired['email_notifications'] is not None:
+            jobs.append(('settings', None))
+        jobs.extend(('mapping', name) for name in desired['mappings'])
+
+        def fetch(job):
+            kind, name = job
+            if kind == 'inputs':
+                return client.get_inputs(with_stats=False)
+            if kind == 'transforms':
+                return client.get_all_transforms()
+            if kind == 'output':
+                return client.get_output_node()
+            if kind == 'settings':
+                return client.get_settings()
+            try:
+                return client.get_mapping(name)
+            except FailedRestCallException as e:
+                if e.status_code == NOT_FOUND:
+                    # the event type does not exist yet
+                    return None
+                raise
+
+        live = {'mappings': {}}
+        for (kind, name), (result, error) in \
+                zip(jobs, run_concurrently(fetch, jobs, self.max_workers)):
+            if error is not None:
+                raise error
+            if kind == 'mapping':
+                live['mappings'][name] = result
+            else:
+                live[kind] = result
+        return live
+
+    def plan(self, config):
+        """
+        Computes the steps needed to bring the live account to the state
+        of a configuration export
+        :param config: the output of `Client.get_config`, see
+                       `desired_state_from_config`
+        :return: a RestorePlan
+        """
+        desired = desired_state_from_config(config)
+        live = self._live_state(desired)
+        steps = []
+
+        output_ids = []
+        if desired['output'] is not None:
+            output = desired['output']
+            output_config = output.get('configuration', output)
+            live_config = (live.get('output') or {}).get('configuration')
+            action = ACTION_SKIP if _same(output_config, live_config) \
+                else ACTION_UPDATE
+            step = RestoreStep(STEP_OUTPUT, None, action,
+                               {'configuration': output_config,
+                                'name': output.get('name')})
+            steps.append(step)
+            output_ids.append(step.id)
+
+        if desired['email_notifications'] is not None:
+            live_settings = (live.get('settings') or {}) \
+                .get('emailNotifications')
+            action = ACTION_SKIP if _same(desired['email_notifications'],
+                                          live_settings) else ACTION_UPDATE
+            steps.append(RestoreStep(STEP_EMAIL_NOTIFICATIONS, None, action,
+                                     desired['email_notifications']))
+
+        transform_ids = []
+        for name, code in sorted(desired['transforms'].items()):
+            live_code = live['transforms'].get(name)
+            if live_code == code:
+                action = ACTION_SKIP
+            else:
+                action = ACTION_CREATE if live_code is None \
+                    else ACTION_UPDATE
+            step = RestoreStep(STEP_TRANSFORM, name, action, code)
+            steps.append(step)
+            transform_ids.append(step.id)
+
+        live_inputs = {node['name']: node for node in live['inputs']}
+        input_ids = []
+        for name, node in sorted(desired['inputs'].items()):
+            live_node = live_inputs.get(name)
+            payload = copy.deepcopy(node)
+            if live_node is None:
+                action = ACTION_CREATE
+            elif live_node['type'] == node['type'] and \
+                    _same(live_node.get('configuration'),
+                          node.get('configuration')):
+                action = ACTION_SKIP
+            else:
+                action = ACTION_UPDATE
+                payload['id'] = live_node['id']
+            step = RestoreStep(STEP_INPUT, name, action, payload, output_ids)
+            steps.append(step)
+            input_ids.append(step.id)
+
+        for name, mapping in sorted(desired['mappings'].items()):
+            live_mapping = live['mappings'].get(name)
+            if live_mapping is None:
+                action = ACTION_CREATE
+            elif _same(mapping, live_mapping):
+                action = ACTION_SKIP
+            else:
+                action = ACTION_UPDATE
+            # event types are created by the inputs and the code engine
+            steps.append(RestoreStep(STEP_MAPPING, name, action, mapping,
+                                     input_ids + transform_ids))
+
+        return RestorePlan(steps)
+
+    def _apply_step(self, step):
+        client = self.client
+        if step.kind == STEP_OUTPUT:
+            config = copy.deepcopy(step.payload['configuration'])
+            client.set_output(config, step.payload['name'])
+        elif step.kind == STEP_EMAIL_NOTIFICATIONS:
+            client.set_settings_email_notifications(step.payload)
+        elif step.kind == STEP_TRANSFORM:
+            client.set_transform(step.payload, module_name=step.name)
+        elif step.kind == STEP_INPUT:
+            payload = copy.deepcopy(step.payload)
+            if step.action == ACTION_CREATE:
+                client.create_input(payload, one_click=False)
+            else:
+                client.edit_input(payload)
+        elif step.kind == STEP_MAPPING:
+            client.set_mapping(copy.deepcopy(step.payload), step.name)
+        else:
+            raise ValueError('Unknown restore step kind: %s' % step.kind)
+
+    def _load_completed(self, plan):
+        """
+        :return: a dict from the id of every recorded step of the plan to
+                 its fingerprint, steps recorded with another fingerprint
+                 (or without one) are left out
+        """
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            recorded = json.load(f).get('completed')
+        if not isinstance(recorded, dict):
+            return {}
+        return {step.id: step.fingerprint for step in plan
+                if recorded.get(step.id) == step.fingerprint}
+
+    def _save_completed(self, completed):
+        if self.state_path is None:
+            return
+        with self._state_lock:
+            temp_path = self.state_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'completed': completed}, f, sort_keys=True)
+            os.rename(temp_path, self.state_path)
+
+    def apply(self, plan):
+        """
+        Runs the plan's steps, in parallel waves of steps whose
+        dependencies are done. Steps which depend on a failed step are
+        not run and reported as blocked
+        :param plan: a RestorePlan
+        :return: a RestoreReport
+        """
+        report = RestoreReport(plan)
+        completed = self._load_completed(plan)
+        remaining = []
+        for step in plan:
+            if step.action == ACTION_SKIP or step.id in completed:
+                report.statuses[step.id] = STATUS_SKIPPED
+            else:
+                remaining.append(step)
+
+        while remaining:
+            ready, waiting = [], []
+            for step in remaining:
+                statuses = [report.statuses.get(dependency)
+                            for dependency in step.depends_on]
+                if any(status in (STATUS_FAILED, STATUS_BLOCKED)
+                       for status in statuses):
+                    report.statuses[step.id] = STATUS_BLOCKED
+                elif all(status is not None for status in statuses):
+                    ready.append(step)
+                else:
+                    waiting.append(step)
+            if not ready:
+                for step in waiting:
+                    report.statuses[step.id] = STATUS_BLOCKED
+                break
+
+            results = run_concurrently(self._apply_step, ready,
+                                       self.max_workers)
+            for step, (_, error) in zip(ready, results):
+                if error is None:
+                    report.statuses[step.id] = STATUS_DONE
+                    completed[step.id] = step.fingerprint
+                else:
+                    report.statuses[step.id] = STATUS_FAILED
+                    report.errors[step.id] = error
+            self._save_completed(completed)
+            remaining = waiting
+
+        if report.ok and self.state_path is not None \
+                and os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return report
+
+    def restore(self, config):
+        """
+        Plans and applies a restore, see `plan` and `apply`
+        :return: a RestoreReport
+        """
+        return self.apply(self.plan(config))
+
+    def restore_backup(self, store, backup_id=None):
+        """
+        Restores a backup from an alooma.backup.ConfigBackupStore
+        :param store: the ConfigBackupStore
+        :param backup_id: the backup to restore, defaults to the latest
+        :return: a RestoreReport
+        """
+        backup_id = backup_id or store.latest_backup()
+        return self.restore(store.restore(backup_id))
+
+
+def _same(desired, live):
+    return json.dumps(desired, sort_keys=True) == \
+        json.dumps(live, sort_keys=True)
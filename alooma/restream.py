@@ -0,0 +1,185 @@
+"""
+Restream orchestration: starts a restream and tracks how fast the
+Restream Queue drains.
+
+Each poll costs two requests (the structure for `availbleForRestream`,
+and the `EVENTS_IN_TRANSIT` metric). The interval between polls adapts to
+the estimated time left, so a long restream is polled rarely and a short
+one often.
+
+Usage:
+    controller = RestreamController(client)
+    controller.start()
+    progress = controller.wait(on_progress=print)
+"""
+import collections
+import threading
+import time
+
+import numpy as np
+
+from .alooma import restream_stats_from_structure
+
+DEFAULT_MIN_POLL_INTERVAL = 5
+DEFAULT_MAX_POLL_INTERVAL = 120
+DEFAULT_STALL_TIMEOUT = 600
+DEFAULT_RATE_WINDOW = 10
+
+# the fraction of the ETA to wait between polls
+POLL_ETA_FRACTION = 0.1
+
+IN_TRANSIT_METRIC = 'EVENTS_IN_TRANSIT'
+IN_TRANSIT_MINUTES = 5
+
+# A sample of a restream's progress:
+# available - events still available for restream
+# in_transit - the last value of the EVENTS_IN_TRANSIT metric
+# drained - events drained since the first sample
+# drain_rate - events per second drained, over the recent samples
+# eta - estimated seconds until the queue is empty, None if unknown
+# done - the queue is empty and no events are in transit
+# stalled - nothing drained for longer than the stall timeout
+RestreamProgress = collections.namedtuple(
+    'RestreamProgress',
+    ['timestamp', 'available', 'in_transit', 'drained', 'drain_rate',
+     'eta', 'done', 'stalled'])
+
+
+class RestreamController(object):
+    def __init__(self, client, min_interval=DEFAULT_MIN_POLL_INTERVAL,
+                 max_interval=DEFAULT_MAX_POLL_INTERVAL,
+                 stall_timeout=DEFAULT_STALL_TIMEOUT,
+                 window=DEFAULT_RATE_WINDOW):
+        """
+        :param client: an alooma.Client
+        :param min_interval: the shortest interval between polls
+        :param max_interval: the longest interval between polls
+        :param stall_timeout: seconds without any drained event after
+                              which the restream is considered stalled
+        :param window: the number of recent samples the drain rate is
+                       computed from
+        """
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stall_timeout = stall_timeout
+        self.window = window
+        self.samples = collections.deque(maxlen=window)
+        self.history = []
+        self._callbacks = []
+        self._initial = None
+        self._last_drain_time = None
+
+    def add_progress_callback(self, callback):
+        """
+        :param callback: called with a RestreamProgress after every poll
+        """
+        self._callbacks.append(callback)
+
+    def start(self):
+        """
+        Starts the restream and takes the first sample
+        :return: the first RestreamProgress
+        """
+        self.client.start_restream()
+        return self.poll()
+
+    def poll(self):
+        """
+        Samples the Restream Queue
+        :return: a RestreamProgress
+        """
+        now = time.time()
+        available = restream_stats_from_structure(
+            self.client.get_structure())['number_of_events']
+        series = self.client.get_metrics_by_names(
+            IN_TRANSIT_METRIC, IN_TRANSIT_MINUTES, as_series=True)
+        in_transit = series[0].last(default=0) if series else 0
+
+        if self._initial is None:
+            self._initial = available
+        if not self.samples or available < self.samples[-1][1] or \
+                self._last_drain_time is None:
+            self._last_drain_time = now
+        self.samples.append((now, available))
+
+        drain_rate = self._drain_rate()
+        eta = None
+        if available == 0:
+            eta = 0.0
+        elif drain_rate:
+            eta = available / drain_rate
+        done = available == 0 and not in_transit
+        stalled = not done and \
+            now - self._last_drain_time > self.stall_timeout
+
+        progress = RestreamProgress(timestamp=now, available=available,
+                                    in_transit=in_transit,
+                                    drained=max(self._initial - available,
+                                                0),
+                                    drain_rate=drain_rate, eta=eta,
+                                    done=done, stalled=stalled)
+        self.history.append(progress)
+        for callback in self._callbacks:
+            callback(progress)
+        return progress
+
+    def _drain_rate(self):
+        """
+        The negated least squares slope of the available events over the
+        recent samples, in events per second. None with less than two
+        samples, 0 when the queue is not draining
+        """
+        if len(self.samples) < 2:
+            return None
+        times, available = np.array(self.samples, dtype=np.float64).T
+        if times[-1] == times[0]:
+            return None
+        rate = -float(np.polyfit(times - times[0], available, 1)[0])
+        return rate if rate > 0 else 0.0
+
+    def next_interval(self, progress):
+        """
+        :return: the seconds to wait before the next poll, a fraction of
+                 the ETA, bounded by min_interval and max_interval
+        """
+        if progress.eta is None:
+            return self.min_interval
+        return min(max(progress.eta * POLL_ETA_FRACTION, self.min_interval),
+                   self.max_interval)
+
+    def wait(self, timeout=None, on_progress=None, stop_event=None):
+        """
+        Polls until the restream is done or stalled
+        :param timeout: optional max seconds to wait
+        :param on_progress: optional callback, called with every
+                            RestreamProgress
+        :param stop_event: optional threading.Event to stop waiting
+        :return: the last RestreamProgress. Check its `done` and `stalled`
+                 fields, neither is set if the timeout passed
+        """
+        stop_event = stop_event or threading.Event()
+        deadline = time.time() + timeout if timeout is not None else None
+        progress = self.history[-1] if self.history else self.poll()
+        if on_progress is not None:
+            on_progress(progress)
+        while not (progress.done or progress.stalled):
+            interval = self.next_interval(progress)
+            if deadline is not None:
+                interval = min(interval, deadline - time.time())
+                if interval <= 0:
+                    break
+            if stop_event.wait(interval):
+                break
+            progress = self.poll()
+            if on_progress is not None:
+                on_progress(progress)
+        return progress
+
+    def run(self, timeout=None, on_progress=None, stop_event=None):
+        """
+        Starts the restream and waits for it, see `start` and `wait`
+        """
+        self.start()
+        return self.wait(timeout=timeout, on_progress=on_progress,
+                         stop_event=stop_event)
@@ -0,0 +1,189 @@
+from .concurrency import DEFAULT_MAX_WORKERS, run_concurrently
+
+TABLE_SYNC_CREATE = 'create'
+TABLE_SYNC_ALTER = 'alter'
+TABLE_SYNC_UNCHANGED = 'unchanged'
+
+# column attributes compared when they are part of the desired spec
+COLUMN_SPEC_KEYS = ['distKey', 'sortKeyIndex', 'primaryKey']
+
+
+class TableSyncAction(object):
+    def __init__(self, table_name, action, columns, changes=None):
+        """
+        :param table_name: the table to sync
+        :param action: one of TABLE_SYNC_CREATE, TABLE_SYNC_ALTER or
+                       TABLE_SYNC_UNCHANGED
+        :param columns: the desired columns of the table
+        :param changes: a list of human readable differences found
+        """
+        self.table_name = table_name
+        self.action = action
+        self.columns = columns
+        self.changes = changes or []
+
+    def __repr__(self):
+        return '{cls}({table!r}, {action!r}, changes={changes})'.format(
+            cls=self.__class__.__name__, table=self.table_name,
+            action=self.action, changes=len(self.changes))
+
+
+class TableSyncResult(object):
+    def __init__(self, action, response=None, error=None):
+        self.action = action
+        self.response = response
+        self.error = error
+
+    @property
+    def table_name(self):
+        return self.action.table_name
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '{cls}({table!r}, {action!r}, ok={ok})'.format(
+            cls=self.__class__.__name__, table=self.table_name,
+            action=self.action.action, ok=self.ok)
+
+
+class TableSyncReport(object):
+    def __init__(self, plan, results=None):
+        """
+        :param plan: a list of TableSyncAction, one per desired table
+        :param results: a list of TableSyncResult, one per applied action
+        """
+        self.plan = plan
+        self.results = results or []
+
+    @property
+    def changes(self):
+        """ The planned actions which are not TABLE_SYNC_UNCHANGED """
+        return [a for a in self.plan if a.action != TABLE_SYNC_UNCHANGED]
+
+    @property
+    def errors(self):
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def summary(self):
+        """
+        :return: a dict from action to the number of tables planned for it
+        """
+        summary = {TABLE_SYNC_CREATE: 0, TABLE_SYNC_ALTER: 0,
+                   TABLE_SYNC_UNCHANGED: 0}
+        for action in self.plan:
+            summary[action.action] += 1
+        return summary
+
+
+def _normalize_desired_tables(desired_tables):
+    """
+    Accepts either a dict from table name to columns, or a list of tables
+    in the format returned by `Client.get_tables`
+    """
+    if isinstance(desired_tables, dict):
+        return list(desired_tables.items())
+    return [(table['tableName'], table['columns'])
+            for table in desired_tables]
+
+
+def _column_type_differences(desired_type, current_type):
+    differences = []
+    current_type = current_type or {}
+    for key, value in (desired_type or {}).items():
+        current_value = current_type.get(key)
+        if key == 'type' and value is not None and current_value is not None:
+            equal = value.upper() == current_value.upper()
+        else:
+            equal = value == current_value
+        if not equal:
+            differences.append('columnType.{key}: {current!r} -> '
+                               '{desired!r}'.format(key=key,
+                                                    current=current_value,
+                                                    desired=value))
+    return differences
+
+
+def diff_table_columns(desired_columns, current_columns):
+    """
+    Compares desired column specs to the server's columns. Only the
+    attributes present in each desired column are compared, and columns
+    that exist only on the server are ignored
+    :param desired_columns: a list of column dicts, see
+                            `Client.create_table`
+    :param current_columns: a list of column dicts from `Client.get_tables`
+    :return: a list of human readable differences, empty if none
+    """
+    current_by_name = {column['columnName']: column
+                       for column in current_columns or []}
+    changes = []
+    for column in desired_columns:
+        name = column['columnName']
+        current = current_by_name.get(name)
+        if current is None:
+            changes.append('{name}: missing column'.format(name=name))
+            continue
+        differences = _column_type_differences(column.get('columnType'),
+                                               current.get('columnType'))
+        for key in COLUMN_SPEC_KEYS:
+            if key in column and column[key] != current.get(key):
+                differences.append('{key}: {current!r} -> {desired!r}'
+                                   .format(key=key,
+                                           current=current.get(key),
+                                           desired=column[key]))
+        changes.extend('{name}: {difference}'.format(name=name,
+                                                     difference=difference)
+                       for difference in differences)
+    return changes
+
+
+def plan_table_sync(desired_tables, current_tables):
+    """
+    :param desired_tables: a dict from table name to columns, or a list of
+                           tables in the format returned by
+                           `Client.get_tables`
+    :param current_tables: the output of `Client.get_tables`
+    :return: a list of TableSyncAction, one per desired table
+    """
+    current_by_name = {table['tableName']: table
+                       for table in current_tables}
+    plan = []
+    for table_name, columns in _normalize_desired_tables(desired_tables):
+        current = current_by_name.get(table_name)
+        if current is None:
+            plan.append(TableSyncAction(table_name, TABLE_SYNC_CREATE,
+                                        columns, ['missing table']))
+            continue
+        changes = diff_table_columns(columns, current.get('columns'))
+        action = TABLE_SYNC_ALTER if changes else TABLE_SYNC_UNCHANGED
+        plan.append(TableSyncAction(table_name, action, columns, changes))
+    return plan
+
+
+def sync_tables(client, desired_tables, schema=None,
+                max_workers=DEFAULT_MAX_WORKERS, dry_run=False):
+    """
+    See `Client.sync_tables`
+    """
+    plan = plan_table_sync(desired_tables, client.get_tables(schema=schema))
+    report = TableSyncReport(plan)
+    if dry_run:
+        return report
+
+    def apply_action(action):
+        if action.action == TABLE_SYNC_CREATE:
+            return client.create_table(action.table_name, action.columns,
+                                       schema=schema)
+        return client.alter_table(action.table_name, action.columns,
+                                  schema=schema)
+
+    changes = report.changes
+    results = run_concurrently(apply_action, changes, max_workers)
+    report.results = [TableSyncResult(action, response, error)
+                      for action, (response, error) in zip(changes, results)]
+    return report
@@ -0,0 +1,212 @@
+"""
+Optional tracing of Client operations.
+
+When a Client is given a tracer, every public method call opens a span,
+and every HTTP request, 401 retry, login and sleep within it is a child
+span, so the time of a high level operation (e.g. create_input or
+clean_system) can be broken down.
+
+Tracers:
+    NoopTracer - the default, Client methods are not instrumented at all
+    RecordingTracer - keeps the spans in memory, `format()` prints them as
+                      an indented tree with durations
+    OpenTelemetryTracer - reports the spans to OpenTelemetry, requires the
+                          opentelemetry-api package
+
+Usage:
+    tracer = RecordingTracer()
+    api = alooma.Client(username, password, tracer=tracer)
+    api.clean_system()
+    print(tracer.format())
+"""
+import functools
+import inspect
+import threading
+import timeit
+
+try:
+    from opentelemetry import trace as opentelemetry_trace
+except ImportError:
+    opentelemetry_trace = None
+
+SPAN_HTTP = 'http.request'
+SPAN_RETRY = 'http.retry'
+SPAN_LOGIN = 'login'
+SPAN_SLEEP = 'sleep'
+
+
+class _NoopSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class NoopTracer(object):
+    enabled = False
+
+    def span(self, name, attributes=None):
+        return _NOOP_SPAN
+
+
+NOOP_TRACER = NoopTracer()
+
+
+class Span(object):
+    __slots__ = ('name', 'parent', 'attributes', 'start', 'end', 'error',
+                 '_tracer')
+
+    def __init__(self, tracer, name, parent, attributes):
+        self._tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.start = None
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        self._tracer._push(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = timeit.default_timer()
+        if exc_value is not None:
+            self.error = repr(exc_value)
+        self._tracer._pop(self)
+        return False
+
+
+class RecordingTracer(object):
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, span):
+        self._stack().append(span)
+        with self._lock:
+            self.spans.append(span)
+
+    def _pop(self, span):
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+
+    def span(self, name, attributes=None):
+        stack = self._stack()
+        return Span(self, name, stack[-1] if stack else None, attributes)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+    def children(self, span):
+        """
+        :param span: a Span, or None for the root spans
+        """
+        with self._lock:
+            return [child for child in self.spans if child.parent is span]
+
+    def totals(self):
+        """
+        :return: a dict from span name to (count, total seconds)
+        """
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            count, seconds = totals.get(span.name, (0, 0.0))
+            totals[span.name] = (count + 1, seconds + (span.duration or 0))
+        return totals
+
+    def format(self):
+        """
+        :return: the spans as an indented tree, one span per line
+        """
+        lines = []
+
+        def add(span, depth):
+            attributes = ' '.join('%s=%s' % item for item
+                                  in sorted(span.attributes.items()))
+            lines.append('{indent}{name} {duration:.1f}ms {attributes}{error}'
+                         .format(indent='  ' * depth, name=span.name,
+                                 duration=(span.duration or 0) * 1000,
+                                 attributes=attributes,
+                                 error=' error=' + span.error
+                                 if span.error else '').rstrip())
+            for child in self.children(span):
+                add(child, depth + 1)
+
+        for root in self.children(None):
+            add(root, 0)
+        return '\n'.join(lines)
+
+
+class OpenTelemetryTracer(object):
+    enabled = True
+
+    def __init__(self, tracer=None):
+        """
+        :param tracer: optional opentelemetry Tracer, defaults to the
+                       global tracer provider's 'alooma' tracer
+        """
+        if tracer is None:
+            if opentelemetry_trace is None:
+                raise Exception('OpenTelemetryTracer requires the '
+                                'opentelemetry-api package')
+            tracer = opentelemetry_trace.get_tracer('alooma')
+        self.tracer = tracer
+
+    def span(self, name, attributes=None):
+        return self.tracer.start_as_current_span(name,
+                                                 attributes=attributes)
+
+
+def _traced(tracer, name, method):
+    @functools.wraps(method)
+    def traced(*args, **kwargs):
+        with tracer.span(name):
+            return method(*args, **kwargs)
+    return traced
+
+
+def instrument(obj, tracer, prefix=None):
+    """
+    Wraps every public method of obj, on the instance only, so that each
+    call opens a span named <prefix>.<method name>
+    :param prefix: the span name prefix, defaults to the class name
+    """
+    prefix = prefix or type(obj).__name__
+    for name, _ in inspect.getmembers(type(obj), callable):
+        if name.startswith('_'):
+            continue
+        setattr(obj, name, _traced(tracer, '%s.%s' % (prefix, name),
+                                   getattr(obj, name)))
@@ -0,0 +1,310 @@
+"""
+Record and replay of Client traffic, for offline and repeatable runs.
+
+A recording session sends requests as usual and keeps every request and
+response pair. When the session is closed (or `save` is called) the pairs
+are written to a gzipped JSON lines archive. Credentials are never
+written: cookies and authorization headers are dropped, and the values of
+password, secret, token and access key fields are redacted from JSON
+bodies.
+
+A replay session answers requests from an archive without any network
+access. Requests are matched by method, normalized URL (path and sorted
+query, without the host) and a hash of the redacted body. Identical
+requests are answered in the recorded order, so a 401 followed by a login
+replays the same way. Responses are returned immediately, after the
+recorded time, or after a scaled recorded time.
+
+Usage:
+    client = Client(username, password, session=recording_session(path))
+    client.test_transform_all_samples()
+    client.session.close()
+
+    client = Client(username, password, session=replay_session(path))
+"""
+import base64
+import collections
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+import timeit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from six.moves.urllib.parse import parse_qsl, urlencode, urlsplit
+
+ARCHIVE_VERSION = 1
+
+TIMING_NONE = 'none'
+TIMING_ORIGINAL = 'original'
+TIMING_SCALED = 'scaled'
+TIMING_MODES = [TIMING_NONE, TIMING_ORIGINAL, TIMING_SCALED]
+
+REDACTED = '<redacted>'
+REDACTED_KEY_PATTERN = re.compile(
+    r'password|passwd|secret|token|api_?key|access_?key|private_?key|'
+    r'credential', re.IGNORECASE)
+
+# response headers worth keeping, the rest (cookies included) are dropped
+RECORDED_HEADERS = ['Content-Type']
+
+
+class ReplayMismatchException(Exception):
+    pass
+
+
+def redact(value):
+    """
+    :return: a copy of a JSON value, with the values of credential keys
+             (see REDACTED_KEY_PATTERN) replaced by REDACTED
+    """
+    if isinstance(value, dict):
+        return {key: REDACTED if REDACTED_KEY_PATTERN.search(key) and
+                value[key] not in (None, '') else redact(value[key])
+                for key in value}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def _parse_json(content):
+    if not content:
+        return None
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
+
+
+def normalize_url(url):
+    """
+    :return: the URL's path and sorted query, without the scheme and host,
+             so archives replay against any base URL
+    """
+    parts = urlsplit(url)
+    path = re.sub(r'/+', '/', parts.path).rstrip('/') or '/'
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True))
+    return path + ('?' + urlencode(query) if query else '')
+
+
+def body_hash(url, body):
+    """
+    :return: a short hash of the redacted request body, None without a
+             body. Login bodies hold nothing but credentials and are not
+             hashed at all
+    """
+    if not body or urlsplit(url).path.rstrip('/').endswith('/login'):
+        return None
+    parsed = _parse_json(body)
+    if parsed is not None:
+        body = json.dumps(redact(parsed), sort_keys=True)
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    return hashlib.sha256(body).hexdigest()[:16]
+
+
+def request_key(method, url, body):
+    return method.upper(), normalize_url(url), body_hash(url, body)
+
+
+class TrafficArchive(object):
+    def __init__(self, path):
+        """
+        :param path: the archive file, gzipped JSON lines
+        """
+        self.path = path
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def add(self, request, response, duration):
+        """
+        Adds a redacted request and response pair
+        :param duration: seconds the response took
+        """
+        content = response.content
+        parsed = _parse_json(content)
+        if parsed is not None:
+            body = json.dumps(redact(parsed), separators=(',', ':'))
+            encoding = 'json'
+        elif not content:
+            body, encoding = '', 'text'
+        else:
+            body = base64.b64encode(content).decode('ascii')
+            encoding = 'base64'
+        method, url, digest = request_key(request.method, request.url,
+                                          request.body)
+        entry = {
+            'method': method, 'url': url, 'body_hash': digest,
+            'status': response.status_code, 'reason': response.reason,
+            'headers': {name: response.headers[name]
+                        for name in RECORDED_HEADERS
+                        if name in response.headers},
+            'body': body, 'encoding': encoding,
+            'duration': round(duration, 6)
+        }
+        with self._lock:
+            self.entries.append(entry)
+
+    def save(self):
+        with self._lock:
+            entries = list(self.entries)
+        with gzip.open(self.path, 'wb') as f:
+            header = {'version': ARCHIVE_VERSION, 'recorded_at': time.time(),
+                      'entries': len(entries)}
+            f.write((json.dumps(header) + '\n').encode('utf-8'))
+            for entry in entries:
+                f.write((json.dumps(entry, separators=(',', ':')) + '\n')
+                        .encode('utf-8'))
+
+    def load(self):
+        with gzip.open(self.path, 'rb') as f:
+            lines = f.read().decode('utf-8').splitlines()
+        header = json.loads(lines[0])
+        if header.get('version') != ARCHIVE_VERSION:
+            raise Exception("Unsupported traffic archive version: {version}"
+                            .format(version=header.get('version')))
+        with self._lock:
+            self.entries = [json.loads(line) for line in lines[1:] if line]
+        return self
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, archive, **kwargs):
+        """
+        Sends requests like HTTPAdapter and records them in the archive,
+        which is saved when the adapter is closed
+        :param archive: a TrafficArchive
+        """
+        super(RecordingAdapter, self).__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        start = timeit.default_timer()
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        response.content  # read the body within the timing
+        self.archive.add(request, response,
+                         timeit.default_timer() - start)
+        return response
+
+    def close(self):
+        super(RecordingAdapter, self).close()
+        self.archive.save()
+
+
+class ReplayAdapter(HTTPAdapter):
+    def __init__(self, archive, timing=TIMING_NONE, scale=1.0,
+                 strict=True):
+        """
+        Answers requests from an archive, without any network access
+        :param archive: a loaded TrafficArchive
+        :param timing: one of TIMING_MODES, whether to answer immediately,
+                       after the recorded duration, or after the recorded
+                       duration multiplied by scale
+        :param scale: the duration multiplier of TIMING_SCALED
+        :param strict: if False, a request with no exact match is answered
+                       by a recorded request with the same method and path
+                       (e.g. with a different time range), instead of
+                       raising ReplayMismatchException
+        """
+        super(ReplayAdapter, self).__init__()
+        if timing not in TIMING_MODES:
+            raise Exception("timing must be one of {modes}"
+                            .format(modes=TIMING_MODES))
+        self.timing = timing
+        self.scale = scale
+        self.strict = strict
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._by_key = collections.OrderedDict()
+        self._by_path = collections.OrderedDict()
+        for entry in archive.entries:
+            key = (entry['method'], entry['url'], entry['body_hash'])
+            self._by_key.setdefault(key, collections.deque()).append(entry)
+            path_key = (entry['method'], entry['url'].split('?')[0])
+            self._by_path.setdefault(path_key, collections.deque()).append(
+                entry)
+
+    @staticmethod
+    def _next(entries):
+        """ Entries are answered in order, the last one repeatedly """
+        return entries.popleft() if len(entries) > 1 else entries[0]
+
+    def _match(self, request):
+        key = request_key(request.method, request.url, request.body)
+        with self._lock:
+            entries = self._by_key.get(key)
+            if entries is None and not self.strict:
+                entries = self._by_path.get((key[0], key[1].split('?')[0]))
+            if entries is None:
+                self.misses += 1
+                raise ReplayMismatchException(
+                    "No recorded response for {method} {url}"
+                    .format(method=key[0], url=key[1]))
+            self.hits += 1
+            return self._next(entries)
+
+    def delay(self, entry):
+        if self.timing == TIMING_ORIGINAL:
+            return entry['duration']
+        if self.timing == TIMING_SCALED:
+            return entry['duration'] * self.scale
+        return 0
+
+    def send(self, request, **kwargs):
+        entry = self._match(request)
+        delay = self.delay(entry)
+        if delay > 0:
+            time.sleep(delay)
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = 'utf-8'
+        if entry['encoding'] == 'base64':
+            response._content = base64.b64decode(entry['body'])
+        else:
+            response._content = entry['body'].encode('utf-8')
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+
+def _mount(session, adapter):
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def recording_session(path, session=None):
+    """
+    :param path: the archive file to write when the session is closed
+    :param session: optional requests.Session to record, defaults to a new
+                    session
+    :return: a requests.Session for Client's session argument
+    """
+    return _mount(session or requests.Session(),
+                  RecordingAdapter(TrafficArchive(path)))
+
+
+def replay_session(path, timing=TIMING_NONE, scale=1.0, strict=True):
+    """
+    :param path: an archive written by a recording session
+    :return: a requests.Session for Client's session argument, replaying
+             the archive, see ReplayAdapter for the arguments
+    """
+    archive = TrafficArchive(path).load()
+    return _mount(requests.Session(),
+                  ReplayAdapter(archive, timing=timing, scale=scale,
+                                strict=strict))
@@ -0,0 +1,109 @@
+"""
+The memory held by structure snapshots, mappings and tables, as the
+API's plain dicts and as the compact alooma.models.
+
+Every snapshot is parsed from its own JSON text, like the responses of
+repeated Client calls, so nothing is shared between snapshots except by
+the models' interning.
+
+Usage, from the repository root:
+    python -m benchmarks.memory --snapshots 10 --nodes 10000
+
+The lazy fields and columns are parsed, to measure the models as after
+walking them. The reported ratio is dicts / models.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from alooma.models import EventType, Table, nodes_from_structure
+
+from .mock_server import MockAloomaServer
+
+
+def _parse_event_type(text):
+    event_type = EventType.from_dict(json.loads(text))
+    # parse the lazy fields, to measure the fully parsed form
+    for field in event_type.fields:
+        field.fields
+    return event_type
+
+
+def _parse_tables(text):
+    tables = [Table.from_dict(table) for table in json.loads(text)]
+    for table in tables:
+        table.columns
+    return tables
+
+
+CASES = [
+    ('structure',
+     lambda mock: json.dumps(mock.structure),
+     lambda text: json.loads(text)['nodes'],
+     lambda text: nodes_from_structure(json.loads(text))),
+    ('mapping',
+     lambda mock: json.dumps(mock.event_types['event_type_0']),
+     json.loads,
+     _parse_event_type),
+    ('tables',
+     lambda mock: json.dumps(mock.tables),
+     json.loads,
+     _parse_tables),
+]
+
+
+def measure(func, texts):
+    """
+    :return: the bytes held by the results of func on every text
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        results = [func(text) for text in texts]
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del results
+    return held
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Compare the memory of dicts and compact models')
+    parser.add_argument('--snapshots', type=int, default=10,
+                        help='the number of copies of every payload held')
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--mapping-fields', type=int, default=10000)
+    parser.add_argument('--tables', type=int, default=100)
+    parser.add_argument('--columns', type=int, default=100)
+    args = parser.parse_args(args)
+    if tracemalloc is None:
+        print('tracemalloc is required (python 3.4+)', file=sys.stderr)
+        return 1
+
+    mock = MockAloomaServer(nodes=args.nodes, event_types=1,
+                            mapping_fields=args.mapping_fields,
+                            tables=args.tables, columns=args.columns)
+    print('{:<10} {:>14} {:>14} {:>7}'.format('payload', 'dicts (bytes)',
+                                              'models (bytes)', 'ratio'))
+    for name, encode, as_dicts, as_models in CASES:
+        texts = [encode(mock)] * args.snapshots
+        dicts = measure(as_dicts, texts)
+        models = measure(as_models, texts)
+        print('{:<10} {:>14,} {:>14,} {:>7.2f}'.format(
+            name, dicts, models, float(dicts) / models))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
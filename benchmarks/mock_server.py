@@ -0,0 +1,419 @@
+"""
+A local stand-in for the Alooma REST API, serving generated data at a
+configurable scale and latency, for benchmarking the Client offline.
+
+It implements the endpoints the benchmarks use: login, repository,
+plumbing, event-types, metrics, transform/functions (including run),
+tables, samples, config/export, inputSleepTime, deployInfo and
+zk-configuration. Sessions are cookie based like the real API, and may
+be expired on demand or after a TTL to exercise the client's re-login.
+
+Usage:
+    with MockAloomaServer(nodes=1000, mapping_fields=10000) as server:
+        client = alooma.Client('user', 'password', base_url=server.url)
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+SESSION_COOKIE = 'alooma_session'
+
+_REST_PATH = re.compile(r'^(?:/[^/]+)?/rest/(.*)$')
+
+
+def _dumps(value):
+    return json.dumps(value).encode('utf-8')
+
+
+def _minutes(value):
+    """ '-60min' -> 60 """
+    return int(re.sub(r'\D', '', value) or 1)
+
+
+class MockAloomaServer(object):
+    def __init__(self, latency=0.0, nodes=10, event_types=10,
+                 mapping_fields=100, tables=10, columns=20, samples=10,
+                 session_ttl=None, login_latency=0.0, etags=False,
+                 port=0):
+        """
+        :param latency: seconds added to every response
+        :param nodes: the number of input nodes in the structure
+        :param event_types: the number of event types
+        :param mapping_fields: the number of fields in each mapping
+        :param tables: the number of tables in the default schema
+        :param columns: the number of columns in each table
+        :param samples: the number of samples per event type
+        :param session_ttl: optional seconds after which sessions expire
+        :param login_latency: seconds added to login responses
+        :param etags: if True, GET responses carry an ETag, and requests
+                      with a matching If-None-Match get 304 Not Modified
+        :param port: the port to listen on, 0 picks a free port
+        """
+        self.latency = latency
+        self.session_ttl = session_ttl
+        self.login_latency = login_latency
+        self.etags = etags
+        self.not_modified_count = 0
+        self.port = port
+
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.login_count = 0
+        self.request_counts = {}
+        self._server = None
+        self._thread = None
+
+        self.structure = {'nodes': self._generate_nodes(nodes)}
+        self.event_types = {}
+        for index in range(event_types):
+            name = 'event_type_%d' % index
+            self.event_types[name] = self._generate_event_type(
+                name, mapping_fields)
+        self.tables = [self._generate_table('table_%d' % index, columns)
+                       for index in range(tables)]
+        self.samples = [{'sample': {'id': index, 'value': 'v%d' % index}}
+                        for index in range(samples)]
+        self.sleep_times = {}
+        self.deploy_info = {'version': '0.5.20', 'deploymentName': 'mock'}
+        self.feature_flags = {'featureUseBigQueryNewConnectConfiguration': {
+            'featureUseBigQueryNewLoginConfiguration': True}}
+        self.transforms = {'main': 'def transform(event):\n'
+                                   '\treturn event'}
+        self._encode()
+
+    @staticmethod
+    def _generate_nodes(count):
+        nodes = [
+            {'id': 'restream', 'name': 'Restream', 'type': 'RESTREAM',
+             'category': 'INPUT', 'deleted': False, 'configuration': {},
+             'stats': {'availbleForRestream': 1000,
+                       'currentQueueSize': 10 ** 6,
+                       'maxQueueSize': 10 ** 8, 'throughput': 0}},
+            {'id': 'code-engine', 'name': 'Code Engine',
+             'type': 'TRANSFORMER', 'category': 'PROCESSOR',
+             'deleted': False, 'configuration': {},
+             'stats': {'throughput': 100}},
+            {'id': 'output', 'name': 'Redshift', 'type': 'REDSHIFT',
+             'category': 'OUTPUT', 'deleted': False,
+             'configuration': {'hostname': 'redshift.local', 'port': 5439},
+             'stats': {'throughput': 100}}
+        ]
+        for index in range(count):
+            nodes.append({
+                'id': 'input-%d' % index, 'name': 'input_%d' % index,
+                'type': 'MYSQL', 'category': 'INPUT', 'deleted': False,
+                'configuration': {'hostname': 'db-%d.local' % index,
+                                  'port': 3306, 'tables': 'a b c'},
+                'stats': {'throughput': index % 100,
+                          'latency': index % 7}})
+        return nodes
+
+    @staticmethod
+    def _generate_event_type(name, field_count):
+        fields = []
+        for index in range(field_count):
+            fields.append({
+                'fieldName': 'field_%d' % index,
+                'fields': [],
+                'mapping': {
+                    'columnName': 'field_%d' % index,
+                    'columnType': {'type': 'VARCHAR', 'length': 256,
+                                   'nonNull': False},
+                    'isDiscarded': False},
+                'stats': {'count': index, 'sample': 'value_%d' % index}})
+        return {'name': name, 'mappingMode': 'STRICT',
+                'origInputLabel': 'input_0',
+                'mapping': {'isDiscarded': False, 'tableName': name,
+                            'schema': 'public'},
+                'fields': fields, 'stats': {}}
+
+    @staticmethod
+    def _generate_table(name, column_count):
+        return {'tableName': name, 'schema': 'public', 'columns': [
+            {'columnName': 'column_%d' % index, 'distKey': False,
+             'primaryKey': False, 'sortKeyIndex': -1,
+             'columnType': {'type': 'VARCHAR', 'length': 256,
+                            'nonNull': False}}
+            for index in range(column_count)]}
+
+    def _encode(self):
+        """ Pre-encodes the static bodies so the server is not the
+        bottleneck of the benchmarks """
+        self.bodies = {
+            'repository': _dumps({'config_clientName': 'benchmark'}),
+            'plumbing': _dumps(self.structure),
+            'topology': _dumps({'nodes': [
+                {key: value for key, value in node.items()
+                 if key != 'stats'}
+                for node in self.structure['nodes']]}),
+            'outputs': _dumps([node for node in self.structure['nodes']
+                               if node['category'] == 'OUTPUT']),
+            'event-types': _dumps([
+                {'name': name, 'mappingMode': event_type['mappingMode'],
+                 'mapping': event_type['mapping']}
+                for name, event_type in self.event_types.items()]),
+            'tables': _dumps(self.tables),
+            'tables-shallow': _dumps([{'tableName': table['tableName'],
+                                       'schema': table['schema']}
+                                      for table in self.tables]),
+            'samples': _dumps(self.samples),
+            'samples-stats': _dumps({name: {'OK': len(self.samples)}
+                                     for name in self.event_types}),
+        }
+        self.event_type_bodies = {name: _dumps(event_type)
+                                  for name, event_type
+                                  in self.event_types.items()}
+        self.bodies['config'] = _dumps({
+            'inputs': [node for node in self.structure['nodes']
+                       if node['category'] == 'INPUT'],
+            'mappings': self.event_types,
+            'transforms': self.transforms,
+            'settings': {'emailNotifications': {}}})
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.port
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', self.port),
+                                            _RequestHandler)
+        self._server.mock = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def expire_sessions(self):
+        """ Invalidates every session, the next requests get 401 """
+        with self.lock:
+            self.sessions.clear()
+
+    def reset_counts(self):
+        with self.lock:
+            self.login_count = 0
+            self.request_counts = {}
+            self.not_modified_count = 0
+
+    def _count(self, endpoint):
+        with self.lock:
+            self.request_counts[endpoint] = \
+                self.request_counts.get(endpoint, 0) + 1
+
+    def login(self):
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.login_count += 1
+            self.sessions[session_id] = time.time()
+        return session_id
+
+    def is_authenticated(self, cookie_header):
+        match = re.search(SESSION_COOKIE + r'=(\w+)', cookie_header or '')
+        if not match:
+            return False
+        with self.lock:
+            created = self.sessions.get(match.group(1))
+        if created is None:
+            return False
+        return self.session_ttl is None or \
+            time.time() - created < self.session_ttl
+
+    @staticmethod
+    def metrics(names, minutes, resolution):
+        """ One datapoint per resolution in the window, every tenth one
+        missing like in the real API """
+        now = int(time.time()) // 60 * 60
+        points = max(minutes // resolution, 1)
+        return _dumps([
+            {'target': name, 'datapoints': [
+                [None if index % 10 == 9 else float(index % 13),
+                 now - 60 * resolution * (points - index)]
+                for index in range(points)]}
+            for name in names])
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, without this every
+    # keep-alive response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, body=b'{}', headers=None):
+        mock = self.server.mock
+        if mock.etags and status == 200 and self.command == 'GET':
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                with mock.lock:
+                    mock.not_modified_count += 1
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            headers = dict(headers or {}, ETag=etag)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        mock = self.server.mock
+        body = self._read_body()
+        if mock.latency:
+            time.sleep(mock.latency)
+
+        parsed = urlparse(self.path)
+        match = _REST_PATH.match(parsed.path)
+        if not match:
+            return self._send(404, _dumps({'error': 'not found'}))
+        path = match.group(1).rstrip('/')
+        query = parse_qs(parsed.query)
+        endpoint = path.split('/')[0]
+        mock._count(endpoint)
+
+        if path == 'login':
+            if mock.login_latency:
+                time.sleep(mock.login_latency)
+            session_id = mock.login()
+            return self._send(200, headers={
+                'Set-Cookie': '%s=%s; Path=/' % (SESSION_COOKIE,
+                                                 session_id)})
+        if not mock.is_authenticated(self.headers.get('Cookie')):
+            return self._send(401, _dumps({'error': 'unauthorized'}))
+
+        handler = getattr(self, '_' + endpoint.replace('-', '_'), None)
+        if handler is None:
+            return self._send(404, _dumps({'error': 'not found'}))
+        return handler(method, path, query, body)
+
+    def _repository(self, method, path, query, body):
+        self._send(200, self.server.mock.bodies['repository'])
+
+    def _plumbing(self, method, path, query, body):
+        mock = self.server.mock
+        if path == 'plumbing/outputs':
+            return self._send(200, mock.bodies['outputs'])
+        if method != 'GET':
+            return self._send(200)
+        if 'resolution' not in query:
+            # stats come with a resolution only
+            return self._send(200, mock.bodies['topology'])
+        self._send(200, mock.bodies['plumbing'])
+
+    def _event_types(self, method, path, query, body):
+        mock = self.server.mock
+        parts = path.split('/')
+        if len(parts) == 1:
+            return self._send(200, mock.bodies['event-types'])
+        if method != 'GET':
+            return self._send(200)
+        event_type = mock.event_type_bodies.get(parts[1])
+        if event_type is None:
+            return self._send(404, _dumps({'error': 'no such event type'}))
+        self._send(200, event_type)
+
+    def _metrics(self, method, path, query, body):
+        names = query.get('metrics', [''])[0].split(',')
+        minutes = _minutes(query.get('from', ['-60min'])[0])
+        resolution = _minutes(query.get('resolution', ['1min'])[0])
+        self._send(200, self.server.mock.metrics(names, minutes, resolution))
+
+    def _transform(self, method, path, query, body):
+        mock = self.server.mock
+        if path == 'transform/functions/run':
+            request = json.loads(body.decode('utf-8'))
+            return self._send(200, _dumps({'result': request['sample'],
+                                           'output': '', 'runtime': 1}))
+        if path == 'transform/functions':
+            return self._send(200, _dumps([
+                {'functionName': name, 'code': code}
+                for name, code in mock.transforms.items()]))
+        name = path.split('/')[-1]
+        if method != 'GET':
+            return self._send(200)
+        if name not in mock.transforms:
+            return self._send(404, _dumps({'error': 'no such module'}))
+        self._send(200, _dumps({'functionName': name,
+                                'code': mock.transforms[name]}))
+
+    def _tables(self, method, path, query, body):
+        mock = self.server.mock
+        if method != 'GET':
+            return self._send(200)
+        if 'shallow' in query:
+            return self._send(200, mock.bodies['tables-shallow'])
+        self._send(200, mock.bodies['tables'])
+
+    def _samples(self, method, path, query, body):
+        mock = self.server.mock
+        if path == 'samples/stats':
+            return self._send(200, mock.bodies['samples-stats'])
+        self._send(200, mock.bodies['samples'])
+
+    def _config(self, method, path, query, body):
+        self._send(200, self.server.mock.bodies['config'])
+
+    def _deployInfo(self, method, path, query, body):
+        self._send(200, _dumps(self.server.mock.deploy_info))
+
+    def _zk_configuration(self, method, path, query, body):
+        flag = self.server.mock.feature_flags.get(path.split('/', 1)[-1])
+        if flag is None:
+            return self._send(404, _dumps({'error': 'no such flag'}))
+        self._send(200, _dumps(flag))
+
+    def _inputSleepTime(self, method, path, query, body):
+        mock = self.server.mock
+        input_id = path.split('/', 1)[-1]
+        with mock.lock:
+            if method == 'PUT':
+                mock.sleep_times[input_id] = json.loads(body.decode('utf-8'))
+            sleep_time = mock.sleep_times.get(input_id, 60.0)
+        self._send(200, _dumps({'inputSleepTime': sleep_time}))
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
@@ -0,0 +1,326 @@
+"""
+Benchmarks of the key Client operations against a local mock Alooma
+server (see mock_server.py), at several scales.
+
+Every benchmark case starts a mock server with the case's payload sizes,
+logs a Client into it, and times repeated calls of one operation. The
+results, with the number of requests each call sent, can be saved as
+JSON and compared with the results of another commit.
+
+Usage, from the repository root:
+    python -m benchmarks.run --output before.json
+    ... change the code ...
+    python -m benchmarks.run --output after.json --compare before.json
+
+Options worth knowing: --quick runs only the smaller scales, --filter
+selects benchmarks by a regex and --latency adds a delay to every mock
+response. The exit status is 1 when --compare finds a regression.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import platform
+import re
+import subprocess
+import sys
+import time
+import timeit
+
+import alooma
+
+from .mock_server import MockAloomaServer
+
+DEFAULT_MIN_ITERATIONS = 3
+DEFAULT_MAX_ITERATIONS = 50
+DEFAULT_MAX_SECONDS = 2.0
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+
+USERNAME = 'benchmark@alooma.local'
+PASSWORD = 'benchmark'
+
+
+class Benchmark(object):
+    def __init__(self, name, param, scales, func, setup=None,
+                 server_kwargs=None, quick_scales=2):
+        """
+        :param name: the benchmark name
+        :param param: the MockAloomaServer argument (or benchmark argument)
+                      the scales apply to
+        :param scales: the values of param to run the benchmark at
+        :param func: a function of (client, context) running the operation
+        :param setup: optional function of (client, server, scale)
+                      returning the context, called before the timing
+        :param server_kwargs: fixed MockAloomaServer arguments
+        :param quick_scales: the number of scales to run with --quick
+        """
+        self.name = name
+        self.param = param
+        self.scales = scales
+        self.func = func
+        self.setup = setup
+        self.server_kwargs = server_kwargs or {}
+        self.quick_scales = quick_scales
+
+    def server_arguments(self, scale):
+        kwargs = dict(self.server_kwargs)
+        if self.param in _SERVER_PARAMS:
+            kwargs[self.param] = scale
+        return kwargs
+
+
+_SERVER_PARAMS = ['nodes', 'event_types', 'mapping_fields', 'tables',
+                  'columns', 'samples']
+
+
+def _first_event_type(client, server, scale):
+    return sorted(server.event_types)[0]
+
+
+def _mapping_of_first_event_type(client, server, scale):
+    event_type = _first_event_type(client, server, scale)
+    return event_type, client.get_mapping(event_type)
+
+
+def _server_url(client, server, scale):
+    return server.url
+
+
+def _scale(client, server, scale):
+    return scale
+
+
+BENCHMARKS = [
+    Benchmark('login', 'nodes', [10],
+              lambda client, url: alooma.Client(USERNAME, PASSWORD,
+                                                base_url=url),
+              setup=_server_url, quick_scales=1),
+    Benchmark('get_structure', 'nodes', [10, 100, 1000, 10000],
+              lambda client, _: client.get_structure()),
+    Benchmark('get_inputs', 'nodes', [10, 100, 1000, 10000],
+              lambda client, _: client.get_inputs(input_type='MYSQL')),
+    Benchmark('get_topology', 'nodes', [10, 100, 1000, 10000],
+              lambda client, _: client.get_topology(refresh=True)),
+    Benchmark('get_node_stats', 'nodes', [10, 100, 1000, 10000],
+              lambda client, _: client.get_node_stats()),
+    Benchmark('get_restream_queue_size', 'nodes', [10, 100, 1000, 10000],
+              lambda client, _: client.get_restream_queue_size()),
+    Benchmark('get_metrics_snapshot', 'minutes', [60, 1440, 10080],
+              lambda client, minutes: client.get_metrics_snapshot(minutes),
+              setup=_scale),
+    Benchmark('get_event_types', 'event_types', [10, 100, 1000],
+              lambda client, _: client.get_event_types(),
+              server_kwargs={'mapping_fields': 10}),
+    Benchmark('get_mapping', 'mapping_fields', [100, 1000, 10000, 100000],
+              lambda client, name: client.get_mapping(name),
+              setup=_first_event_type, server_kwargs={'event_types': 1}),
+    Benchmark('set_mapping', 'mapping_fields', [100, 1000, 10000, 100000],
+              lambda client, context: client.set_mapping(context[1],
+                                                         context[0]),
+              setup=_mapping_of_first_event_type,
+              server_kwargs={'event_types': 1}),
+    Benchmark('get_config', 'mapping_fields', [100, 1000, 10000],
+              lambda client, _: client.get_config(),
+              server_kwargs={'event_types': 10, 'nodes': 100}),
+    Benchmark('get_tables', 'tables', [10, 100, 1000],
+              lambda client, _: client.get_tables()),
+    Benchmark('test_transform_all_samples', 'samples', [10, 50],
+              lambda client, _: client.test_transform_all_samples(),
+              server_kwargs={'event_types': 2}, quick_scales=1),
+]
+
+
+def percentile(sorted_values, q):
+    """
+    :return: the q-th percentile of the sorted values, interpolated
+    """
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    position = (len(sorted_values) - 1) * q / 100.0
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + \
+        (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(durations):
+    durations = sorted(durations)
+    mean = sum(durations) / len(durations)
+    variance = sum((d - mean) ** 2 for d in durations) / len(durations)
+    return {
+        'iterations': len(durations),
+        'min': durations[0],
+        'max': durations[-1],
+        'mean': mean,
+        'median': percentile(durations, 50),
+        'p95': percentile(durations, 95),
+        'stdev': math.sqrt(variance),
+        'ops_per_sec': 1.0 / mean if mean else None,
+    }
+
+
+def run_case(benchmark, scale, latency=0.0,
+             min_iterations=DEFAULT_MIN_ITERATIONS,
+             max_iterations=DEFAULT_MAX_ITERATIONS,
+             max_seconds=DEFAULT_MAX_SECONDS):
+    """
+    Runs one benchmark at one scale, after one untimed warm up call
+    :return: a result dict
+    """
+    with MockAloomaServer(latency=latency,
+                          **benchmark.server_arguments(scale)) as server:
+        client = alooma.Client(USERNAME, PASSWORD, base_url=server.url)
+        context = benchmark.setup(client, server, scale) \
+            if benchmark.setup else None
+        benchmark.func(client, context)
+
+        server.reset_counts()
+        durations = []
+        started = timeit.default_timer()
+        while len(durations) < max_iterations:
+            start = timeit.default_timer()
+            benchmark.func(client, context)
+            durations.append(timeit.default_timer() - start)
+            if len(durations) >= min_iterations and \
+                    timeit.default_timer() - started > max_seconds:
+                break
+        requests = sum(server.request_counts.values())
+
+    result = {'benchmark': benchmark.name, 'param': benchmark.param,
+              'scale': scale,
+              'requests_per_op': float(requests) / len(durations)}
+    result.update(summarize(durations))
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(benchmarks, quick=False, **kwargs):
+    """
+    :return: the results document, the metadata and a list of results
+    """
+    results = []
+    for benchmark in benchmarks:
+        scales = benchmark.scales[:benchmark.quick_scales] if quick \
+            else benchmark.scales
+        for scale in scales:
+            result = run_case(benchmark, scale, **kwargs)
+            print_result(result)
+            results.append(result)
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': quick,
+            'latency': kwargs.get('latency', 0.0),
+        },
+        'results': results
+    }
+
+
+def _case_key(result):
+    return result['benchmark'], result['param'], result['scale']
+
+
+def print_result(result):
+    print('{name:<28} {param:>14}={scale:<7} median {median:9.2f}ms  '
+          'p95 {p95:9.2f}ms  {ops:9.1f} ops/s  {requests:5.1f} req/op'
+          .format(name=result['benchmark'], param=result['param'],
+                  scale=result['scale'], median=result['median'] * 1000,
+                  p95=result['p95'] * 1000, ops=result['ops_per_sec'] or 0,
+                  requests=result['requests_per_op']))
+    sys.stdout.flush()
+
+
+def compare(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    Compares the median durations of the cases both documents ran
+    :param threshold: the relative slowdown considered a regression
+    :return: a list of (case key, baseline median, current median, ratio,
+             regressed) tuples
+    """
+    baseline_results = {_case_key(result): result
+                        for result in baseline['results']}
+    comparison = []
+    for result in current['results']:
+        old = baseline_results.get(_case_key(result))
+        if old is None:
+            continue
+        ratio = result['median'] / old['median'] if old['median'] else None
+        regressed = ratio is not None and ratio > 1 + threshold
+        comparison.append((_case_key(result), old['median'],
+                           result['median'], ratio, regressed))
+    return comparison
+
+
+def print_comparison(comparison):
+    for (name, param, scale), old, new, ratio, regressed in comparison:
+        print('{name:<28} {param:>14}={scale:<7} {old:9.2f}ms -> '
+              '{new:9.2f}ms  x{ratio:5.2f}{flag}'
+              .format(name=name, param=param, scale=scale,
+                      old=old * 1000, new=new * 1000, ratio=ratio or 0,
+                      flag='  REGRESSION' if regressed else ''))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the alooma Client against a local mock '
+                    'server')
+    parser.add_argument('--output', help='a JSON file to save results to')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='a JSON results file to compare against')
+    parser.add_argument('--threshold', type=float,
+                        default=DEFAULT_REGRESSION_THRESHOLD,
+                        help='the relative slowdown reported as a '
+                             'regression (default: %(default)s)')
+    parser.add_argument('--filter', help='a regex of benchmarks to run')
+    parser.add_argument('--quick', action='store_true',
+                        help='run only the smaller scales')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every mock response')
+    parser.add_argument('--min-iterations', type=int,
+                        default=DEFAULT_MIN_ITERATIONS)
+    parser.add_argument('--max-iterations', type=int,
+                        default=DEFAULT_MAX_ITERATIONS)
+    parser.add_argument('--max-seconds', type=float,
+                        default=DEFAULT_MAX_SECONDS,
+                        help='the time budget of every case, once it ran '
+                             'min-iterations times')
+    args = parser.parse_args(args)
+
+    benchmarks = BENCHMARKS
+    if args.filter:
+        benchmarks = [benchmark for benchmark in benchmarks
+                      if re.search(args.filter, benchmark.name)]
+
+    document = run(benchmarks, quick=args.quick, latency=args.latency,
+                   min_iterations=args.min_iterations,
+                   max_iterations=args.max_iterations,
+                   max_seconds=args.max_seconds)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare(baseline, document, args.threshold)
+        print()
+        print_comparison(comparison)
+        if any(regressed for _, _, _, _, regressed in comparison):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+A stress test of a single Client shared by many threads, while the mock
+server keeps expiring its sessions.
+
+Every expiration makes the in-flight requests of all the threads fail
+with 401 at once. The Client must log in again once per expiration (not
+once per thread), and every call must still succeed.
+
+Usage, from the repository root:
+    python -m benchmarks.stress_relogin --threads 32 --expirations 10
+
+The exit status is 1 if any call failed or there were more logins than
+expirations.
+"""
+from __future__ import print_function
+
+import argparse
+import sys
+import threading
+import time
+
+import alooma
+
+from .mock_server import MockAloomaServer
+from .run import PASSWORD, USERNAME
+
+
+def stress(threads, expirations, interval, latency, login_latency):
+    """
+    :return: a dict of the calls, errors, logins and expirations counted
+    """
+    with MockAloomaServer(latency=latency,
+                          login_latency=login_latency) as server:
+        client = alooma.Client(USERNAME, PASSWORD, base_url=server.url)
+        server.reset_counts()
+        stop = threading.Event()
+        errors = []
+        calls = [0] * threads
+
+        def work(index):
+            while not stop.is_set():
+                try:
+                    client.get_structure()
+                except Exception as e:
+                    errors.append(e)
+                calls[index] += 1
+
+        workers = [threading.Thread(target=work, args=(index,))
+                   for index in range(threads)]
+        for worker in workers:
+            worker.start()
+        for _ in range(expirations):
+            time.sleep(interval)
+            server.expire_sessions()
+        time.sleep(interval)
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+        return {'threads': threads, 'calls': sum(calls),
+                'errors': len(errors), 'logins': server.login_count,
+                'expirations': expirations,
+                'first_error': repr(errors[0]) if errors else None}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Stress the re-login of a Client shared by threads')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--expirations', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between session expirations, keep it '
+                             'well above the duration of a call, a retry '
+                             'hitting the next expiration fails')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='seconds added to every mock response')
+    parser.add_argument('--login-latency', type=float, default=0.05,
+                        help='seconds added to mock logins')
+    args = parser.parse_args(args)
+
+    result = stress(args.threads, args.expirations, args.interval,
+                    args.latency, args.login_latency)
+    for key in sorted(result):
+        print('{key:<12} {value}'.format(key=key, value=result[key]))
+    failed = result['errors'] or result['logins'] > result['expirations']
+    print('FAILED' if failed else 'OK')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,7 +5,7 @@ install_reqs = parse_requirements("requirements.txt", session=False)
 
 reqs = [str(ir.req) for ir in install_reqs]
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='alooma',
       version='0.3.20',
@@ -14,5 +14,8 @@ setup(name='alooma',
       author_email='yonatan@alooma.io',
       packages=['alooma'],
       install_requires=reqs,
+      entry_points={
+          'console_scripts': ['alooma = alooma.cli:main']
+      },
       keywords=['alooma']
 )